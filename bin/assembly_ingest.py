@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""Ingest assemblies before an alignment, reading and writing each FASTA file once.
+
+Fixing the headers with fasta-header-fixer.py, indexing and summarising
+the assemblies with fasta_len.py, and finding them again with
+cactus_tree_prepare.py each read every assembly in full. Instead, this
+script streams each assembly once, in parallel, and in the same pass:
+    - keeps only the first word of each header, as fasta-header-fixer.py;
+    - writes the result, compressed with bgzip if the assembly was compressed;
+    - computes the MD5 checksum of the uncompressed result;
+    - counts what the `.fai` index (and `.gzi` index) and the statistics of
+      fasta_len.py need.
+
+Assemblies are fixed in place, or written to --output_dir. The statistics
+go to the cache of fasta_len.py, so that `fasta_len.py --assemblies_dirs`
+does not read them again, and a rerun skips the assemblies already ingested.
+One table is printed, a row per assembly.
+
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fasta_len
+
+# columns of the table printed
+COLUMNS = fasta_len.COLUMNS[:-1] + ["headers_fixed", "md5", "path"]
+
+
+def get_output_path(filename: str, output_dir: Optional[str], bgzip: bool) -> str:
+    """Get where an assembly is written, compressed assemblies ending with `.gz`."""
+    directory, basename = os.path.split(filename)
+    if bgzip and not basename.endswith(".gz"):
+        basename += ".gz"
+    return os.path.join(output_dir or directory, basename)
+
+
+def ingest_assembly(filename: str, output: str, bgzip: bool, compresslevel: int = 6) -> dict:
+    """Fix, index, checksum and summarise an assembly in one pass.
+
+    Args:
+        filename: Path of the FASTA file, plain or gzip-compressed.
+        output: Path of the fixed FASTA file, possibly `filename` itself.
+        bgzip: Whether to compress the fixed FASTA file with bgzip.
+        compresslevel: Compression level of the fixed FASTA file.
+
+    Returns:
+        The `stats` of fasta_len.py, the `md5` of the uncompressed fixed
+        FASTA file, and the `changes` of its headers.
+
+    """
+    directory, basename = os.path.split(os.path.abspath(output))
+    temporary = os.path.join(directory, ".{}.{}.tmp".format(basename, uuid.uuid4()))
+    checksum = hashlib.md5()
+    changes: List[Tuple[str, str]] = []
+
+    def write(blocks: Iterable[bytes], handle) -> Iterator[bytes]:
+        for block in blocks:
+            checksum.update(block)
+            handle.write(block)
+            yield block
+
+    try:
+        with fasta_len.open_fasta(filename) as fasta_file, open(temporary, "wb") as output_file:
+            writer = fasta_len.BgzfWriter(output_file, compresslevel) if bgzip else output_file
+            blocks = fasta_len.fix_headers(fasta_len.read_blocks(fasta_file), changes)
+            records = list(fasta_len.scan_fasta(write(blocks, writer), composition=True))
+            if bgzip:
+                writer.close()
+
+        shutil.copymode(filename, temporary)
+        os.replace(temporary, output)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    # compressed in place, as bgzip does
+    if output != filename and os.path.dirname(output) == os.path.dirname(filename):
+        os.remove(filename)
+
+    # the indexes are written after the FASTA file, to be newer than it
+    if bgzip:
+        fasta_len.write_gzi(output + ".gzi", writer.offsets)
+    try:
+        fasta_len.write_fai(output + ".fai", records)
+    except ValueError as error:
+        print("{}: {}".format(output, error), file=sys.stderr)
+
+    return {
+        "stats": fasta_len.summarise_records(records),
+        "md5": checksum.hexdigest(),
+        "changes": changes,
+    }
+
+
+def get_input_key(filename: str) -> dict:
+    """Get the path, size and modification time of an assembly ingested, to notice it changed."""
+    stat = os.stat(filename)
+    return {"path": filename, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def ingest_job(job: Tuple[str, str, bool, int]) -> dict:
+    """Ingest an assembly given as a tuple, for a process pool."""
+    return ingest_assembly(*job)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Fix the headers, index, checksum and summarise assemblies in one pass"
+    )
+    parser.add_argument("input", nargs="*", help="FASTA files, plain or gzip")
+    parser.add_argument(
+        "--assemblies_dirs",
+        nargs="+",
+        default=[],
+        help="Directories where FASTA files are localised, as given to cactus_tree_prepare.py",
+    )
+    parser.add_argument(
+        "--extension",
+        default=".fa",
+        help="The expected extension of the files containing the assemblies (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output_dir", help="Where to write the fixed assemblies, instead of replacing them"
+    )
+    parser.add_argument(
+        "--bgzip", action="store_true", help="Compress the plain assemblies too, with bgzip"
+    )
+    parser.add_argument(
+        "--compresslevel", type=int, default=6, help="Compression level of bgzip (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Amount of assemblies ingested in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mapping",
+        metavar="TSV",
+        help="Write the old and new header of each header changed, quoting those containing tabs",
+    )
+    parser.add_argument(
+        "--cache",
+        default=os.path.join(os.path.expanduser("~"), ".cache", "fasta_len.json"),
+        help="Statistics of the assemblies, shared with fasta_len.py (default: %(default)s)",
+    )
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = create_argparser().parse_args()
+
+    filenames = [os.path.abspath(x) for x in args.input]
+    if args.assemblies_dirs:
+        filenames += fasta_len.find_assemblies(args.assemblies_dirs, args.extension)
+    filenames = list(dict.fromkeys(filenames))
+    if not filenames:
+        print("No assemblies given!", file=sys.stderr)
+        sys.exit(1)
+
+    for filename in filenames:
+        if not os.path.exists(filename):
+            print("File {} does not exist!".format(filename))
+            sys.exit(1)
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        args.output_dir = os.path.abspath(args.output_dir)
+
+    cache: Dict[str, dict] = fasta_len.read_cache(args.cache)
+    outputs: Dict[str, str] = {}
+    jobs = []
+    for filename in filenames:
+        bgzip = args.bgzip or fasta_len.is_gzip(filename)
+        output = get_output_path(filename, args.output_dir, bgzip)
+        outputs[filename] = output
+
+        # ingested before from the same input, and neither changed since
+        entry = cache.get(output)
+        if entry is not None and "md5" in entry and os.path.exists(output):
+            stat = os.stat(output)
+            if (
+                entry["size"] == stat.st_size
+                and entry["mtime"] == stat.st_mtime_ns
+                and entry.get("input") == get_input_key(filename)
+            ):
+                continue
+        jobs.append((filename, output, bgzip, args.compresslevel))
+
+    changes: Dict[str, List[Tuple[str, str]]] = {}
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(jobs)))) as pool:
+            for job, result in zip(jobs, pool.map(ingest_job, jobs)):
+                filename, output = job[:2]
+                stat = os.stat(output)
+                cache[output] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    # an input compressed in place is replaced by the output
+                    "input": get_input_key(filename if os.path.exists(filename) else output),
+                    "stats": result["stats"],
+                    "md5": result["md5"],
+                    "headers_fixed": len(result["changes"]),
+                }
+                changes[output] = result["changes"]
+        fasta_len.write_cache(args.cache, cache)
+
+    print(";".join(COLUMNS))
+    for filename in filenames:
+        output = outputs[filename]
+        entry = cache[output]
+        print(
+            ";".join(
+                [fasta_len.get_assembly_name(output)]
+                + [fasta_len.format_stat(entry["stats"][x]) for x in COLUMNS[1:-3]]
+                + [str(entry["headers_fixed"]), entry["md5"], output]
+            )
+        )
+
+    if args.mapping is not None:
+        with open(args.mapping, "w", encoding="utf-8", newline="") as mapping_file:
+            # descriptions may contain tabs
+            writer = csv.writer(mapping_file, delimiter="\t", lineterminator="\n")
+            for output, output_changes in changes.items():
+                writer.writerows((output, old, new) for old, new in output_changes)
@@ -24,14 +24,43 @@ wraps the cactus pipeline into Slurm jobs.
 """
 
 import argparse
+import heapq
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import os
+import math
 from pathlib import Path
+import random
 import re
 import stat
+import subprocess
 import sys
 import shutil
 import tempfile
-from typing import Any, Dict, Generator, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+import time
+import uuid
+import zlib
+from dataclasses import astuple, dataclass, field
+from datetime import timedelta
+from statistics import mean
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import fasta_len
+from cactus_batcher_state import WorkflowState
 
 try:
     import yaml
@@ -76,6 +105,14 @@ def make_or_replace_symlink(target: str, link_name: str) -> None:
 
     """
 
+    # most links are created in fresh directories, so try the cheap way first
+    try:
+        os.symlink(target, link_name)
+        return
+    except FileExistsError:
+        if os.path.islink(link_name) and os.readlink(link_name) == target:
+            return
+
     # os.replace() may fail if files are on different filesystems
     link_dir = os.path.dirname(link_name)
 
@@ -148,19 +185,49 @@ def create_symlinks(src_dirs, dest):
         make_or_replace_symlink(target=relativepath, link_name=fromfolderWithFoldername)
 
 
-def appendln_file(filename: str, line: str, mode: str = "a") -> None:
-    """Append content to a file.
+def write_file(filename: str, lines: Iterable[str], executable: bool = False) -> None:
+    """Write the whole content of a file at once.
+
+    Args:
+        filename: The name of the file to be written.
+        lines: Strings to write in the file, one per line.
+        executable: True if the file should be executable, e.g., chmod +x.
+
+    """
+
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("".join(f"{line.strip()}\n" for line in lines if line))
+
+        # chmod +x on it without looking the path up again
+        if executable:
+            st = os.fstat(file.fileno())
+            os.fchmod(file.fileno(), st.st_mode | stat.S_IEXEC)
+
+
+def remove_dir(path: str) -> None:
+    """Delete a directory tree without waiting for it.
+
+    The tree is renamed first, which is a single metadata operation, so that
+    its path can be reused at once. The renamed tree is then removed by a
+    detached process that outlives this script.
 
     Args:
-        filename: The name of the file to append information.
-        line: String to append in the file as a line.
-        mode: Mode to open the file.
+        path: Path of the directory to delete.
 
     """
+    trash = f"{path}.{uuid.uuid4().hex}.deleting"
+    os.rename(path, trash)
 
-    if line:
-        with open(filename, mode, encoding="utf-8") as file:
-            file.write(line.strip() + '\n')
+    try:
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            ["rm", "-rf", trash],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        shutil.rmtree(trash)
 
 
 def make_or_replace_dir(path: str, force: bool = False) -> None:
@@ -171,36 +238,96 @@ def make_or_replace_dir(path: str, force: bool = False) -> None:
         force: If the directory exists, delete and recreate it.
 
     """
-    if force and Path(path).exists():
-        shutil.rmtree(path)
+    if force and os.path.isdir(path):
+        remove_dir(path)
+
+    os.makedirs(path, exist_ok=True)
+
+
+def parse_memory(value: Union[int, float, str, None]) -> Optional[int]:
+    """Convert a Slurm memory value into MB.
+
+    Args:
+        value: Memory in MB or a string with a unit suffix, e.g., 16G.
+
+    Returns:
+        The amount of memory in MB or None if not given.
+
+    """
+    if value is None or value == "None":
+        return None
 
-    Path(path).mkdir(parents=True, exist_ok=True)
+    if isinstance(value, (int, float)):
+        return int(value)
 
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
 
-def make_executable(path: str) -> None:
-    """Make a file executable, e.g., chmod +x.
+
+def parse_time(value: Union[int, str]) -> int:
+    """Convert a Slurm time limit into seconds.
 
     Args:
-        path: Path to a file.
+        value: Time in minutes or as MM:SS, HH:MM:SS, D-HH, D-HH:MM or D-HH:MM:SS.
+
+    Returns:
+        The time limit in seconds.
 
     """
-    st = os.stat(path)
-    os.chmod(path, st.st_mode | stat.S_IEXEC)
+    if isinstance(value, (int, float)):
+        return int(value * 60)
+
+    days, _, clock = value.strip().rpartition("-")
+    fields = [int(x) for x in clock.split(":")]
+
+    if days:
+        # D-HH, D-HH:MM, D-HH:MM:SS
+        fields += [0] * (3 - len(fields))
+    elif len(fields) == 1:
+        # MM
+        fields = [0, fields[0], 0]
+    elif len(fields) == 2:
+        # MM:SS
+        fields = [0] + fields
+
+    return int(days or 0) * 86400 + fields[0] * 3600 + fields[1] * 60 + fields[2]
+
+
+def parse_bases(value: str) -> int:
+    """Convert an amount of bases with an optional K, M or G suffix, e.g., 500M."""
+    units = {"K": 10**3, "M": 10**6, "G": 10**9}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def format_time(seconds: float) -> str:
+    """Convert seconds into a Slurm time limit in the D-HH:MM:SS format."""
+    minutes, seconds = divmod(int(math.ceil(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}-{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
-def create_bash_script(filename: str) -> None:
-    """Create executable bash script with shebang on it.
+def get_fasta_length(path: str) -> int:
+    """Get the amount of residues of a FASTA file (plain, gzip or bgzip).
+
+    The samtools index (.fai) is used if it is up to date, otherwise the
+    file is scanned by fasta_len.py, in large binary blocks.
 
     Args:
-        filename: Path of the file.
-        chmod_x: True if script should be executable.
-        shebang: String containing bash shebang.
+        path: Path of the FASTA file.
+
+    Returns:
+        The sum of the lengths of all sequences.
 
     """
-    appendln_file(filename=filename, mode="w", line="#!/bin/bash")
 
-    # chmod +x on it
-    make_executable(path=filename)
+    return sum(x.length for x in fasta_len.get_records(path))
 
 
 def create_argparser() -> argparse.ArgumentParser:
@@ -243,6 +370,132 @@ def create_argparser() -> argparse.ArgumentParser:
         required=True,
         help="YAML file describing the SLURM resources",
     )
+    parser.add_argument(
+        "--leaf_outgroups_only",
+        dest="ancestral_outgroups",
+        action="store_false",
+        help="Only leaves may be chosen as outgroups by Cactus, not the ancestral genomes "
+        "of other subtrees, for configs that forbid them",
+    )
+    parser.add_argument(
+        "--slurm_arrays",
+        action="store_true",
+        help="Submit jobs sharing resources and dependencies as Slurm job arrays",
+    )
+    parser.add_argument(
+        "--script_shard_size",
+        metavar="FILES",
+        type=int,
+        default=1000,
+        help="Maximum amount of scripts per directory, above which they are spread over subdirectories "
+        "(0 to disable)",
+    )
+    parser.add_argument(
+        "--fs_threads",
+        type=int,
+        default=8,
+        help="Maximum amount of concurrent filesystem operations while writing the workflow",
+    )
+    parser.add_argument(
+        "--state_db",
+        metavar="PATH",
+        help="SQLite database where the jobs record their state when they start and finish, "
+        "e.g., cactus_batcher_state.db in the output directory",
+    )
+    parser.add_argument(
+        "--resubmit",
+        action="store_true",
+        help="Only generate the jobs not completed by the previous submission recorded in --state_db, "
+        "keeping the logs of that submission",
+    )
+    parser.add_argument(
+        "--preprocess_pack_size",
+        metavar="BASES",
+        type=parse_bases,
+        help="Pack cactus-preprocess commands into jobs of up to this many bases (e.g., 500M), "
+        "which run the packed commands concurrently",
+    )
+    parser.add_argument(
+        "--gpu_node",
+        metavar="GPUS[:CPUS]",
+        type=lambda x: tuple(int(y) for y in x.split(":", 1)),
+        help="Pack cactus-preprocess and cactus-blast commands using fewer GPUs than a node "
+        "with this many GPUs (and CPUs) into jobs taking a whole node, each command "
+        "using its own GPUs and a share of the CPUs in proportion to its GPUs",
+    )
+    parser.add_argument(
+        "--fuse_chains",
+        action="store_true",
+        help="Fuse linear chains of jobs with the same partition and GPUs, "
+        "e.g., cactus-align and hal2fasta, into jobs that run them in sequence",
+    )
+    parser.add_argument(
+        "--fuse_max_time",
+        type=parse_time,
+        default="7-00:00:00",
+        help="Maximum sum of the time limits of the jobs fused together (D-HH:MM:SS)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["slurm", "local", "simulate"],
+        default="slurm",
+        help="Run the workflow with Slurm (default), right away on the local node, "
+        "or simulate it without writing anything",
+    )
+    parser.add_argument(
+        "--local_cpus",
+        type=int,
+        default=os.cpu_count(),
+        help="Amount of CPUs available to the local executor",
+    )
+    parser.add_argument(
+        "--local_memory",
+        metavar="MB",
+        type=int,
+        default=os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20,
+        help="Amount of memory (in MB) available to the local executor",
+    )
+    parser.add_argument(
+        "--local_gpus",
+        type=int,
+        default=len([x for x in os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if x]),
+        help="Amount of GPUs available to the local executor",
+    )
+    parser.add_argument(
+        "--runtimes",
+        metavar="FILE",
+        nargs="+",
+        default=[],
+        help="Runtime history for the simulator, as job;count;mean;stdev rows where job is "
+        "either a job name (e.g., cactus-blast-Anc1) or a command (e.g., cactus-blast)",
+    )
+    parser.add_argument(
+        "--simulate_partition",
+        metavar="NAME=NODES[:CPUS[:GPUS]]",
+        type=SimulatedPartition.from_string,
+        action="append",
+        default=[],
+        help="Nodes, CPUs per node and GPUs per node of a simulated partition; "
+        "without CPUs, each job takes a whole node. Partitions not given are unbounded",
+    )
+    parser.add_argument(
+        "--simulate_default_runtime",
+        metavar="SECONDS",
+        type=float,
+        default=0.0,
+        help="Simulated runtime of jobs without any runtime history",
+    )
+    parser.add_argument(
+        "--simulate_samples",
+        type=int,
+        default=0,
+        help="Amount of extra simulations with runtimes sampled from their mean and stdev",
+    )
+    parser.add_argument(
+        "--simulate_timeline",
+        metavar="FILE",
+        help="CSV file in which the simulated utilisation of each partition over time is written",
+    )
     return parser
 
 
@@ -353,6 +606,338 @@ def check_slurm_resources_info(content: Dict,
     return errors
 
 
+###################################################################
+###                    WORKFLOW  DATA MODEL                      ##
+###################################################################
+
+
+@dataclass
+class SlurmResources:
+    """Slurm resources requested by a job.
+
+    Attributes:
+        partition: Slurm partition name to dispatch the job.
+        gpus: Amount of GPUs to run the job.
+        cpus: Amount of CPUs to run the job.
+        memory: Amount of memory (in MB) to run the job.
+        time: Time limit of the job.
+
+    """
+
+    partition: Optional[str] = None
+    gpus: Optional[int] = None
+    cpus: Optional[int] = None
+    memory: Optional[int] = None
+    time: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], size: Optional[int] = None) -> "SlurmResources":
+        """Create the resources from an entry of the slurm configuration file.
+
+        If the entry has a `scaling` key and `size` is given, `cpus`, `memory`
+        and `time` are scaled by the size of the job, e.g.:
+
+            scaling:
+              memory: {base: 8000, per_gb: 40000, min: 16000, max: 1000000}
+              time: {base: "01:00:00", per_gb: "08:00:00", max: "7-00:00:00"}
+
+        where each value is `base + per_gb * size_in_gb` clamped to [min, max].
+
+        Args:
+            config: The dictionary of a given key from the slurm configuration file.
+            size: The sum of the lengths of the genomes touched by the job.
+
+        Returns:
+            The resources described by `config`.
+
+        Raises:
+            ValueError: If a scaling rule refers to an unknown resource.
+
+        """
+        gpus = config.get("gpus")
+        resources = cls(
+            partition=config.get("partition"),
+            gpus=None if gpus in (None, "None") else gpus,
+            cpus=config.get("cpus"),
+            memory=config.get("memory"),
+            time=config.get("time"),
+        )
+
+        if size is None or not config.get("scaling"):
+            return resources
+
+        converters: Dict[str, Callable[[Any], float]] = {
+            "cpus": float,
+            "memory": lambda x: parse_memory(x) or 0,
+            "time": parse_time,
+        }
+        for key, rule in config["scaling"].items():
+            if key not in converters:
+                raise ValueError(f"Unknown resource '{key}' in scaling rules: {config}")
+
+            convert = converters[key]
+            value = convert(rule.get("base", 0)) + convert(rule.get("per_gb", 0)) * size / 1e9
+            if "min" in rule:
+                value = max(value, convert(rule["min"]))
+            if "max" in rule:
+                value = min(value, convert(rule["max"]))
+
+            setattr(resources, key, format_time(value) if key == "time" else int(math.ceil(value)))
+
+        return resources
+
+    @classmethod
+    def combine(cls, resources: Sequence["SlurmResources"], concurrent: bool) -> "SlurmResources":
+        """Get the resources of a job that runs several jobs.
+
+        Args:
+            resources: The resources of each job.
+            concurrent: True if the jobs run concurrently, otherwise they run in sequence.
+
+        Returns:
+            The sum (concurrent) or maximum (sequence) of the CPUs, memory and GPUs,
+            with the maximum (concurrent) or sum (sequence) of the time limits.
+
+        """
+        aggregate: Callable[[Iterable[int]], int] = sum if concurrent else max  # type: ignore
+
+        def total(values: List[Any]) -> Any:
+            values = [x for x in values if x is not None]
+            return aggregate(values) if values else None
+
+        times = [parse_time(x.time) for x in resources if x.time is not None]
+        return cls(
+            partition=resources[0].partition,
+            gpus=total([x.gpus for x in resources]),
+            cpus=total([x.cpus for x in resources]),
+            memory=total([parse_memory(x.memory) for x in resources]),
+            time=format_time((max if concurrent else sum)(times)) if times else None,
+        )
+
+
+@dataclass
+class CactusJob:
+    """A command line of the Cactus pipeline to be wrapped into a Slurm job.
+
+    Attributes:
+        command: The name of the binary.
+        id: A unique ID for the command line within its task type.
+        variable: A unique variable name for the command line.
+        jobstore: The jobstore of the command line if it exists.
+        line: The command line itself.
+        group: The name of the aggregated bash script the job belongs to.
+        resources: The Slurm resources requested by the job.
+        dependencies: Variable names of the jobs that this job depends on.
+        script: Path of the bash script of the job wrapped by Slurm.
+        steps: The jobs run by this job if it wraps several command lines.
+        concurrent: True if `steps` run concurrently, otherwise they run in sequence.
+        devices: Indexes of the GPUs used by this job among those of the job wrapping it.
+        cpus: Amount of CPUs overriding the one of the Slurm resources information.
+
+    """
+
+    command: str
+    id: str
+    variable: str
+    jobstore: Optional[str]
+    line: str
+    group: str
+    resources: SlurmResources = field(default_factory=SlurmResources)
+    dependencies: List[str] = field(default_factory=list)
+    script: Optional[str] = None
+    steps: List["CactusJob"] = field(default_factory=list)
+    concurrent: bool = False
+    devices: List[int] = field(default_factory=list)
+    cpus: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        """Name of the Slurm job."""
+        return f"{self.command}-{self.id}"
+
+
+@dataclass
+class WorkflowRound:
+    """A batch of jobs sharing the same working directory, e.g., a round of alignments.
+
+    Attributes:
+        task_type: Type of the task, e.g., preprocessor, alignments, merging.
+        round_id: The round number for alignments, None otherwise.
+        root_dir: The directory in which the jobs of this round run.
+        symlinks: List of directories (as source) for symlink creation at `root_dir`.
+        script_dirs: Directories to be created inside of `root_dir` to store scripts.
+        log_dir: Directory inside of `root_dir` in which log files will be written.
+        groups: Variable names of the jobs of each aggregated bash script, in order.
+
+    """
+
+    task_type: str
+    round_id: Optional[str]
+    root_dir: str
+    symlinks: Sequence[str]
+    script_dirs: Mapping[str, str]
+    log_dir: str
+    groups: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        """Name of the round, e.g., alignments-2."""
+        if self.round_id is None:
+            return self.task_type
+        return f"{self.task_type}-{self.round_id}"
+
+    def resolve(self, path: str) -> str:
+        """Resolve a path as seen from `root_dir` without touching the filesystem.
+
+        Args:
+            path: A path relative to `root_dir`, e.g., jobstore/0.
+
+        Returns:
+            The path resolved through the symlinks of this round.
+
+        """
+        if os.path.isabs(path):
+            return path
+
+        head, _, tail = path.partition("/")
+        for src in self.symlinks:
+            if os.path.basename(src) == head:
+                return f"{src}/{tail}" if tail else src
+
+        return f"{self.root_dir}/{path}"
+
+
+@dataclass
+class Workflow:
+    """In-memory representation of the Cactus pipeline.
+
+    The workflow is built in one pass over the output of cactus-prepare and its
+    files are only written to disk once everything has been rendered.
+
+    Attributes:
+        rounds: The rounds of the workflow in execution order.
+        jobs: Every job of the workflow indexed by its variable name.
+        files: Content of the files to be written, indexed by their path.
+        executables: Path of the files that must be executable.
+
+    """
+
+    rounds: List[WorkflowRound] = field(default_factory=list)
+    jobs: Dict[str, CactusJob] = field(default_factory=dict)
+    files: Dict[str, List[str]] = field(default_factory=dict)
+    executables: Set[str] = field(default_factory=set)
+
+    def add_round(self, round_: WorkflowRound) -> WorkflowRound:
+        """Append a new round to the workflow."""
+        self.rounds.append(round_)
+        return round_
+
+    def add_job(self, round_: WorkflowRound, job: CactusJob) -> None:
+        """Add a job to the given round of the workflow.
+
+        Raises:
+            ValueError: If a job with the same variable name already exists.
+
+        """
+        if job.variable in self.jobs:
+            raise ValueError(f"Duplicated Cactus command: '{job.line}'")
+
+        self.jobs[job.variable] = job
+        round_.groups.setdefault(job.group, []).append(job.variable)
+
+    def remove_jobs(self, variables: Iterable[str]) -> None:
+        """Remove jobs from the workflow.
+
+        The jobs that depended on a removed job depend on its dependencies
+        instead, skipping those removed as well.
+
+        Args:
+            variables: Variable names of the jobs to be removed.
+
+        """
+        removed = set(variables)
+        survivors: Dict[str, List[str]] = {}
+
+        def get_survivors(variable: str) -> List[str]:
+            if variable not in removed:
+                return [variable]
+            if variable not in survivors:
+                survivors[variable] = [
+                    x for dep in self.jobs[variable].dependencies for x in get_survivors(dep)
+                ]
+            return survivors[variable]
+
+        for job in self.jobs.values():
+            if job.variable not in removed and removed.intersection(job.dependencies):
+                job.dependencies = list(dict.fromkeys(
+                    x for dep in job.dependencies for x in get_survivors(dep)
+                ))
+
+        for round_ in self.rounds:
+            round_.groups = {
+                group: members
+                for group, members in (
+                    (k, [x for x in v if x not in removed]) for k, v in round_.groups.items()
+                )
+                if members
+            }
+
+        for variable in removed:
+            del self.jobs[variable]
+
+    def replace_jobs(self, variables: Sequence[str], job: CactusJob) -> None:
+        """Replace some jobs of the same round by a single job that wraps them.
+
+        The new job takes the place of the first replaced job, inherits their
+        dependencies and is depended on by their dependents.
+
+        Args:
+            variables: Variable names of the jobs to be replaced.
+            job: The job replacing them.
+
+        """
+        replaced = set(variables)
+        job.dependencies = list(dict.fromkeys(
+            x for v in variables for x in self.jobs[v].dependencies if x not in replaced
+        ))
+
+        for round_ in self.rounds:
+            for group, members in round_.groups.items():
+                if not replaced.intersection(members):
+                    continue
+                if job.variable not in self.jobs:
+                    index = next(i for i, x in enumerate(members) if x in replaced)
+                    members.insert(index, job.variable)
+                    self.jobs[job.variable] = job
+                round_.groups[group] = [x for x in members if x not in replaced]
+
+        for variable in variables:
+            del self.jobs[variable]
+
+        for other in self.jobs.values():
+            if replaced.intersection(other.dependencies):
+                other.dependencies = list(dict.fromkeys(
+                    job.variable if x in replaced else x for x in other.dependencies
+                ))
+
+        # drop groups left empty
+        for round_ in self.rounds:
+            round_.groups = {k: v for k, v in round_.groups.items() if v}
+
+    def iter_jobs(self) -> Iterator[Tuple[WorkflowRound, CactusJob]]:
+        """Iterate over the jobs in execution order along with their round."""
+        for round_ in self.rounds:
+            for variables in round_.groups.values():
+                for variable in variables:
+                    yield round_, self.jobs[variable]
+
+    def emit(self, filename: str, line: str, executable: bool = False) -> None:
+        """Append a line to a file that will be written later by `write_workflow`."""
+        self.files.setdefault(filename, []).append(line)
+        if executable:
+            self.executables.add(filename)
+
+
 ###################################################################
 ###               CACTUS-BATCHER  PARSING STEP                   ##
 ###################################################################
@@ -360,45 +945,43 @@ def check_slurm_resources_info(content: Dict,
 
 def parse(
     read_func: Iterator[str],
-    symlink_dir: Iterable[str],
+    workflow: Workflow,
+    symlink_dir: Sequence[str],
     root_dir: str,
     script_dirs: Mapping[str, str],
     log_dir: str,
     task_type: str,
     stop_condition: Optional[str],
-    ext: str = "dat",
 ) -> None:
     """Main function to parse the output file of Cactus-prepare.
 
     Args:
         read_func: Pointer to the function that yields input lines.
+        workflow: The workflow in which the parsed jobs are stored.
         symlink_dir: List of directories (as source) for symlink creation.
         root_dir: The directory in which to save parser's output.
         script_dirs: List of extra directories to be created inside of `root_dir`.
         log_dir: Directory in which log files will be written.
         task_type: Type of the given task.
         stop_condition: The condition to stop this parser.
-        ext: Extension for the files that contain the command lines.
 
     """
 
-    # dict to point to parsed files
-    parsed_files = {}
-
-    # Preamble - create links and directories needed to execute Cactus at
-    # @root_dir
-    if task_type != "alignments":
-
-        # For the alignment step, these links must be created inside of each round  directory,
-        # which is done inside of the while loop below
-        create_symlinks(src_dirs=symlink_dir, dest=root_dir)
-
-        # create log directory at root_dir
-        make_or_replace_dir(f"{root_dir}/{log_dir}", force=True)
+    def new_round(round_id: Optional[str], path: str) -> WorkflowRound:
+        return workflow.add_round(
+            WorkflowRound(
+                task_type=task_type,
+                round_id=round_id,
+                root_dir=path,
+                symlinks=symlink_dir,
+                script_dirs=script_dirs,
+                log_dir=log_dir,
+            )
+        )
 
-        # create script directory at root_dir
-        for script_dir in script_dirs.values():
-            make_or_replace_dir(f"{root_dir}/{script_dir}", force=True)
+    # For the alignment step, a new round is created for each round directory,
+    # which is done inside of the while loop below
+    round_ = new_round(None, root_dir) if task_type != "alignments" else None
 
     while True:
         # get the next line
@@ -419,319 +1002,1965 @@ def parse(
         if stop_condition and line.startswith(stop_condition):
             break
 
-        if task_type == "preprocessor":
-
-            # define the correct filenames to write the line
-            parsed_files["all"] = f"{root_dir}/{script_dirs['all']}/all-{task_type}.{ext}"
+        # preamble - create a new round
+        if task_type == "alignments" and line.startswith("### Round"):
+            round_id = line.split()[-1]
+            round_ = new_round(round_id, f"{root_dir}/{round_id}")
+            continue
 
-        elif task_type == "alignments":
+        # do not store lines starting with ## Rounds
+        if line.startswith("#"):
+            continue
 
-            # preamble - create a new round directory
-            if line.startswith("### Round"):
-                round_id = line.split()[-1]
-                round_path = f"{root_dir}/{round_id}"
+        # sanity check
+        assert round_ is not None
 
-                # create script directory at root_dir
-                for script_dir in script_dirs.values():
-                    make_or_replace_dir(f"{round_path}/{script_dir}", force=True)
+        # just in case more than one command per line
+        for command in line.split(";"):
+            command = command.strip()
+            if not command:
+                continue
 
-                # create log directory at root_dir
-                make_or_replace_dir(f"{round_path}/{log_dir}", force=True)
+            # extract line info
+            info = cactus_job_command_name(command)
+            assert info is not None, "processed Cactus command info must not be empty"
 
-                # create links needed for execution
-                create_symlinks(src_dirs=symlink_dir, dest=round_path)
+            workflow.add_job(
+                round_,
+                CactusJob(
+                    command=info["command"],
+                    id=info["id"],
+                    variable=info["variable"],
+                    jobstore=info["jobstore"],
+                    line=command,
+                    group=info["id"] if task_type == "alignments" else f"all-{task_type}",
+                ),
+            )
 
-                # go to the next line
-                continue
 
-            # sanity check
-            assert "round_path" in locals()
+###################################################################
+###                 WORKFLOW  DEPENDENCY GRAPH                   ##
+###################################################################
 
-            # extract line info
-            info = cactus_job_command_name(line)
-            assert info is not None, "processed Cactus command info must not be empty"
 
-            # update filenames to write the line
-            parsed_files["all"] = f"{round_path}/{script_dirs['all']}/{info['id']}.{ext}"
+@dataclass
+class SeqFile:
+    """The content of a Cactus seqfile.
 
-        # update filenames to write the line
-        elif task_type == "merging":
+    Attributes:
+        children: The children names of each internal node of the tree.
+        paths: The FASTA file path of each genome.
 
-            # get parent and root node from the command line
-            parsed_files["all"] = f"{root_dir}/{script_dirs['all']}/all-{task_type}.{ext}"
+    """
 
-        # write the line in the correct files and not write it down lines starting with ## Rounds
-        if not line.startswith('#'):
-            for filename in parsed_files.values():
-                appendln_file(filename=filename, line=line)
+    children: Dict[str, List[str]] = field(default_factory=dict)
+    paths: Dict[str, str] = field(default_factory=dict)
 
+    @property
+    def nodes(self) -> List[str]:
+        """Name of every node of the tree."""
+        names = list(self.children)
+        for children in self.children.values():
+            names.extend(x for x in children if x not in self.children)
+        return names
 
-###################################################################
-###                  SLURM BASH SCRIPT CREATOR                   ##
-###################################################################
 
+@dataclass
+class OutgroupCandidates:
+    """The outgroup candidates shared by the subtrees of a seqfile.
 
-def get_slurm_submission(
-    job_name: str,
-    variable_name: str,
-    work_dir: str,
-    log_dir: str,
-    partition: str,
-    gpus: int,
-    cpus: int,
-    memory: int,
-    time: str,
-    command: str,
-    dependencies: Sequence[str],
-    script_filename: str,
-    singularity: bool = True,
-) -> None:
-    """Prepare a Slurm string call.
+    The candidates only grow from one round to the next, so they are updated
+    incrementally rather than being recomputed for every job.
 
-    Args:
-        job_name: Name for the Slurm job.
-        variable_name: A unique variable name to identify the given command.
-        work_dir: Location where the slurm should run the command.
-        log_dir: Path to Cactus' log.
-        partition: Slurm partition name to dispatch the job.
-        gpus: Amount of GPUs to run the job.
-        cpus: Amount of CPUs to run the job.
-        command: Command to be wrapped by Slurm.
-        dependencies: List of Job IDs that this job depends on.
-        script_filename: Path of bash script to which a Slurm
-            batch submission command will be written.
-        singularity: True if `command` should run via singularity.
+    Attributes:
+        genomes: Names of the candidate genomes.
+        count: Amount of produced genomes already considered as candidates.
+        writers: Jobs producing the candidates, without those implied by other ones.
+        mask: Bitmask of `writers`.
+        closure: Bitmask of `writers` plus all of their (transitive) dependencies.
+        readers: Jobs that read the candidates.
 
     """
 
-    # sbatch command line
-    sbatch = [f"TASK_{variable_name}=$(sbatch", "--parsable", "--requeue"]
-    sbatch.append(f"-J {job_name}")
+    genomes: Set[str] = field(default_factory=set)
+    count: int = 0
+    writers: List[str] = field(default_factory=list)
+    mask: int = 0
+    closure: int = 0
+    readers: List[str] = field(default_factory=list)
 
-    if work_dir is not None:
-        sbatch.append(f"-D {work_dir}")
 
-    sbatch.append(f"-o {log_dir}/{job_name}-%j.out")
-    sbatch.append(f"-e {log_dir}/{job_name}-%j.err")
-    
+def parse_newick(text: str) -> Dict[str, List[str]]:
+    """Parse a Newick tree without any third-party module.
 
-    if gpus is not None and gpus != "None":
-        sbatch.append(f"--gres=gpu:{gpus}")
-    else:
-        sbatch.append(f"-p {partition}")
-    
-    if cpus is not None:
-        sbatch.append(f"--cpus-per-task {cpus}")
+    Args:
+        text: The Newick string.
 
-    if memory is not None:
-        sbatch.append(f"--mem={memory}")
-    
-    if time is not None:
-        sbatch.append(f"--time={time}")
+    Returns:
+        A dictionary containing the children names of each named internal node.
 
-    if dependencies is not None and len(dependencies) > 0:
-        all_deps = ":$".join(["TASK_" + dep for dep in dependencies])
-        sbatch.append(f"--dependency=afterok:${all_deps}")
+    """
 
-    # define singularity
-    if singularity:
+    children: Dict[str, List[str]] = {}
+    stack: List[List[str]] = [[]]
+    closed: Optional[List[str]] = None
+    label: List[str] = []
+    quoted = False
+    comment = False
+
+    for char in text:
+        if quoted:
+            if char == "'":
+                quoted = False
+            else:
+                label.append(char)
+        elif comment:
+            comment = char != "]"
+        elif char == "'":
+            quoted = True
+        elif char == "[":
+            comment = True
+        elif char == "(":
+            stack.append([])
+        elif char in "),;":
+            # the name is whatever comes before the branch length
+            name = "".join(label).split(":")[0].strip()
+            label = []
+
+            # an internal node has just been closed
+            if closed is not None and name:
+                children[name] = closed
+            closed = None
+
+            if name:
+                stack[-1].append(name)
+
+            if char == ")" and len(stack) > 1:
+                closed = stack.pop()
+        else:
+            label.append(char)
+
+    return children
+
+
+def parse_seqfile(filename: str) -> Optional[SeqFile]:
+    """Cactus seqfile parser.
 
-        # get image PATH from environment variable
-        image = os.environ.get("CACTUS_IMAGE")
+    Args:
+        filename: Path of the seqfile.
 
-        # for GPU usage, grab another image
-        if gpus is not None and gpus != "None":
-            image = f"--nv {os.environ.get('CACTUS_GPU_IMAGE')}"
+    Returns:
+        The seqfile content or None if it cannot be read.
 
-        # wrap the commands to use singularity
-        command = f"singularity run {image} {command}"
+    """
 
-    # real wrapped job
-    job_filename = script_filename.replace(".sh", "-job.sh")
-    jobs = [command]
-    if os.environ.get("CACTUS_USAGE_LOGGER") is not None:
-        gpu_option = "" if gpus is None else "-g"
-        jobs.insert(
-            1,
-            f"bash ~/git/thiago-ebi-tools/bin/usage.sh {gpu_option} -o {log_dir}/{job_name}.usage &",
-        )
+    seqfile = SeqFile()
+    tree: List[str] = []
 
-    # write jobs to the file
-    appendln_file(filename=job_filename, line="\n\n".join(jobs))
+    try:
+        for line in read_file(filename):
+            line = line.strip()
 
-    # wrap the commands for SLURM
-    sbatch.append(f'--wrap "source {job_filename}")')
+            if not line or line.startswith("#"):
+                continue
 
-    # store it in the individual bash script
-    appendln_file(filename=script_filename, line=" ".join(sbatch))
+            # the Newick tree comes first and may span several lines
+            if (tree or line.startswith("(")) and not "".join(tree).endswith(";"):
+                tree.append(line)
+                if line.endswith(";"):
+                    seqfile.children = parse_newick("".join(tree))
+                continue
 
+            name, _, path = line.partition(" ")
+            seqfile.paths[name.lstrip("*")] = path.strip()
 
-def slurmify(
-    root_dir: str,
-    script_dirs: Mapping[str, str],
-    log_dir: str,
-    resources: Dict,
-    initial_dependencies: Sequence[str],
-    ext: str = "dat",
-) -> List[str]:
-    """Wraps each command line into a Slurm job.
+    except OSError:
+        return None
+
+    return seqfile
+
+
+def get_positional_args(line: str) -> List[str]:
+    """Get the positional arguments of a command line.
 
     Args:
-        root_dir: Location of the cactus task.
-        script_dirs: Directory to read data and create scripts.
-        log_dir: Log path for Cactus call.
-        resources: Slurm resources information.
-        initial_dependencies: Essential dependencies set before.
-        ext: Extension for the files that contains the command lines.
+        line: The command line.
 
     Returns:
-        A list of unique variable names representing the jobs that
-        are dependencies for the next batch of Slurm jobs.
+        The arguments given before the first option or redirection.
 
     """
+    positionals = []
+    for arg in line.split()[1:]:
+        if arg.startswith("-") or arg.startswith(">"):
+            break
+        positionals.append(arg)
+    return positionals
 
-    agg_script_dir = f"{root_dir}/{script_dirs['all']}"
-    filenames = [x for x in os.listdir(agg_script_dir)
-                 if os.path.isfile(os.path.join(agg_script_dir, x))]
 
-    # list of variable names that serve as dependencies for the next batch
-    extra_dependencies = []
+def get_option_values(line: str, option: str) -> List[str]:
+    """Get the values given to an option of a command line.
 
-    for filename in filenames:
+    Args:
+        line: The command line.
+        option: The option, e.g., --inputNames.
 
-        # sanity check
-        aggregated_bashscript_filename, file_extension = os.path.splitext(filename)
-        if ext not in file_extension:
-            continue
+    Returns:
+        The arguments given after `option` until the next option.
 
-        # create aggregated bash script
-        aggregated_bashscript_filename = (
-            f"{root_dir}/{script_dirs['all']}/{aggregated_bashscript_filename}.sh"
-        )
-        create_bash_script(filename=aggregated_bashscript_filename)
+    """
+    args = line.split()
+    if option not in args:
+        return []
 
-        # dependency SLURM variable
-        intra_dependencies = list(initial_dependencies)
+    values = []
+    for arg in args[args.index(option) + 1:]:
+        if arg.startswith("-") or arg.startswith(">"):
+            break
+        values.append(arg)
+    return values
 
-        for commands in read_file(filename=f"{root_dir}/{script_dirs['all']}/{filename}"):
-            # just in case more than one command per line
-            for line in commands.split(";"):
-                # remove rubbish
-                line = line.strip()
 
-                # extract line info from the current command line to create key
-                # info for SLURM
-                info = cactus_job_command_name(line)
-                assert info is not None, "processed Cactus command info must not be empty"
+def get_job_data(
+    job: CactusJob, round_: WorkflowRound, genomes: Sequence[str]
+) -> Tuple[List[str], List[str]]:
+    """Get the data read and written by a job.
 
-                # set Cactus log file for Toil outputsgi
-                if info["command"] != "halAppendSubtree" and info["command"] != "hal2fasta":
-                    line = f"{line} --logFile {root_dir}/{log_dir}/{info['command']}-{info['id']}.log"
+    Genomes are identified as "genome:<name>" and files as "file:<absolute path>".
 
-                # update the extra dependency between task types
-                extra_dependencies.append(info["variable"])
-                if info["command"] == "cactus-blast" or info["command"] == "cactus-align":
-                    extra_dependencies.pop()
+    Args:
+        job: The job.
+        round_: The round of `job`, used to resolve relative paths.
+        genomes: The genomes aligned by `job` if it is a cactus-blast or cactus-align job.
 
-                # enabling restart option for Cactus if a jobstore folder
-                # exists
-                if info["jobstore"] is not None:
-                    if os.path.isdir(f"{root_dir}/{info['jobstore']}"):
-                        line = f"{line} --restart"
+    Returns:
+        The list of data read by `job` and the list of data written by it.
 
-                # create individual bash script
-                individual_bashscript_filename = (
-                    f"{root_dir}/{script_dirs['separated']}/{info['command']}-{info['id']}.sh"
-                )
-                create_bash_script(filename=individual_bashscript_filename)
+    """
 
-                # get the SLURM string call
-                get_slurm_submission(
-                    job_name=f"{info['command']}-{info['id']}",
-                    variable_name=info["variable"],
-                    work_dir=root_dir,
-                    log_dir=f"{root_dir}/{log_dir}",
-                    script_filename=individual_bashscript_filename,
-                    partition=resources[info["command"]]["partition"],
-                    gpus=resources[info["command"]]["gpus"]
-                        if 'gpus' in resources[info["command"]] else None,
-                    cpus=resources[info["command"]]["cpus"],
-                    memory=resources[info["command"]]["memory"]
-                        if 'memory' in resources[info["command"]] else None,  # in MB
-                    time=resources[info["command"]]["time"],
-                    command=line.strip(),
-                    dependencies=intra_dependencies,
-                    singularity=True,
-                )
+    positionals = get_positional_args(job.line)
 
-                # update the intra dependency list between info['command']
-                if (
-                    info["command"] == "halAppendSubtree"
-                    or info["command"] == "cactus-blast"
-                    or info["command"] == "cactus-align"
-                ):
-                    intra_dependencies.clear()
-                    intra_dependencies.append(info["variable"])
+    def files(*indexes: int) -> List[str]:
+        return [f"file:{round_.resolve(positionals[i])}" for i in indexes if i < len(positionals)]
 
-                # store it in the aggregated bash script
-                appendln_file(
-                    filename=aggregated_bashscript_filename,
-                    line=f"source {individual_bashscript_filename}",
-                )
+    if job.command == "cactus-preprocess":
+        return [], [f"genome:{x}" for x in get_option_values(job.line, "--inputNames")]
 
-    # dependencies for the next batch
-    return extra_dependencies
+    if job.command == "cactus-blast":
+        return [f"genome:{x}" for x in genomes], files(2)
 
+    if job.command == "cactus-align":
+        return [f"genome:{x}" for x in genomes] + files(2), files(3)
 
-###################################################################
-###          SLURM  WORKFLOW BASH SCRIPT CREATOR                 ##
-###################################################################
+    if job.command == "hal2fasta":
+        return files(0), [f"genome:{positionals[1]}"] if len(positionals) > 1 else []
 
+    if job.command == "halAppendSubtree":
+        # the subtree is appended in place, so the output HAL file is also read
+        return files(1, 0), files(0)
+
+    return [], []
 
-def create_workflow_script(
-    root_dir: str, task_type: str, script_dir: str, workflow_filename: str
-) -> None:
-    """Create Cactus pipeline using Slurm dependencies.
+
+def link_dependencies(workflow: Workflow, ancestral_outgroups: bool = True) -> None:
+    """Create the dependencies between the jobs of the workflow.
+
+    Each job depends only on the jobs that produce the genomes and files it
+    reads, on the previous writer of the files it writes and on the jobs that
+    must read those files before they are overwritten. The genomes aligned by
+    cactus-blast and cactus-align are the children of `--root` in the seqfile,
+    plus the outgroup candidates.
 
     Args:
-        root_dir: Root directory under which bash scripts of `task_type` are located.
-        task_type: Type of the given task.
-        script_dir: The directory in which scripts of `task_type` are located.
-        workflow_filename: The name of the bash script that contains the Cactus pipeline.
+        workflow: The workflow whose jobs will be linked.
+        ancestral_outgroups: True if ancestral genomes of other subtrees may be
+            chosen as outgroups, as Cactus does by default, otherwise only
+            leaves are.
 
     """
 
-    # adding preprocess
-    appendln_file(filename=workflow_filename, line=f"\n### - {task_type} step\n")
-
-    # get path path for all-{}.sh bash script
-    path = f"{root_dir}/{script_dir}"
-    filenames = [x for x in os.listdir(path) if os.path.isfile(os.path.join(path, x))]
+    # seqfiles read so far, indexed by their path
+    seqfiles: Dict[str, Optional[SeqFile]] = {}
+
+    # last job that wrote each data and the jobs that read it since then
+    writers: Dict[str, str] = {}
+    readers: Dict[str, List[str]] = {}
+
+    # bit of each job and bitmask of the job plus all of its (transitive) dependencies
+    bits: Dict[str, int] = {}
+    closure: Dict[str, int] = {}
+
+    # genomes in the order they were first produced, and how many of them
+    # were produced by the rounds before the current one
+    produced: List[str] = []
+    previous_count = 0
+    current_round: Optional[WorkflowRound] = None
+
+    # outgroup candidates indexed by seqfile path, None if the subtree is unknown
+    outgroups: Dict[Optional[str], OutgroupCandidates] = {}
+
+    def get_outgroups(path: Optional[str]) -> OutgroupCandidates:
+        group = outgroups.setdefault(path, OutgroupCandidates())
+        if group.count == previous_count:
+            return group
+
+        # add the genomes produced since the last update
+        children = seqfiles[path].children if path is not None else {}  # type: ignore
+        names = [
+            x for x in produced[group.count : previous_count]
+            if path is None or ancestral_outgroups or x not in children
+        ]
+        group.count = previous_count
+        group.genomes.update(names)
+        candidates = [
+            x for x in dict.fromkeys(writers[f"genome:{x}"] for x in names)
+            if not group.mask & bits[x]
+        ]
+
+        # the candidates are shared by many jobs, so reduce their writers once
+        implied = group.closure & ~group.mask
+        for dep in candidates:
+            implied |= closure[dep] & ~bits[dep]
+        if implied & group.mask:
+            group.writers = [x for x in group.writers if not implied & bits[x]]
+            group.mask = sum(bits[x] for x in group.writers)
+        for dep in candidates:
+            if not implied & bits[dep]:
+                group.writers.append(dep)
+                group.mask |= bits[dep]
+        group.closure = implied | group.mask
+
+        return group
+
+    for index, (round_, job) in enumerate(workflow.iter_jobs()):
+
+        if round_ is not current_round:
+            current_round = round_
+            previous_count = len(produced)
+
+        genomes: List[str] = []
+        candidates: Optional[OutgroupCandidates] = None
+        if job.command in ("cactus-blast", "cactus-align"):
+            positionals = get_positional_args(job.line)
+            path = round_.resolve(positionals[1]) if len(positionals) > 1 else ""
+            if path not in seqfiles:
+                seqfiles[path] = parse_seqfile(path) if path else None
+            seqfile = seqfiles[path]
+
+            # outgroups are always produced by previous rounds; subtree
+            # members among them are pruned below as redundant
+            if seqfile is not None and job.id in seqfile.children:
+                genomes = list(seqfile.children[job.id])
+                candidates = get_outgroups(path)
+            else:
+                # no way to tell the subtree apart, so wait for every genome of previous rounds
+                if job.command == "cactus-blast":
+                    print(f"subtree of '{job.id}' not found in '{path}', depending on all previous genomes")
+                candidates = get_outgroups(None)
+
+        reads, writes = get_job_data(job, round_, genomes)
+
+        dependencies = [writers[x] for x in reads if x in writers]
+        for data in writes:
+            if data in writers:
+                dependencies.append(writers[data])
+
+                # a genome written again must wait for the jobs that read it as an outgroup
+                name = data.split(":", 1)[1]
+                for group in outgroups.values():
+                    if name in group.genomes:
+                        dependencies.extend(group.readers)
+            dependencies.extend(readers.get(data, []))
+
+        # remove duplicates and dependencies already implied by other dependencies
+        dependencies = [x for x in dict.fromkeys(dependencies) if x != job.variable]
+        implied = 0
+        job_closure = 0
+        for dep in dependencies:
+            implied |= closure[dep] & ~bits[dep]
+            job_closure |= closure[dep]
+
+        if candidates is not None:
+            implied |= candidates.closure & ~candidates.mask
+            job_closure |= candidates.closure
+            dependencies = [x for x in dependencies if not candidates.mask & bits[x]]
+            dependencies.extend(
+                candidates.writers if not candidates.mask & implied
+                else [x for x in candidates.writers if not implied & bits[x]]
+            )
+            candidates.readers.append(job.variable)
 
-    # check all files
-    for filename in filenames:
+        job.dependencies = [x for x in dependencies if not implied & bits[x]]
 
-        # update filename path
-        script = f"{path}/{filename}"
+        bits[job.variable] = 1 << index
+        closure[job.variable] = bits[job.variable] | job_closure
 
-        # filtering files that aren't executable
-        if os.path.isfile(script) and not os.access(script, os.X_OK):
-            continue
+        for data in reads:
+            readers.setdefault(data, []).append(job.variable)
+        for data in writes:
+            if data.startswith("genome:"):
+                name = data.split(":", 1)[1]
+                if data not in writers:
+                    produced.append(name)
 
-        appendln_file(filename=workflow_filename, line=" ".join(["source", script]))
+                # the outgroups produced again must be read from their new writer
+                for group in outgroups.values():
+                    if name in group.genomes:
+                        group.writers.append(job.variable)
+                        group.mask |= bits[job.variable]
+                        group.closure |= closure[job.variable]
+            writers[data] = job.variable
+            readers[data] = []
 
 
 ###################################################################
-###                             MAIN                             ##
+###                    WORKFLOW  STATE                           ##
 ###################################################################
 
-if __name__ == "__main__":
 
-    ###################################################################
-    ###                   PYTHON  ARGPARSE STEP                      ##
-    ###################################################################
+def get_job_outputs(
+    job: CactusJob, round_: WorkflowRound, seqfiles: Dict[str, Optional[SeqFile]]
+) -> List[str]:
+    """Get the files produced by a job.
 
-    # parse the args given
+    Args:
+        job: The job.
+        round_: The round of `job`, used to resolve relative paths.
+        seqfiles: Seqfiles read so far, indexed by their path.
+
+    Returns:
+        The absolute path of each output file of `job`.
+
+    """
+
+    outputs: List[str] = []
+    positionals = get_positional_args(job.line)
+
+    if job.command == "cactus-preprocess" and len(positionals) > 2:
+        # the preprocessed genomes are listed by the output seqfile
+        path = round_.resolve(positionals[2])
+        if path not in seqfiles:
+            seqfiles[path] = parse_seqfile(path)
+        seqfile = seqfiles[path]
+        if seqfile is not None:
+            outputs.extend(
+                round_.resolve(seqfile.paths[x])
+                for x in get_option_values(job.line, "--inputNames")
+                if x in seqfile.paths
+            )
+
+    elif job.command == "hal2fasta" and ">" in job.line:
+        outputs.append(round_.resolve(job.line.split(">", 1)[1].split()[0]))
+
+    else:
+        _, writes = get_job_data(job, round_, [])
+        outputs.extend(x.split(":", 1)[1] for x in writes if x.startswith("file:"))
+
+    return outputs
+
+
+def get_completed_jobs(workflow: Workflow, state: WorkflowState) -> Set[str]:
+    """Get the jobs that do not need to run again.
+
+    A job is completed if it succeeded, its outputs did not change since
+    then and all of its dependencies are completed as well.
+
+    Args:
+        workflow: The workflow.
+        state: The state of the jobs of a previous submission of the workflow.
+
+    Returns:
+        The variable names of the completed jobs.
+
+    """
+
+    jobs = state.get_jobs()
+    valid = state.get_valid_outputs()
+    completed: Set[str] = set()
+
+    for _, job in workflow.iter_jobs():
+        job_state = jobs.get(job.variable)
+        if (
+            job_state is not None
+            and job_state.status == "succeeded"
+            and all(valid.get(x, False) for x in job_state.outputs)
+            and completed.issuperset(job.dependencies)
+        ):
+            completed.add(job.variable)
+
+    return completed
+
+
+def register_jobs(workflow: Workflow, state: WorkflowState, reset: bool) -> None:
+    """Record the jobs of the workflow as generated.
+
+    Args:
+        workflow: The workflow.
+        state: The state database.
+        reset: True to forget the jobs of a previous submission of the workflow.
+
+    """
+
+    seqfiles: Dict[str, Optional[SeqFile]] = {}
+    jobs: List[Tuple[str, str, Sequence[str]]] = []
+
+    for round_, job in workflow.iter_jobs():
+        for step in job.steps:
+            jobs.append((step.variable, step.name, get_job_outputs(step, round_, seqfiles)))
+        if job.steps:
+            jobs.append((job.variable, job.name, []))
+        else:
+            jobs.append((job.variable, job.name, get_job_outputs(job, round_, seqfiles)))
+
+    state.register(jobs, reset=reset)
+
+
+###################################################################
+###                 GENOME-SIZE  RESOURCE SCALING                ##
+###################################################################
+
+
+def get_job_sizes(workflow: Workflow) -> Dict[str, int]:
+    """Compute the size of each job of the workflow from the genomes it touches.
+
+    Leaf lengths are read from the FASTA files listed in the input seqfile of
+    cactus-preprocess, and an ancestral genome is assumed to be as long as its
+    longest child. The genomes touched by each job are:
+
+        - cactus-preprocess: the genomes given to --inputNames;
+        - cactus-blast, cactus-align: the children of --root;
+        - hal2fasta: the exported genome;
+        - halAppendSubtree: the root of the appended subtree and its children.
+
+    Args:
+        workflow: The workflow.
+
+    Returns:
+        The sum of the lengths of the genomes touched by each job, indexed by
+        the variable name of the job.
+
+    """
+
+    tree: Dict[str, List[str]] = {}
+    paths: Dict[str, str] = {}
+
+    for round_, job in workflow.iter_jobs():
+        positionals = get_positional_args(job.line)
+        if job.command == "cactus-preprocess" and len(positionals) > 1:
+            seqfile = parse_seqfile(round_.resolve(positionals[1]))
+        elif job.command in ("cactus-blast", "cactus-align") and len(positionals) > 1 and not tree:
+            seqfile = parse_seqfile(round_.resolve(positionals[1]))
+        else:
+            continue
+
+        if seqfile is not None:
+            tree = tree or seqfile.children
+            for name, path in seqfile.paths.items():
+                paths.setdefault(name, round_.resolve(path))
+
+    sizes: Dict[str, int] = {}
+
+    def genome_size(name: str) -> int:
+        if name not in sizes:
+            if name in tree:
+                sizes[name] = max((genome_size(x) for x in tree[name]), default=0)
+            elif name in paths and os.path.isfile(paths[name]):
+                sizes[name] = get_fasta_length(paths[name])
+            else:
+                print(f"FASTA file of '{name}' not found, its size is assumed to be 0")
+                sizes[name] = 0
+        return sizes[name]
+
+    job_sizes = {}
+    for _, job in workflow.iter_jobs():
+        positionals = get_positional_args(job.line)
+
+        if job.command == "cactus-preprocess":
+            genomes = get_option_values(job.line, "--inputNames")
+        elif job.command in ("cactus-blast", "cactus-align"):
+            genomes = tree.get(job.id, [])
+        elif job.command == "hal2fasta":
+            genomes = positionals[1:2]
+        elif job.command == "halAppendSubtree":
+            genomes = positionals[2:3] + tree.get(positionals[2], []) if len(positionals) > 2 else []
+        else:
+            genomes = []
+
+        job_sizes[job.variable] = sum(genome_size(x) for x in genomes)
+
+    return job_sizes
+
+
+###################################################################
+###                 PREPROCESS  JOB BIN-PACKING                  ##
+###################################################################
+
+
+def pack_preprocess_jobs(
+    workflow: Workflow, sizes: Dict[str, int], target: int
+) -> None:
+    """Pack cactus-preprocess jobs into jobs that run them concurrently.
+
+    The jobs are bin-packed by the length of their genomes with the
+    first-fit decreasing heuristic, so that the sum of the lengths of each
+    packed job does not exceed `target` unless a single job already does.
+
+    Args:
+        workflow: The workflow whose cactus-preprocess jobs will be packed.
+        sizes: Size of each job, see `get_job_sizes`. It is updated with the
+            size of the packed jobs.
+        target: Maximum sum of the genome lengths of a packed job.
+
+    """
+
+    # jobs can only be packed with those of the same round and dependencies
+    candidates: Dict[Tuple, List[str]] = {}
+    for round_index, round_ in enumerate(workflow.rounds):
+        for variables in round_.groups.values():
+            for variable in variables:
+                job = workflow.jobs[variable]
+                if job.command == "cactus-preprocess" and not job.steps:
+                    key = (round_index, frozenset(job.dependencies))
+                    candidates.setdefault(key, []).append(variable)
+
+    count = 0
+    for variables in candidates.values():
+        bins: List[List[str]] = []
+        loads: List[int] = []
+
+        for variable in sorted(variables, key=lambda x: -sizes.get(x, 0)):
+            size = sizes.get(variable, 0)
+            index = next((i for i, load in enumerate(loads) if load + size <= target), None)
+            if index is None:
+                bins.append([variable])
+                loads.append(size)
+            else:
+                bins[index].append(variable)
+                loads[index] += size
+
+        # keep the workflow order inside of each packed job
+        order = {x: i for i, x in enumerate(variables)}
+        for members, load in zip(bins, loads):
+            if len(members) < 2:
+                continue
+
+            members.sort(key=order.get)
+            steps = [workflow.jobs[x] for x in members]
+            packed = CactusJob(
+                command="cactus-preprocess",
+                id=f"pack{count}",
+                variable=f"CACTUS_PREPROCESS_PACK_{count}",
+                jobstore=None,
+                line="; ".join(x.line for x in steps),
+                group=steps[0].group,
+                steps=steps,
+                concurrent=True,
+            )
+            workflow.replace_jobs(members, packed)
+            sizes[packed.variable] = load
+            count += 1
+
+
+def pack_gpu_jobs(
+    workflow: Workflow,
+    resources: Mapping[str, Any],
+    node_gpus: int,
+    node_cpus: Optional[int] = None,
+    sizes: Optional[Mapping[str, int]] = None,
+) -> None:
+    """Pack GPU jobs into jobs that take a whole GPU node and run them concurrently.
+
+    cactus-preprocess and cactus-blast jobs using fewer GPUs than a node are
+    bin-packed by their GPUs with the first-fit decreasing heuristic. Each
+    packed job gets its own slice of the GPUs of the node, and a share of its
+    CPUs in proportion to its GPUs if `node_cpus` is given.
+
+    Args:
+        workflow: The workflow whose GPU jobs will be packed.
+        resources: Slurm resources information.
+        node_gpus: Amount of GPUs of a node.
+        node_cpus: Amount of CPUs of a node.
+        sizes: Size of each job used to scale its resources, see `get_job_sizes`.
+
+    """
+
+    # jobs can only be packed with those of the same round and dependencies
+    candidates: Dict[Tuple, List[str]] = {}
+    gpus: Dict[str, int] = {}
+    for round_index, round_ in enumerate(workflow.rounds):
+        for variables in round_.groups.values():
+            for variable in variables:
+                job = workflow.jobs[variable]
+                if job.command not in ("cactus-preprocess", "cactus-blast") or job.steps:
+                    continue
+
+                job_gpus = SlurmResources.from_config(
+                    resources[job.command], size=None if sizes is None else sizes.get(variable)
+                ).gpus
+                if job_gpus and job_gpus < node_gpus:
+                    gpus[variable] = job_gpus
+                    key = (round_index, job.command, frozenset(job.dependencies))
+                    candidates.setdefault(key, []).append(variable)
+
+    count = 0
+    for variables in candidates.values():
+        bins: List[List[str]] = []
+        loads: List[int] = []
+
+        for variable in sorted(variables, key=lambda x: -gpus[x]):
+            index = next(
+                (i for i, load in enumerate(loads) if load + gpus[variable] <= node_gpus), None
+            )
+            if index is None:
+                bins.append([variable])
+                loads.append(gpus[variable])
+            else:
+                bins[index].append(variable)
+                loads[index] += gpus[variable]
+
+        # keep the workflow order inside of each packed job
+        order = {x: i for i, x in enumerate(variables)}
+        for members in bins:
+            if len(members) < 2:
+                continue
+
+            members.sort(key=order.get)
+            steps = [workflow.jobs[x] for x in members]
+
+            # give each job its own slice of the GPUs of the node
+            offset = 0
+            for step in steps:
+                step.devices = list(range(offset, offset + gpus[step.variable]))
+                offset += gpus[step.variable]
+                if node_cpus is not None:
+                    step.cpus = max(1, node_cpus * gpus[step.variable] // node_gpus)
+
+            command = steps[0].command
+            packed = CactusJob(
+                command=command,
+                id=f"gpupack{count}",
+                variable=f"{command.replace('-', '_').upper()}_GPU_PACK_{count}",
+                jobstore=None,
+                line="; ".join(x.line for x in steps),
+                group=steps[0].group,
+                steps=steps,
+                concurrent=True,
+            )
+            workflow.replace_jobs(members, packed)
+            count += 1
+
+
+def fuse_job_chains(
+    workflow: Workflow,
+    resources: Mapping[str, Any],
+    max_time: Optional[int] = None,
+    sizes: Optional[Mapping[str, int]] = None,
+) -> None:
+    """Fuse linear chains of jobs into jobs that run them in sequence.
+
+    A job is chained to the next one if it is its only dependent, the next job
+    has no other dependency, both belong to the same round and they request
+    the same partition and GPUs, e.g., cactus-align and hal2fasta of a subtree
+    or the halAppendSubtree calls of the merging step.
+
+    Args:
+        workflow: The workflow whose job chains will be fused.
+        resources: Slurm resources information.
+        max_time: Maximum sum of the time limits of a fused job, in seconds.
+        sizes: Size of each job used to scale its resources, see `get_job_sizes`.
+
+    """
+
+    dependents: Dict[str, List[str]] = {}
+    rounds: Dict[str, int] = {}
+    for round_index, round_ in enumerate(workflow.rounds):
+        for variables in round_.groups.values():
+            for variable in variables:
+                rounds[variable] = round_index
+                for dep in workflow.jobs[variable].dependencies:
+                    dependents.setdefault(dep, []).append(variable)
+
+    requests: Dict[str, SlurmResources] = {}
+
+    def get_request(variable: str) -> SlurmResources:
+        if variable not in requests:
+            requests[variable] = SlurmResources.from_config(
+                resources[workflow.jobs[variable].command],
+                size=None if sizes is None else sizes.get(variable),
+            )
+        return requests[variable]
+
+    def get_time(variable: str) -> int:
+        limit = get_request(variable).time
+        return 0 if limit is None else parse_time(limit)
+
+    chains: List[List[str]] = []
+    chained: Set[str] = set()
+    for _, job in workflow.iter_jobs():
+        if job.variable in chained or job.steps:
+            continue
+
+        chain = [job.variable]
+        chain_time = get_time(job.variable)
+        while len(dependents.get(chain[-1], [])) == 1:
+            variable = dependents[chain[-1]][0]
+            following = workflow.jobs[variable]
+            if (
+                following.steps
+                or following.dependencies != [chain[-1]]
+                or rounds[variable] != rounds[job.variable]
+                or get_request(variable).partition != get_request(job.variable).partition
+                or get_request(variable).gpus != get_request(job.variable).gpus
+                or (max_time is not None and chain_time + get_time(variable) > max_time)
+            ):
+                break
+
+            chain.append(variable)
+            chain_time += get_time(variable)
+
+        chained.update(chain)
+        if len(chain) > 1:
+            chains.append(chain)
+
+    for chain in chains:
+        steps = [workflow.jobs[x] for x in chain]
+        fused = CactusJob(
+            command=steps[0].command,
+            id=f"{steps[0].id}-fused",
+            variable=f"{steps[0].variable}_FUSED",
+            jobstore=None,
+            line="; ".join(x.line for x in steps),
+            group=steps[0].group,
+            steps=steps,
+            concurrent=False,
+        )
+        workflow.replace_jobs(chain, fused)
+
+
+###################################################################
+###                  SLURM BASH SCRIPT CREATOR                   ##
+###################################################################
+
+
+def get_slurm_dependency(variable_name: str, index: Optional[int] = None) -> str:
+    """Get the reference to a Slurm job ID to be used in a dependency list.
+
+    Args:
+        variable_name: The unique variable name of the job (or job array).
+        index: The index of the task if only one task of a job array is referenced.
+
+    Returns:
+        The bash expression that expands to the Slurm job ID.
+
+    """
+    if index is None:
+        return f"$TASK_{variable_name}"
+    return f"${{TASK_{variable_name}}}_{index}"
+
+
+def get_singularity_command(command: str, gpus: Optional[int]) -> str:
+    """Wrap a command to run via singularity.
+
+    Args:
+        command: The command.
+        gpus: Amount of GPUs used by the command.
+
+    Returns:
+        The command wrapped by singularity.
+
+    """
+
+    # get image PATH from environment variable
+    image = os.environ.get("CACTUS_IMAGE")
+
+    # for GPU usage, grab another image
+    if gpus is not None and gpus != "None":
+        image = f"--nv {os.environ.get('CACTUS_GPU_IMAGE')}"
+
+    # wrap the commands to use singularity
+    return f"singularity run {image} {command}"
+
+
+def get_steps_log(job_name: str, log_dir: str) -> str:
+    """Get the file recording the exit code of each step of a job, see `get_wrapped_steps`."""
+    return f"{log_dir}/{job_name}-${{SLURM_JOB_ID:-local}}.steps"
+
+
+def get_wrapped_steps(
+    job_name: str,
+    log_dir: str,
+    steps: Sequence[Tuple[str, str]],
+    concurrent: bool,
+    devices: Optional[Sequence[Sequence[int]]] = None,
+) -> str:
+    """Prepare the content of a job that runs several commands.
+
+    Each step writes its own stdout/stderr log files, unless the command
+    redirects its stdout itself, and its exit code is recorded in the
+    `<job_name>-<job id>.steps` file of `log_dir`.
+
+    Args:
+        job_name: Name for the Slurm job.
+        log_dir: Path to Cactus' log.
+        steps: The name and command of each step.
+        concurrent: True if the steps run concurrently, otherwise they run in
+            sequence and stop at the first failure.
+        devices: Indexes of the GPUs of the job used by each step, if the GPUs
+            are split between the steps.
+
+    Returns:
+        The content of the job, whose exit status is zero only if all steps succeed.
+
+    """
+
+    job_id = "${SLURM_JOB_ID:-local}"
+    steps_log = get_steps_log(job_name=job_name, log_dir=log_dir)
+    lines = ["STEP_EXIT=0"]
+
+    # the GPUs allocated to the job, or all of them outside of Slurm
+    if devices:
+        count = sum(len(x) for x in devices)
+        lines.append(
+            f'IFS=, read -r -a GPU_DEVICES <<< "${{CUDA_VISIBLE_DEVICES:-$(seq -s, 0 {count - 1})}}"'
+        )
+
+    for index, (name, command) in enumerate(steps):
+        redirections = f"> {log_dir}/{name}-{job_id}.out 2> {log_dir}/{name}-{job_id}.err"
+
+        if devices and devices[index]:
+            visible = ",".join(f"${{GPU_DEVICES[{x}]}}" for x in devices[index])
+            command = f'CUDA_VISIBLE_DEVICES="{visible}" {command}'
+
+        # grouped, so that a command redirecting its own stdout, e.g.,
+        # hal2fasta > Anc0.fa, keeps writing there and not into the log
+        command = f"{{ {command}; }} {redirections}"
+
+        if concurrent:
+            lines.append(f"{command} &")
+            lines.append("STEP_PIDS+=($!)")
+        else:
+            lines.append(
+                f'[ "$STEP_EXIT" -eq 0 ] && {{ {command}; STEP_CODE=$?; }} || STEP_CODE=skipped'
+            )
+            lines.append(f'echo "{name} $STEP_CODE" >> {steps_log}')
+            lines.append('[ "$STEP_CODE" = 0 ] || STEP_EXIT=1')
+
+    if concurrent:
+        names = " ".join(name for name, _ in steps)
+        lines.append(f"STEP_NAMES=({names})")
+        lines.append('for STEP_INDEX in "${!STEP_PIDS[@]}"; do')
+        lines.append('    wait "${STEP_PIDS[$STEP_INDEX]}"; STEP_CODE=$?')
+        lines.append(f'    echo "${{STEP_NAMES[$STEP_INDEX]}} $STEP_CODE" >> {steps_log}')
+        lines.append('    [ "$STEP_CODE" -eq 0 ] || STEP_EXIT=1')
+        lines.append("done")
+
+    lines.append('[ "$STEP_EXIT" -eq 0 ]')
+    return "\n".join(lines)
+
+
+# script updating the state database from the jobs
+STATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cactus_batcher_state.py")
+
+# script sampling the resource usage of the jobs if CACTUS_USAGE_LOGGER is set
+USAGE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "usage.py")
+
+# current time with microseconds, without forking a process on bash >= 5
+BASH_NOW = "${EPOCHREALTIME:-$(date +%s.%N)}"
+
+
+def get_lifecycle_record(
+    job_name: str,
+    log_dir: str,
+    round_name: str,
+    variables: Sequence[str],
+    dependencies: Sequence[str],
+    partition: Optional[str],
+) -> str:
+    """Prepare the command appending the lifecycle record of a job to its log.
+
+    The record is a JSON line written to `<job_name>.lifecycle` in `log_dir`,
+    one per attempt of the job, with the submission, start and end times of
+    the job, its exit code, the node running it and the resources allocated
+    by Slurm. It expects `LIFECYCLE_START`, `LIFECYCLE_END` and `STATUS` to
+    be set by the job, and the submission time in `CACTUS_SUBMIT_TIME`.
+
+    Args:
+        job_name: Name for the Slurm job.
+        log_dir: Path to Cactus' log.
+        round_name: Name of the round of the job.
+        variables: Variable names of the jobs run by this job.
+        dependencies: Variable names of the jobs that this job depends on.
+        partition: Slurm partition requested by the job, if any.
+
+    Returns:
+        The bash command line.
+
+    """
+
+    # values known when the workflow is generated
+    record = json.dumps(
+        {
+            "job": job_name,
+            "round": round_name,
+            "variables": list(variables),
+            "dependencies": list(dependencies),
+        }
+    )
+
+    # values only known when the job runs, as strings and as numbers; the
+    # times are strings, as $EPOCHREALTIME has the decimal separator of the
+    # locale, e.g., a comma, which would not be a valid JSON number
+    strings = {
+        "slurm_job_id": "${SLURM_JOB_ID:-}",
+        "partition": f"${{SLURM_JOB_PARTITION:-{partition or ''}}}",
+        "node": "${SLURMD_NODENAME:-$HOSTNAME}",
+        "cpus": "${SLURM_CPUS_PER_TASK:-}",
+        "memory": "${SLURM_MEM_PER_NODE:-}",
+        "gpus": "${SLURM_JOB_GPUS:-${CUDA_VISIBLE_DEVICES:-}}",
+        "submit": "${CACTUS_SUBMIT_TIME:-}",
+        "start": "$LIFECYCLE_START",
+        "end": "$LIFECYCLE_END",
+    }
+    numbers = {
+        "exit_code": "$STATUS",
+    }
+
+    template = record[:-1]
+    template += "".join(f', "{x}": "%s"' for x in strings)
+    template += "".join(f', "{x}": %s' for x in numbers)
+    values = " ".join(f'"{x}"' for x in list(strings.values()) + list(numbers.values()))
+
+    return f"printf '{template}}}\\n' {values} >> {log_dir}/{job_name}.lifecycle"
+
+
+def get_wrapped_job(
+    job_name: str,
+    log_dir: str,
+    gpus: Optional[int],
+    command: str,
+    singularity: bool = True,
+    state_db: Optional[str] = None,
+    variables: Sequence[str] = (),
+    round_name: Optional[str] = None,
+    dependencies: Sequence[str] = (),
+    partition: Optional[str] = None,
+    steps: bool = False,
+) -> str:
+    """Prepare the content of the job wrapped by a Slurm submission.
+
+    Args:
+        job_name: Name for the Slurm job.
+        log_dir: Path to Cactus' log.
+        gpus: Amount of GPUs to run the job.
+        command: Command to be wrapped by Slurm.
+        singularity: True if `command` should run via singularity.
+        state_db: Path of the state database that the job should update, if any.
+        variables: Variable names of the jobs run by this job.
+        round_name: Name of the round of the job, to record its lifecycle, see
+            `get_lifecycle_record`.
+        dependencies: Variable names of the jobs that this job depends on.
+        partition: Slurm partition requested by the job, if any.
+        steps: True if `command` runs several steps, see `get_wrapped_steps`,
+            whose own exit codes are recorded in the state database.
+
+    Returns:
+        The content of the job.
+
+    """
+
+    # define singularity
+    if singularity:
+        command = get_singularity_command(command=command, gpus=gpus)
+
+    # real wrapped job, keeping its exit code
+    before: List[str] = []
+    jobs = [command, "STATUS=$?"]
+    after: List[str] = []
+
+    # sample the resource usage of the job while it runs, from the counters
+    # of its cgroup if CACTUS_USAGE_LOGGER=cgroup, otherwise from its process tree
+    if os.environ.get("CACTUS_USAGE_LOGGER") is not None:
+        options = "" if gpus is None else " -g"
+        if os.environ["CACTUS_USAGE_LOGGER"] == "cgroup":
+            options = f"{options} --cgroup"
+        interval = os.environ.get("CACTUS_USAGE_INTERVAL", "1")
+        jobs.insert(
+            0,
+            f"python3 {USAGE_SCRIPT} -p $$ -i {interval}{options} "
+            f"-o {log_dir}/{job_name}.usage.csv & USAGE_PID=$!",
+        )
+        jobs.append('kill "$USAGE_PID" 2> /dev/null; wait "$USAGE_PID"')
+
+    # record the job lifecycle
+    if round_name is not None:
+        before.append(f"LIFECYCLE_START={BASH_NOW}")
+        after.append(f"LIFECYCLE_END={BASH_NOW}")
+        after.append(
+            get_lifecycle_record(
+                job_name=job_name,
+                log_dir=log_dir,
+                round_name=round_name,
+                variables=variables,
+                dependencies=dependencies,
+                partition=partition,
+            )
+        )
+
+    # update the state database
+    if state_db is not None:
+        state = f"python3 {STATE_SCRIPT} --db {state_db}"
+        names = " ".join(variables)
+        before.append(f'{state} running {names} --slurm_job_id "${{SLURM_JOB_ID:-}}" || true')
+        options = f' --steps "{get_steps_log(job_name=job_name, log_dir=log_dir)}"' if steps else ""
+        after.append(f'{state} finish "$STATUS" {names}{options} || true')
+
+    return "\n\n".join(before + jobs + after + ['exit "$STATUS"'])
+
+
+def get_slurm_submission(
+    job_name: str,
+    variable_name: str,
+    work_dir: str,
+    log_dir: str,
+    partition: str,
+    gpus: int,
+    cpus: int,
+    memory: int,
+    time: str,
+    job_filename: str,
+    dependencies: Sequence[str],
+    array: Optional[int] = None,
+) -> str:
+    """Prepare a Slurm string call.
+
+    Args:
+        job_name: Name for the Slurm job.
+        variable_name: A unique variable name to identify the given command.
+        work_dir: Location where the slurm should run the command.
+        log_dir: Path to Cactus' log.
+        partition: Slurm partition name to dispatch the job.
+        gpus: Amount of GPUs to run the job.
+        cpus: Amount of CPUs to run the job.
+        job_filename: Path of the job to be wrapped by Slurm.
+        dependencies: List of Job IDs that this job depends on, see `get_slurm_dependency`.
+        array: Amount of tasks if the submission is a job array.
+
+    Returns:
+        The Slurm batch submission command line.
+
+    """
+
+    # Slurm job ID placeholder for the log files
+    job_id = "%j" if array is None else "%A_%a"
+
+    # sbatch command line
+    # the submission time is recorded by the lifecycle of the job, see `get_lifecycle_record`
+    sbatch = [f"TASK_{variable_name}=$(CACTUS_SUBMIT_TIME={BASH_NOW} sbatch", "--parsable", "--requeue"]
+    sbatch.append(f"-J {job_name}")
+
+    if work_dir is not None:
+        sbatch.append(f"-D {work_dir}")
+
+    sbatch.append(f"-o {log_dir}/{job_name}-{job_id}.out")
+    sbatch.append(f"-e {log_dir}/{job_name}-{job_id}.err")
+
+    if array is not None:
+        sbatch.append(f"--array=0-{array - 1}")
+
+    if gpus is not None and gpus != "None":
+        sbatch.append(f"--gres=gpu:{gpus}")
+    else:
+        sbatch.append(f"-p {partition}")
+    
+    if cpus is not None:
+        sbatch.append(f"--cpus-per-task {cpus}")
+
+    if memory is not None:
+        sbatch.append(f"--mem={memory}")
+    
+    if time is not None:
+        sbatch.append(f"--time={time}")
+
+    if dependencies is not None and len(dependencies) > 0:
+        sbatch.append(f"--dependency=afterok:{':'.join(dependencies)}")
+
+    # wrap the commands for SLURM
+    sbatch.append(f'--wrap "source {job_filename}")')
+
+    return " ".join(sbatch)
+
+
+def group_slurm_arrays(workflow: Workflow) -> Dict[str, List[str]]:
+    """Group homogeneous jobs into Slurm job arrays.
+
+    Jobs of the same round are grouped when they share the same resource class
+    (i.e., the same key in the slurm configuration file), the same resources and
+    the same dependencies.
+
+    Args:
+        workflow: The workflow whose jobs will be grouped.
+
+    Returns:
+        The variable names of the jobs of each job array, indexed by the
+        variable name of the job array. Arrays of a single job are discarded.
+
+    """
+
+    groups: Dict[Tuple, List[str]] = {}
+    for round_index, round_ in enumerate(workflow.rounds):
+        for variables in round_.groups.values():
+            for variable in variables:
+                job = workflow.jobs[variable]
+                key = (
+                    round_index,
+                    job.command,
+                    astuple(job.resources),
+                    frozenset(job.dependencies),
+                )
+                groups.setdefault(key, []).append(variable)
+
+    arrays = {}
+    for key, variables in groups.items():
+        if len(variables) > 1:
+            variable = re.sub("[^a-zA-Z0-9]", "_", f"{key[1]}_array_{len(arrays)}").upper()
+            arrays[variable] = variables
+
+    return arrays
+
+
+def slurmify(
+    workflow: Workflow,
+    resources: Mapping[str, Any],
+    arrays: bool = False,
+    sizes: Optional[Mapping[str, int]] = None,
+    state_db: Optional[str] = None,
+    shard_size: Optional[int] = None,
+) -> None:
+    """Wraps each command line of the workflow into a Slurm job.
+
+    Args:
+        workflow: The workflow whose jobs will be wrapped.
+        resources: Slurm resources information.
+        arrays: True if homogeneous jobs should be submitted as Slurm job arrays.
+        sizes: Size of each job used to scale its resources, see `get_job_sizes`.
+        state_db: Path of the state database updated by the jobs, if any.
+        shard_size: Maximum amount of scripts per directory, above which the
+            scripts of each job are spread over subdirectories.
+
+    """
+
+    # jobstores found on disk, listed once per jobstore parent directory
+    jobstores: Dict[str, Set[str]] = {}
+
+    for round_, job in workflow.iter_jobs():
+        for step in job.steps or [job]:
+            step.resources = SlurmResources.from_config(
+                resources[step.command], size=None if sizes is None else sizes.get(step.variable)
+            )
+            if step.cpus is not None:
+                step.resources.cpus = step.cpus
+        if job.steps:
+            job.resources = SlurmResources.combine(
+                [x.resources for x in job.steps], concurrent=job.concurrent
+            )
+
+    def command_line(job: CactusJob, round_: WorkflowRound) -> str:
+        line = job.line
+
+        # set Cactus log file for Toil outputs
+        if job.command != "halAppendSubtree" and job.command != "hal2fasta":
+            line = f"{line} --logFile {round_.root_dir}/{round_.log_dir}/{job.name}.log"
+
+        # enabling restart option for Cactus if a jobstore folder
+        # exists
+        if job.jobstore is not None:
+            parent, name = os.path.split(round_.resolve(job.jobstore))
+            if parent not in jobstores:
+                jobstores[parent] = (
+                    {x.name for x in os.scandir(parent) if x.is_dir()}
+                    if os.path.isdir(parent) else set()
+                )
+            if name in jobstores[parent]:
+                line = f"{line} --restart"
+
+        return line.strip()
+
+    # job array (and task index) of each job submitted as part of a job array
+    slurm_arrays = group_slurm_arrays(workflow) if arrays else {}
+    array_tasks = {
+        variable: (array, index)
+        for array, variables in slurm_arrays.items()
+        for index, variable in enumerate(variables)
+    }
+
+    def dependency(variable: str, dependencies: Set[str]) -> str:
+        if variable not in array_tasks:
+            return get_slurm_dependency(variable)
+
+        # depending on every task of the array is depending on the array itself
+        array, index = array_tasks[variable]
+        if dependencies.issuperset(slurm_arrays[array]):
+            return get_slurm_dependency(array)
+        return get_slurm_dependency(array, index)
+
+    for round_ in workflow.rounds:
+
+        # shard the directory of the individual scripts if it gets too large,
+        # two scripts being created per job
+        shards = 1
+        if shard_size:
+            shards = math.ceil(2 * sum(len(x) for x in round_.groups.values()) / shard_size)
+
+        def separated_dir(job: CactusJob) -> str:
+            path = f"{round_.root_dir}/{round_.script_dirs['separated']}"
+            if shards > 1:
+                path = f"{path}/{zlib.crc32(job.name.encode()) % shards:03d}"
+            return path
+
+        for group, variables in round_.groups.items():
+
+            # create aggregated bash script
+            aggregated_bashscript_filename = f"{round_.root_dir}/{round_.script_dirs['all']}/{group}.sh"
+            workflow.emit(aggregated_bashscript_filename, "#!/bin/bash", executable=True)
+
+            for variable in variables:
+                job = workflow.jobs[variable]
+                log_dir = f"{round_.root_dir}/{round_.log_dir}"
+
+                # several command lines wrapped into a single job
+                if job.steps:
+                    command = get_wrapped_steps(
+                        job_name=job.name,
+                        log_dir=log_dir,
+                        steps=[
+                            (
+                                step.name,
+                                get_singularity_command(
+                                    command=command_line(step, round_), gpus=step.resources.gpus
+                                ),
+                            )
+                            for step in job.steps
+                        ],
+                        concurrent=job.concurrent,
+                        devices=[x.devices for x in job.steps] if job.steps[0].devices else None,
+                    )
+                else:
+                    command = command_line(job, round_)
+
+                # create the job wrapped by Slurm
+                individual_bashscript_filename = f"{separated_dir(job)}/{job.name}.sh"
+                job_filename = individual_bashscript_filename.replace(".sh", "-job.sh")
+                job.script = job_filename
+                workflow.emit(
+                    job_filename,
+                    get_wrapped_job(
+                        job_name=job.name,
+                        log_dir=log_dir,
+                        gpus=job.resources.gpus,
+                        command=command,
+                        singularity=not job.steps,
+                        state_db=state_db,
+                        variables=[job.variable] + [x.variable for x in job.steps],
+                        round_name=round_.name,
+                        dependencies=job.dependencies,
+                        partition=job.resources.partition,
+                        steps=bool(job.steps),
+                    ),
+                )
+
+                # the job array is submitted along with its first task
+                array_name = None
+                if variable in array_tasks:
+                    array_name, index = array_tasks[variable]
+                    if index > 0:
+                        continue
+
+                    # per-index command table
+                    members = slurm_arrays[array_name]
+                    individual_bashscript_filename = (
+                        f"{separated_dir(job)}/{job.command}-array-{job.id}.sh"
+                    )
+                    job_filename = individual_bashscript_filename.replace(".sh", "-job.sh")
+                    workflow.emit(job_filename, "TASKS=(")
+                    for member in members:
+                        workflow.emit(
+                            job_filename,
+                            f"{separated_dir(workflow.jobs[member])}/{workflow.jobs[member].name}-job.sh",
+                        )
+                    workflow.emit(job_filename, ")")
+                    workflow.emit(job_filename, 'source "${TASKS[$SLURM_ARRAY_TASK_ID]}"')
+
+                # get the SLURM string call
+                dependencies = set(job.dependencies)
+                sbatch = get_slurm_submission(
+                    job_name=job.name if array_name is None else f"{job.command}-array-{job.id}",
+                    variable_name=job.variable if array_name is None else array_name,
+                    work_dir=round_.root_dir,
+                    log_dir=log_dir,
+                    partition=job.resources.partition,
+                    gpus=job.resources.gpus,
+                    cpus=job.resources.cpus,
+                    memory=job.resources.memory,  # in MB
+                    time=job.resources.time,
+                    job_filename=job_filename,
+                    dependencies=list(
+                        dict.fromkeys(dependency(x, dependencies) for x in job.dependencies)
+                    ),
+                    array=None if array_name is None else len(slurm_arrays[array_name]),
+                )
+
+                # create individual bash script
+                workflow.emit(individual_bashscript_filename, "#!/bin/bash", executable=True)
+                workflow.emit(individual_bashscript_filename, sbatch)
+
+                # keep track of the Slurm job ID of each job
+                if state_db is not None:
+                    if array_name is None:
+                        submitted = [f'"{variable} {get_slurm_dependency(variable)}"']
+                    else:
+                        submitted = [
+                            f'"{x} {get_slurm_dependency(array_name, i)}"'
+                            for i, x in enumerate(slurm_arrays[array_name])
+                        ]
+                    workflow.emit(
+                        individual_bashscript_filename,
+                        f"printf '%s\\n' {' '.join(submitted)} >> {state_db}.submitted",
+                    )
+
+                # store it in the aggregated bash script
+                workflow.emit(
+                    aggregated_bashscript_filename,
+                    f"source {individual_bashscript_filename}",
+                )
+
+
+###################################################################
+###          SLURM  WORKFLOW BASH SCRIPT CREATOR                 ##
+###################################################################
+
+
+def create_workflow_script(workflow: Workflow, workflow_filename: str) -> None:
+    """Create Cactus pipeline using Slurm dependencies.
+
+    Args:
+        workflow: The workflow whose aggregated bash scripts will be called.
+        workflow_filename: The name of the bash script that contains the Cactus pipeline.
+
+    """
+
+    workflow.emit(workflow_filename, "#!/bin/bash", executable=True)
+
+    for round_ in workflow.rounds:
+
+        # adding task type
+        workflow.emit(workflow_filename, f"### - {round_.task_type} step")
+
+        for group in round_.groups:
+            script = f"{round_.root_dir}/{round_.script_dirs['all']}/{group}.sh"
+            workflow.emit(workflow_filename, " ".join(["source", script]))
+
+
+def write_workflow(workflow: Workflow, threads: int = 8, replace: bool = True) -> None:
+    """Create the directories of the workflow and write its files.
+
+    The filesystem operations are independent of each other, so they are
+    spread over a bounded pool of threads to hide the latency of network
+    filesystems.
+
+    Args:
+        workflow: The workflow to be written.
+        threads: Maximum amount of concurrent filesystem operations.
+        replace: True to replace the directories of a previous workflow,
+            otherwise only the missing ones are created, e.g., to keep the
+            logs of a previous submission when resubmitting.
+
+    """
+
+    # script and log directories at the root directory of each round
+    directories = [
+        f"{round_.root_dir}/{x}"
+        for round_ in workflow.rounds
+        for x in list(round_.script_dirs.values()) + [round_.log_dir]
+    ]
+
+    # subdirectories of the sharded script directories
+    subdirectories = set(os.path.dirname(x) for x in workflow.files).difference(directories)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+
+        # replace the directories of a previous workflow
+        list(pool.map(lambda x: make_or_replace_dir(x, force=replace), dict.fromkeys(directories)))
+        list(pool.map(make_or_replace_dir, sorted(subdirectories)))
+
+        # create links needed for execution
+        list(pool.map(lambda x: create_symlinks(src_dirs=x.symlinks, dest=x.root_dir), workflow.rounds))
+
+        list(
+            pool.map(
+                lambda x: write_file(
+                    filename=x[0], lines=x[1], executable=x[0] in workflow.executables
+                ),
+                workflow.files.items(),
+            )
+        )
+
+
+###################################################################
+###                  LOCAL  WORKFLOW EXECUTOR                    ##
+###################################################################
+
+
+def run_job_script(job: CactusJob, round_: WorkflowRound, env: Mapping[str, str]) -> int:
+    """Run the job wrapped by Slurm on the local node.
+
+    Args:
+        job: The job to run.
+        round_: The round of `job`.
+        env: The environment variables of the job.
+
+    Returns:
+        The exit code of the job.
+
+    """
+    log = f"{round_.root_dir}/{round_.log_dir}/{job.name}-local"
+    with open(f"{log}.out", "w", encoding="utf-8") as out, open(
+        f"{log}.err", "w", encoding="utf-8"
+    ) as err:
+        return subprocess.call(
+            ["bash", str(job.script)], cwd=round_.root_dir, stdout=out, stderr=err, env=dict(env)
+        )
+
+
+@dataclass
+class LocalExecutor:
+    """Run the jobs of a workflow on a single node with a process pool.
+
+    The `cpus`, `memory` and `gpus` requested by each job are taken from the
+    budget of the node while it runs, and a job starts as soon as its
+    dependencies succeed and its resources fit in what is left.
+
+    Attributes:
+        cpus: Amount of CPUs of the node.
+        memory: Amount of memory (in MB) of the node.
+        gpus: Amount of GPUs of the node.
+        runner: Function that runs a job and returns its exit code.
+
+    """
+
+    cpus: int
+    memory: int
+    gpus: int = 0
+    runner: Callable[[CactusJob, WorkflowRound, Mapping[str, str]], int] = run_job_script
+
+    def request(self, job: CactusJob) -> Tuple[int, int, int]:
+        """Get the resources of a job, capped to the budget of the node."""
+        request = (
+            int(job.resources.cpus or 1),
+            parse_memory(job.resources.memory) or 0,
+            int(job.resources.gpus or 0),
+        )
+        capped = (
+            min(request[0], self.cpus),
+            min(request[1], self.memory),
+            min(request[2], self.gpus),
+        )
+        if capped != request:
+            print(f"{job.name} requests more resources than available, running it with {capped}")
+        return capped
+
+    def run(self, workflow: Workflow) -> Dict[str, Optional[int]]:
+        """Run every job of the workflow.
+
+        Args:
+            workflow: The workflow to run.
+
+        Returns:
+            The exit code of each job, or None if it has not run because one
+            of its dependencies failed.
+
+        """
+
+        rounds = {job.variable: round_ for round_, job in workflow.iter_jobs()}
+        status: Dict[str, Optional[int]] = {}
+
+        # jobs waiting for their dependencies and the jobs waiting for them
+        waiting = {x: set(job.dependencies) for x, job in workflow.jobs.items()}
+        dependents: Dict[str, List[str]] = {}
+        for variable, dependencies in waiting.items():
+            for dep in dependencies:
+                dependents.setdefault(dep, []).append(variable)
+        ready = [x for x in rounds if not waiting[x]]
+
+        cpus, memory = self.cpus, self.memory
+        devices = list(range(self.gpus))
+        running: Dict[Future, Tuple[str, Tuple[int, int, int], List[int]]] = {}
+
+        # every job is submitted when the workflow starts, as with Slurm
+        submit_time = f"{time.time():.6f}"
+
+        with ThreadPoolExecutor(max_workers=max(1, self.cpus)) as pool:
+            while ready or running:
+
+                # start every ready job that fits in the budget left, in workflow order
+                for variable in list(ready):
+                    job = workflow.jobs[variable]
+                    request = self.request(job)
+                    if request[0] > cpus or request[1] > memory or request[2] > len(devices):
+                        continue
+
+                    cpus -= request[0]
+                    memory -= request[1]
+                    job_devices, devices = devices[: request[2]], devices[request[2]:]
+
+                    env = dict(os.environ)
+                    env["CUDA_VISIBLE_DEVICES"] = ",".join(str(x) for x in job_devices)
+                    env["SLURM_CPUS_PER_TASK"] = str(request[0])
+                    env["CACTUS_SUBMIT_TIME"] = submit_time
+
+                    ready.remove(variable)
+                    future = pool.submit(self.runner, job, rounds[variable], env)
+                    running[future] = (variable, request, job_devices)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    variable, request, job_devices = running.pop(future)
+                    cpus += request[0]
+                    memory += request[1]
+                    devices.extend(job_devices)
+
+                    try:
+                        status[variable] = future.result()
+                    except OSError as err:
+                        print(f"{workflow.jobs[variable].name} could not run: {err}")
+                        status[variable] = -1
+
+                    if status[variable] == 0:
+                        for dependent in dependents.get(variable, []):
+                            waiting[dependent].discard(variable)
+                            if not waiting[dependent]:
+                                ready.append(dependent)
+                    else:
+                        print(f"{workflow.jobs[variable].name} failed with exit code {status[variable]}")
+
+        # jobs that never became ready
+        for variable in workflow.jobs:
+            status.setdefault(variable, None)
+
+        return status
+
+
+###################################################################
+###                WORKFLOW  MAKESPAN SIMULATOR                  ##
+###################################################################
+
+
+@dataclass
+class SimulatedPartition:
+    """A Slurm partition of the simulated cluster.
+
+    Attributes:
+        nodes: Amount of nodes of the partition.
+        cpus: Amount of CPUs per node, or None if every job takes a whole node.
+        gpus: Amount of GPUs per node.
+
+    """
+
+    nodes: int
+    cpus: Optional[int] = None
+    gpus: int = 0
+
+    @classmethod
+    def from_string(cls, value: str) -> Tuple[str, "SimulatedPartition"]:
+        """Parse a partition given as NAME=NODES[:CPUS[:GPUS]], e.g., gpu=4:32:4."""
+        name, _, spec = value.partition("=")
+        fields = spec.split(":")
+        try:
+            return name, cls(
+                nodes=int(fields[0]),
+                cpus=int(fields[1]) if len(fields) > 1 and fields[1] else None,
+                gpus=int(fields[2]) if len(fields) > 2 else 0,
+            )
+        except ValueError as err:
+            raise argparse.ArgumentTypeError(
+                f"'{value}' is not in the NAME=NODES[:CPUS[:GPUS]] format"
+            ) from err
+
+
+def parse_runtimes(filenames: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+    """Parse runtime history tables in the `job;count;mean;stdev` format of log-extracter.py.
+
+    Rows of the same job found in several tables are pooled together.
+
+    Args:
+        filenames: Paths of the tables.
+
+    Returns:
+        The mean and standard deviation of the runtime (in seconds) of each job.
+
+    """
+
+    stats: Dict[str, Tuple[int, float, float]] = {}
+
+    for filename in filenames:
+        for line in read_file(filename):
+            fields = line.strip().split(";")
+            if len(fields) != 4:
+                continue
+            try:
+                count, runtime, stdev = int(fields[1]), float(fields[2]), float(fields[3])
+            except ValueError:
+                continue
+
+            # pool count, sum and sum of squares
+            total = stats.get(fields[0], (0, 0.0, 0.0))
+            stats[fields[0]] = (
+                total[0] + count,
+                total[1] + count * runtime,
+                total[2] + count * (stdev**2 + runtime**2),
+            )
+
+    runtimes = {}
+    for job, (count, total, squares) in stats.items():
+        if count > 0:
+            runtime = total / count
+            runtimes[job] = (runtime, max(squares / count - runtime**2, 0.0) ** 0.5)
+    return runtimes
+
+
+@dataclass
+class SimulationResult:
+    """Outcome of a simulated execution of a workflow.
+
+    Attributes:
+        makespan: Time (in seconds) to run the whole workflow.
+        start: Start time of each job.
+        end: End time of each job.
+        critical_path: Variable names of the jobs on the critical path, in order.
+        timeline: Samples of (time, partition, used nodes, used CPUs, used GPUs).
+
+    """
+
+    makespan: float
+    start: Dict[str, float]
+    end: Dict[str, float]
+    critical_path: List[str]
+    timeline: List[Tuple[float, str, int, int, int]]
+
+
+@dataclass
+class WorkflowSimulator:
+    """Discrete-event simulator of a workflow running on a Slurm cluster.
+
+    Jobs start in workflow order as soon as their dependencies end and a node of
+    their partition has room for them. Partitions not described are unbounded.
+
+    Attributes:
+        partitions: The simulated partitions, indexed by their name.
+        runtimes: Mean and standard deviation of the runtime of each job name or command.
+        default_runtime: Runtime of jobs without any history.
+
+    """
+
+    partitions: Mapping[str, SimulatedPartition]
+    runtimes: Mapping[str, Tuple[float, float]]
+    default_runtime: float = 0.0
+
+    def runtime(self, job: CactusJob, rng: Optional[random.Random] = None) -> float:
+        """Get the runtime of a job, sampled from a normal distribution if `rng` is given."""
+        if job.steps:
+            runtimes = [self.runtime(x, rng) for x in job.steps]
+            return max(runtimes) if job.concurrent else sum(runtimes)
+
+        mean, stdev = self.runtimes.get(
+            job.name, self.runtimes.get(job.command, (self.default_runtime, 0.0))
+        )
+        if rng is None:
+            return mean
+        return max(rng.gauss(mean, stdev), 0.0)
+
+    def run(self, workflow: Workflow, rng: Optional[random.Random] = None) -> SimulationResult:
+        """Simulate the execution of a workflow.
+
+        Args:
+            workflow: The workflow to simulate.
+            rng: Random generator to sample runtimes, otherwise mean runtimes are used.
+
+        Returns:
+            The outcome of the simulation.
+
+        Raises:
+            ValueError: If a job does not fit in any node of its partition.
+
+        """
+
+        order = {job.variable: i for i, (_, job) in enumerate(workflow.iter_jobs())}
+        waiting = {x: set(job.dependencies) for x, job in workflow.jobs.items()}
+        dependents: Dict[str, List[str]] = {}
+        for variable, dependencies in waiting.items():
+            for dep in dependencies:
+                dependents.setdefault(dep, []).append(variable)
+
+        # free CPUs (None for whole-node jobs) and GPUs of each node of each partition
+        free = {
+            name: [[x.cpus, x.gpus] for _ in range(x.nodes)] for name, x in self.partitions.items()
+        }
+        placement: Dict[str, Tuple[str, int, int, int]] = {}
+
+        start: Dict[str, float] = {}
+        end: Dict[str, float] = {}
+        blocked_by: Dict[str, str] = {}
+        timeline: List[Tuple[float, str, int, int, int]] = []
+        events: List[Tuple[float, int, str]] = []
+
+        ready = sorted((x for x in waiting if not waiting[x]), key=order.get)
+        now = 0.0
+        last_finished: Dict[str, str] = {}
+
+        def fit(job: CactusJob) -> Optional[Tuple[str, int, int, int]]:
+            partition = job.resources.partition
+            if partition not in self.partitions:
+                return (str(partition), -1, 0, 0)
+
+            spec = self.partitions[partition]
+            cpus = int(job.resources.cpus or 1)
+            gpus = int(job.resources.gpus or 0)
+            if gpus > spec.gpus or (spec.cpus is not None and cpus > spec.cpus):
+                raise ValueError(f"{job.name} does not fit in any node of partition '{partition}'")
+
+            for index, (free_cpus, free_gpus) in enumerate(free[partition]):
+                if free_gpus < gpus:
+                    continue
+                if spec.cpus is None:
+                    # whole-node jobs
+                    if free_cpus is None and free_gpus == spec.gpus:
+                        return (partition, index, 0, gpus)
+                elif free_cpus >= cpus:
+                    return (partition, index, cpus, gpus)
+            return None
+
+        def sample() -> None:
+            for name, nodes in free.items():
+                spec = self.partitions[name]
+                timeline.append((
+                    now,
+                    name,
+                    sum(1 for x in nodes if x[0] != spec.cpus or x[1] != spec.gpus),
+                    sum(spec.cpus - x[0] for x in nodes) if spec.cpus is not None else 0,
+                    sum(spec.gpus - x[1] for x in nodes),
+                ))
+
+        while ready or events:
+            for variable in list(ready):
+                job = workflow.jobs[variable]
+                slot = fit(job)
+                if slot is None:
+                    continue
+
+                partition, index, cpus, gpus = slot
+                if index >= 0:
+                    # whole-node jobs leave no CPU behind
+                    node = free[partition][index]
+                    node[0] = -1 if node[0] is None else node[0] - cpus
+                    node[1] -= gpus
+                placement[variable] = slot
+
+                # what held the job back: the last dependency or the resources released last
+                latest = max(job.dependencies, key=lambda x: end[x], default=None)
+                if latest is not None and end[latest] >= now:
+                    blocked_by[variable] = latest
+                elif partition in last_finished and now > 0:
+                    blocked_by[variable] = last_finished[partition]
+
+                ready.remove(variable)
+                start[variable] = now
+                heapq.heappush(events, (now + self.runtime(job, rng), order[variable], variable))
+
+            sample()
+            if not events:
+                break
+
+            now, _, variable = heapq.heappop(events)
+            end[variable] = now
+
+            partition, index, cpus, gpus = placement[variable]
+            if index >= 0:
+                node = free[partition][index]
+                node[0] = None if self.partitions[partition].cpus is None else node[0] + cpus
+                node[1] += gpus
+                last_finished[partition] = variable
+
+            for dependent in dependents.get(variable, []):
+                waiting[dependent].discard(variable)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+            ready.sort(key=order.get)
+
+        if len(end) != len(workflow.jobs):
+            raise ValueError("The workflow contains a dependency cycle")
+
+        # walk back from the job that ends last
+        critical_path = []
+        variable = max(end, key=lambda x: end[x], default=None)
+        while variable is not None:
+            critical_path.append(variable)
+            variable = blocked_by.get(variable)
+        critical_path.reverse()
+
+        return SimulationResult(
+            makespan=max(end.values(), default=0.0),
+            start=start,
+            end=end,
+            critical_path=critical_path,
+            timeline=timeline,
+        )
+
+
+def get_utilisation(
+    result: SimulationResult, partitions: Mapping[str, SimulatedPartition]
+) -> Dict[str, Tuple[float, float, float]]:
+    """Compute the average utilisation of each partition during a simulation.
+
+    Args:
+        result: The outcome of the simulation.
+        partitions: The simulated partitions, indexed by their name.
+
+    Returns:
+        The fraction of nodes, CPUs and GPUs in use on average for each partition.
+
+    """
+
+    utilisation = {}
+    for name, spec in partitions.items():
+        samples = [x for x in result.timeline if x[1] == name]
+        used = [0.0, 0.0, 0.0]
+
+        # the timeline is piecewise constant; the last sample of a time wins
+        for current, following in zip(samples, samples[1:]):
+            elapsed = following[0] - current[0]
+            used[0] += current[2] * elapsed
+            used[1] += current[3] * elapsed
+            used[2] += current[4] * elapsed
+
+        capacity = [spec.nodes, spec.nodes * (spec.cpus or 0), spec.nodes * spec.gpus]
+        utilisation[name] = tuple(  # type: ignore
+            x / (y * result.makespan) if y and result.makespan else 0.0
+            for x, y in zip(used, capacity)
+        )
+
+    return utilisation
+
+
+###################################################################
+###                             MAIN                             ##
+###################################################################
+
+if __name__ == "__main__":
+
+    ###################################################################
+    ###                   PYTHON  ARGPARSE STEP                      ##
+    ###################################################################
+
+    # parse the args given
     args = create_argparser().parse_args()
 
     # get absolute path
@@ -799,7 +3028,6 @@ if __name__ == "__main__":
                         "all": "scripts/all",
                         "separated": "scripts/separated",
                     },
-                    "rounds": [None],
                 },
             },
             "alignments": {
@@ -813,7 +3041,6 @@ if __name__ == "__main__":
                         "all": "scripts/all",
                         "separated": "scripts/separated",
                     },
-                    "rounds": [None],
                 },
             },
             "merging": {
@@ -830,7 +3057,6 @@ if __name__ == "__main__":
                         "all": "scripts/all",
                         "separated": "scripts/separated",
                     },
-                    "rounds": [None],
                 },
             },
         },
@@ -840,6 +3066,9 @@ if __name__ == "__main__":
     ###               CACTUS-PREAPRE  PARSING STEP                   ##
     ###################################################################
 
+    # in-memory Cactus pipeline
+    workflow = Workflow()
+
     # Parsing loop
     while True:
 
@@ -859,6 +3088,7 @@ if __name__ == "__main__":
 
             parse(
                 read_func=reader,
+                workflow=workflow,
                 symlink_dir=data["jobs"][job]["directories"]["symlinks"],
                 root_dir=f"{data['jobs'][job]['directories']['root']}/{data['jobs'][job]['task_name']}",
                 script_dirs=data["jobs"][job]["directories"]["scripts"],
@@ -868,66 +3098,136 @@ if __name__ == "__main__":
             )
 
     ###################################################################
-    ###       UPDATE ALIGNMENT STEP ESSENTIAL DIRECTORIES            ##
+    ###                  SLURM BASH SCRIPT CREATOR                   ##
     ###################################################################
 
-    # update alignment job information including "script_dir" for each round
-    # dir
-    job = "alignments"
+    # create dependencies between job types, e.g., preprocess,
+    # alignment, merging
+    link_dependencies(workflow=workflow, ancestral_outgroups=args.ancestral_outgroups)
+
+    # skip the jobs completed by a previous submission
+    state = None
+    if args.state_db is not None and args.executor != "simulate":
+        state = WorkflowState(os.path.abspath(args.state_db))
+    if args.resubmit:
+        if args.executor == "simulate":
+            raise Exception("--resubmit cannot be used with the simulate executor")
+        if state is None:
+            raise Exception("--resubmit needs the --state_db of the previous submission")
+        completed = get_completed_jobs(workflow=workflow, state=state)
+        workflow.remove_jobs(completed)
+        print(f"Skipping {len(completed)} completed jobs, {len(workflow.jobs)} left")
+
+    # scale resources by the size of the genomes of each job if asked to
+    job_sizes = None
+    if args.preprocess_pack_size or any(
+        isinstance(x, dict) and x.get("scaling") for x in slurm_config.values()
+    ):
+        job_sizes = get_job_sizes(workflow=workflow)
+
+    # pack small genomes into preprocess jobs
+    if args.preprocess_pack_size:
+        assert job_sizes is not None
+        pack_preprocess_jobs(workflow=workflow, sizes=job_sizes, target=args.preprocess_pack_size)
+
+    # share GPU nodes between GPU jobs
+    if args.gpu_node:
+        pack_gpu_jobs(
+            workflow=workflow,
+            resources=slurm_config,
+            node_gpus=args.gpu_node[0],
+            node_cpus=args.gpu_node[1] if len(args.gpu_node) > 1 else None,
+            sizes=job_sizes,
+        )
 
-    # get rounds
-    aln_dir = f"{data['jobs'][job]['directories']['root']}/{data['jobs'][job]['task_name']}"
-    data["jobs"][job]["directories"]["rounds"] = sorted(
-        [x for x in os.listdir(aln_dir) if os.path.isdir(os.path.join(aln_dir, x))],
-        key=int
+    # run job chains as a single job
+    if args.fuse_chains:
+        fuse_job_chains(
+            workflow=workflow, resources=slurm_config, max_time=args.fuse_max_time, sizes=job_sizes
+        )
+
+    # create SLURM batches jobs
+    slurmify(
+        workflow=workflow,
+        resources=slurm_config,
+        arrays=args.slurm_arrays,
+        sizes=job_sizes,
+        state_db=None if state is None else state.filename,
+        shard_size=args.script_shard_size,
     )
 
     ###################################################################
-    ###                  SLURM BASH SCRIPT CREATOR                   ##
+    ###         FINAL CACTUS PIPELINE BASH SCRIPT USING SLURM        ##
     ###################################################################
 
-    # list to carry dependencies between job types, e.g., preprocess,
-    # alignment, merging
-    slurm_job_dependencies: List[str] = []
+    create_workflow_script(
+        workflow=workflow,
+        workflow_filename=f"{args.output_dir}/{data['workflow_script_name']}.sh",
+    )
 
-    for job in data["task_order"]:
-        directories = data["jobs"][job]["directories"]
-        for round_dir in directories["rounds"]:
+    # write everything down at once
+    if args.executor != "simulate":
+        write_workflow(workflow=workflow, threads=args.fs_threads, replace=not args.resubmit)
+    if state is not None:
+        register_jobs(workflow=workflow, state=state, reset=not args.resubmit)
 
-            if round_dir is None:
-                slurm_root_dir = f"{directories['root']}/{data['jobs'][job]['task_name']}"
-            else:
-                slurm_root_dir = f"{directories['root']}/{data['jobs'][job]['task_name']}/{round_dir}"
-
-            # create SLURM batches jobs
-            slurm_job_dependencies = slurmify(
-                root_dir=slurm_root_dir,
-                script_dirs=directories["scripts"],
-                log_dir=directories["logs"],
-                resources=slurm_config,
-                initial_dependencies=slurm_job_dependencies,
-            )
+    ###################################################################
+    ###                  LOCAL  WORKFLOW EXECUTOR                    ##
+    ###################################################################
+
+    if args.executor == "local":
+        executor = LocalExecutor(cpus=args.local_cpus, memory=args.local_memory, gpus=args.local_gpus)
+        exit_codes = executor.run(workflow=workflow)
+
+        failed = [workflow.jobs[x].name for x, code in exit_codes.items() if code != 0]
+        print(f"{len(exit_codes) - len(failed)} of {len(exit_codes)} jobs succeeded")
+        if failed:
+            print("Jobs failed or not run: {}".format(" ".join(failed)))
+            sys.exit(1)
 
     ###################################################################
-    ###         FINAL CACTUS PIPELINE BASH SCRIPT USING SLURM        ##
+    ###                WORKFLOW  MAKESPAN SIMULATOR                  ##
     ###################################################################
 
-    # create a new bash script file there
-    workflow_scripts = f"{args.output_dir}/{data['workflow_script_name']}.sh"
-    create_bash_script(filename=workflow_scripts)
+    if args.executor == "simulate":
+        simulator = WorkflowSimulator(
+            partitions=dict(args.simulate_partition),
+            runtimes=parse_runtimes(args.runtimes),
+            default_runtime=args.simulate_default_runtime,
+        )
+
+        unknown = [x.name for job in workflow.jobs.values() for x in job.steps or [job]
+                   if x.name not in simulator.runtimes and x.command not in simulator.runtimes]
+        if unknown:
+            print(f"No runtime history for {len(unknown)} jobs: {' '.join(unknown)}")
 
-    for job in data["task_order"]:
-        dir_ = data["jobs"][job]["directories"]
-        for round_dir in dir_["rounds"]:
+        simulation = simulator.run(workflow=workflow)
 
-            if round_dir is None:
-                script_root_dir = f"{dir_['root']}/{data['jobs'][job]['task_name']}"
-            else:
-                script_root_dir = f"{dir_['root']}/{data['jobs'][job]['task_name']}/{round_dir}"
+        print(f"Predicted makespan = {simulation.makespan:.0f} seconds or "
+              f"{timedelta(seconds=round(simulation.makespan))}")
 
-            create_workflow_script(
-                root_dir=script_root_dir,
-                task_type=job,
-                script_dir=dir_["scripts"]["all"],
-                workflow_filename=workflow_scripts,
+        print("Critical path:")
+        for variable in simulation.critical_path:
+            print(f"  {workflow.jobs[variable].name};"
+                  f"{simulation.start[variable]:.0f};{simulation.end[variable]:.0f}")
+
+        print("Partition utilisation (nodes;cpus;gpus):")
+        for name, usage in get_utilisation(simulation, simulator.partitions).items():
+            print(f"  {name};{usage[0]:.2%};{usage[1]:.2%};{usage[2]:.2%}")
+
+        if args.simulate_timeline:
+            write_file(
+                filename=args.simulate_timeline,
+                lines=["TIME_SECONDS,PARTITION,USED_NODES,USED_CPUS,USED_GPUS"]
+                + [",".join(str(x) for x in sample) for sample in simulation.timeline],
+            )
+
+        if args.simulate_samples > 0:
+            rng = random.Random(0)
+            makespans = sorted(
+                simulator.run(workflow=workflow, rng=rng).makespan
+                for _ in range(args.simulate_samples)
             )
+            print(f"Sampled makespan: mean={mean(makespans):.0f} "
+                  f"p95={makespans[int(0.95 * (len(makespans) - 1))]:.0f} "
+                  f"max={makespans[-1]:.0f} seconds")
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""This script benchmarks cactus_batcher on synthetic cactus-prepare outputs.
+
+For balanced and caterpillar trees of several sizes, it runs the parsing,
+dependency, Slurm and workflow script steps of cactus_batcher against a
+temporary directory and records the wall time, peak RSS, files created, read
+and write syscalls, and filesystem metadata operations (mkdir, rename,
+symlink, unlink, ...) of each case. The results can be saved as a JSON
+baseline that later runs are compared against.
+
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# cactus_batcher refuses to be imported without the singularity images
+os.environ.setdefault("CACTUS_IMAGE", "cactus.sif")
+os.environ.setdefault("CACTUS_GPU_IMAGE", "cactus-gpu.sif")
+
+import cactus_batcher  # noqa: E402  pylint: disable=wrong-import-position
+
+# metrics compared against the baseline, higher values being worse
+METRICS = ["wall_time", "peak_rss_kb", "files_created", "io_syscalls", "metadata_ops"]
+
+# functions of the os module counted as filesystem metadata operations
+METADATA_CALLS = ["mkdir", "rename", "replace", "symlink", "link", "unlink", "remove", "rmdir", "chmod"]
+
+# resources used by the benchmark, the values themselves do not matter
+SLURM_CONFIG = {
+    "cactus-preprocess": {
+        "partition": "standard", "cpus": 8, "memory": 16000, "gpus": None, "time": "10:00:00"
+    },
+    "cactus-blast": {"partition": "gpu", "cpus": 16, "memory": 64000, "gpus": 1, "time": "1-00:00:00"},
+    "cactus-align": {
+        "partition": "standard", "cpus": 32, "memory": 128000, "gpus": None, "time": "2-00:00:00"
+    },
+    "hal2fasta": {"partition": "standard", "cpus": 1, "memory": 4000, "gpus": None, "time": "01:00:00"},
+    "halAppendSubtree": {
+        "partition": "standard", "cpus": 1, "memory": 8000, "gpus": None, "time": "02:00:00"
+    },
+    "regular": {"partition": "standard", "cpus": 1, "memory": 1000, "gpus": None, "time": "01:00:00"},
+}
+
+
+###################################################################
+###                 SYNTHETIC  CACTUS-PREPARE                    ##
+###################################################################
+
+
+def make_tree(shape: str, leaves: int) -> Dict[str, List[str]]:
+    """Create a binary tree.
+
+    Args:
+        shape: Either "balanced" or "caterpillar".
+        leaves: Amount of leaves.
+
+    Returns:
+        The children names of each internal node, the root being the first one.
+
+    """
+
+    children: Dict[str, List[str]] = {}
+    names = [f"L{i}" for i in range(leaves)]
+
+    if shape == "caterpillar":
+        node = names[0]
+        for i, leaf in enumerate(names[1:]):
+            children[f"Anc{leaves - 2 - i}"] = [node, leaf]
+            node = f"Anc{leaves - 2 - i}"
+
+    elif shape == "balanced":
+        # split the leaves top-down, keeping the parent of each pending range
+        pending: List[Tuple[int, int, Optional[str]]] = [(0, leaves, None)]
+        count = 0
+        while pending:
+            start, end, parent = pending.pop()
+            if end - start == 1:
+                name = names[start]
+            else:
+                name = f"Anc{count}"
+                count += 1
+                children[name] = []
+                middle = (start + end) // 2
+                pending.extend([(middle, end, name), (start, middle, name)])
+            if parent is not None:
+                children[parent].append(name)
+
+    else:
+        raise ValueError(f"Unknown tree shape: {shape}")
+
+    return dict(reversed(list(children.items()))) if shape == "caterpillar" else children
+
+
+def get_newick(children: Dict[str, List[str]], root: str) -> str:
+    """Write a tree in Newick format without recursion."""
+
+    tokens: List[str] = []
+
+    # each item is either a node to visit or some text to write
+    pending: List[Tuple[bool, str]] = [(True, root)]
+
+    while pending:
+        is_node, item = pending.pop()
+        if not is_node or item not in children:
+            tokens.append(item)
+            continue
+
+        pending.append((False, f"){item}"))
+        for i, child in enumerate(reversed(children[item])):
+            if i:
+                pending.append((False, ","))
+            pending.append((True, child))
+        pending.append((False, "("))
+
+    return "".join(tokens) + ";"
+
+
+def get_cactus_prepare_lines(children: Dict[str, List[str]], leaves: List[str]) -> Iterator[str]:
+    """Generate the output of cactus-prepare for a tree.
+
+    Args:
+        children: The children names of each internal node, root first.
+        leaves: The leaf names.
+
+    Yields:
+        The lines of the cactus-prepare output.
+
+    """
+
+    options = "--realTimeLogging --logInfo --retryCount 0"
+    jobstore = 0
+
+    yield "## Preprocessor"
+    for i in range(0, len(leaves), 2):
+        names = " ".join(leaves[i : i + 2])
+        yield (
+            f"cactus-preprocess jobstore/{jobstore} input/seqfile.txt steps/seqfile.txt "
+            f"--inputNames {names} {options}"
+        )
+        jobstore += 1
+
+    # an ancestor is aligned one round after its deepest child
+    height: Dict[str, int] = {}
+    for node in reversed(list(children)):
+        height[node] = 1 + max(height.get(x, 0) for x in children[node])
+
+    rounds: Dict[int, List[str]] = {}
+    for node in children:
+        rounds.setdefault(height[node], []).append(node)
+
+    yield "## Alignment"
+    for round_id, level in enumerate(sorted(rounds)):
+        yield f"### Round {round_id}"
+        for node in rounds[level]:
+            yield (
+                f"cactus-blast jobstore/{jobstore} steps/seqfile.txt steps/{node}.cigar "
+                f"--root {node} {options}"
+            )
+            yield (
+                f"cactus-align jobstore/{jobstore + 1} steps/seqfile.txt steps/{node}.cigar steps/{node}.hal "
+                f"--root {node} {options} --maxCores 32"
+            )
+            yield f"hal2fasta steps/{node}.hal {node} --hdf5InMemory > steps/{node}.fa"
+            jobstore += 2
+
+    yield "## HAL merging"
+    root, *ancestors = list(children)
+    for node in ancestors:
+        yield f"halAppendSubtree steps/{root}.hal steps/{node}.hal {node} {node} --merge --hdf5InMemory"
+
+
+def create_case_inputs(shape: str, leaves: int, work_dir: str) -> List[str]:
+    """Create the input directories of a benchmark case.
+
+    Args:
+        shape: The tree shape.
+        leaves: Amount of leaves.
+        work_dir: Directory in which `steps`, `jobstore` and `input` are created.
+
+    Returns:
+        The lines of the cactus-prepare output.
+
+    """
+
+    children = make_tree(shape, leaves)
+    names = [f"L{i}" for i in range(leaves)]
+    root = next(iter(children))
+
+    for directory in ["steps", "jobstore", "input"]:
+        os.makedirs(f"{work_dir}/{directory}", exist_ok=True)
+
+    newick = get_newick(children, root)
+    for directory in ["steps", "input"]:
+        cactus_batcher.write_file(
+            f"{work_dir}/{directory}/seqfile.txt",
+            [newick] + [f"{x} {work_dir}/{directory}/{x}.fa" for x in names],
+        )
+
+    return list(get_cactus_prepare_lines(children, names))
+
+
+###################################################################
+###                       MEASUREMENT                            ##
+###################################################################
+
+
+def get_io_syscalls() -> Optional[int]:
+    """Get the amount of read and write syscalls done so far by this process."""
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as io_file:
+            counters = dict(x.split(":") for x in io_file)
+        return int(counters["syscr"]) + int(counters["syscw"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def count_metadata_ops() -> Iterator[Dict[str, int]]:
+    """Count the calls to the metadata functions of the os module while in the context.
+
+    /proc/self/io only counts reads and writes, so the functions themselves
+    are wrapped. Higher-level helpers such as os.makedirs, shutil.rmtree and
+    pathlib go through them too.
+
+    Yields:
+        The amount of calls of each function, updated while in the context.
+
+    """
+
+    counts = {x: 0 for x in METADATA_CALLS}
+    originals = {x: getattr(os, x) for x in METADATA_CALLS}
+
+    def wrap(name: str, func: Any) -> Any:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(os, name, wrap(name, func))
+    try:
+        yield counts
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+
+
+def count_files(path: str) -> int:
+    """Count the files, directories and symlinks below a path."""
+    return sum(len(dirs) + len(files) for _, dirs, files in os.walk(path))
+
+
+def run_case(shape: str, leaves: int) -> Dict[str, Any]:
+    """Run a benchmark case in this process.
+
+    Args:
+        shape: The tree shape.
+        leaves: Amount of leaves.
+
+    Returns:
+        The measures of the case.
+
+    """
+
+    with tempfile.TemporaryDirectory(prefix="cactus_batcher_benchmark_") as work_dir:
+        lines = create_case_inputs(shape, leaves, work_dir)
+        output_dir = f"{work_dir}/output"
+        symlinks = [f"{work_dir}/steps", f"{work_dir}/jobstore", f"{work_dir}/input"]
+        scripts = {"all": "scripts/all", "separated": "scripts/separated"}
+        tasks = [
+            ("preprocessor", "1-preprocessors", "## Alignment", symlinks),
+            ("alignments", "2-alignments", "## HAL merging", symlinks),
+            ("merging", "3-merging", None, symlinks[:2]),
+        ]
+
+        phases: Dict[str, float] = {}
+        with count_metadata_ops() as metadata_calls:
+            io_syscalls = get_io_syscalls()
+            start = time.perf_counter()
+
+            workflow = cactus_batcher.Workflow()
+            reader = iter(lines[1:])
+            for task_type, task_name, stop_condition, symlink_dir in tasks:
+                cactus_batcher.parse(
+                    read_func=reader,
+                    workflow=workflow,
+                    symlink_dir=symlink_dir,
+                    root_dir=f"{output_dir}/{task_name}",
+                    script_dirs=scripts,
+                    log_dir="logs",
+                    task_type=task_type,
+                    stop_condition=stop_condition,
+                )
+            phases["parse"] = time.perf_counter() - start
+
+            steps = [
+                ("link_dependencies", lambda: cactus_batcher.link_dependencies(workflow)),
+                (
+                    "slurmify",
+                    lambda: cactus_batcher.slurmify(workflow, resources=SLURM_CONFIG, shard_size=1000),
+                ),
+                (
+                    "create_workflow_script",
+                    lambda: cactus_batcher.create_workflow_script(
+                        workflow, f"{output_dir}/run_cactus_workflow.sh"
+                    ),
+                ),
+                ("write_workflow", lambda: cactus_batcher.write_workflow(workflow)),
+            ]
+            for name, step in steps:
+                phase_start = time.perf_counter()
+                step()
+                phases[name] = time.perf_counter() - phase_start
+
+            wall_time = time.perf_counter() - start
+            io_syscalls_end = get_io_syscalls()
+
+        return {
+            "shape": shape,
+            "leaves": leaves,
+            "jobs": len(workflow.jobs),
+            "wall_time": wall_time,
+            "phases": phases,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "files_created": count_files(output_dir),
+            "io_syscalls": (
+                None if io_syscalls is None or io_syscalls_end is None else io_syscalls_end - io_syscalls
+            ),
+            "metadata_ops": sum(metadata_calls.values()),
+            "metadata_calls": metadata_calls,
+        }
+
+
+def run_isolated_case(shape: str, leaves: int) -> Dict[str, Any]:
+    """Run a benchmark case in a fresh interpreter, so its peak RSS is its own."""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run_case", f"{shape}:{leaves}"],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+###################################################################
+###                    BASELINE  COMPARISON                      ##
+###################################################################
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Compare benchmark results against a baseline.
+
+    Args:
+        results: The results of this run.
+        baseline: The results of a previous run.
+        tolerance: Allowed relative increase of each metric, e.g., 0.2 for 20%.
+
+    Returns:
+        A description of each regression.
+
+    """
+
+    previous = {(x["shape"], x["leaves"]): x for x in baseline}
+    regressions = []
+
+    print("shape;leaves;metric;baseline;current;ratio")
+    for result in results:
+        old = previous.get((result["shape"], result["leaves"]))
+        if old is None:
+            continue
+
+        for metric in METRICS:
+            if old.get(metric) is None or result.get(metric) is None:
+                continue
+            ratio = result[metric] / old[metric] if old[metric] else 1.0
+            print(f"{result['shape']};{result['leaves']};{metric};{old[metric]};{result[metric]};{ratio:.2f}")
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{result['shape']} tree of {result['leaves']} leaves: "
+                    f"{metric} went from {old[metric]} to {result[metric]} ({ratio:.2f}x)"
+                )
+
+    return regressions
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark cactus_batcher on synthetic cactus-prepare outputs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--shapes",
+        nargs="+",
+        choices=["balanced", "caterpillar"],
+        default=["balanced", "caterpillar"],
+        help="Shapes of the synthetic trees",
+    )
+    parser.add_argument(
+        "--leaves",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000, 5000],
+        help="Amount of leaves of the synthetic trees",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run each case this many times and keep the fastest run",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="JSON",
+        help="JSON file with the results of a previous run, created if missing (required)",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing against it",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative increase of each metric before reporting a regression",
+    )
+    parser.add_argument("--run_case", help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == "__main__":
+
+    parser = create_argparser()
+    args = parser.parse_args()
+
+    # child process measuring a single case
+    if args.run_case:
+        case_shape, case_leaves = args.run_case.split(":")
+        print(json.dumps(run_case(case_shape, int(case_leaves))))
+        sys.exit(0)
+
+    if args.baseline is None:
+        parser.error("the following arguments are required: --baseline")
+
+    results = []
+    for tree_shape in args.shapes:
+        for tree_leaves in args.leaves:
+            runs = [run_isolated_case(tree_shape, tree_leaves) for _ in range(args.repeat)]
+            best = min(runs, key=lambda x: x["wall_time"])
+            results.append(best)
+            print(
+                f"{tree_shape} tree of {tree_leaves} leaves: {best['jobs']} jobs, "
+                f"{best['wall_time']:.3f} s, {best['peak_rss_kb']} KB, "
+                f"{best['files_created']} files, {best['io_syscalls']} read/write syscalls, "
+                f"{best['metadata_ops']} metadata operations",
+                file=sys.stderr,
+            )
+
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        sys.exit(0)
+
+    with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+        found = compare(results, json.load(baseline_file), tolerance=args.tolerance)
+
+    if found:
+        print("Regressions found:\n" + "\n".join(found), file=sys.stderr)
+        sys.exit(1)
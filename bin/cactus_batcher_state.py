@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""This script keeps the state of the jobs of a cactus_batcher workflow.
+
+The state is a SQLite database recording the status of each job (generated,
+submitted, running, succeeded, failed, or skipped if an earlier step of
+the same Slurm job failed), its Slurm job ID and the fingerprints of its
+outputs. With `cactus_batcher.py --state_db`, the scripts generated call
+this script to update it, and `cactus_batcher.py --resubmit` reads it to
+skip the jobs already completed.
+
+The submission scripts do not write into the database, as starting Python
+for every submitted job would slow them down. They append the Slurm job ID
+of each job to a plain text file next to the database instead, which is
+loaded on the next read.
+
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+STATUSES = ["generated", "submitted", "running", "succeeded", "failed", "skipped"]
+
+
+def read_step_codes(filename: str) -> Dict[str, str]:
+    """Read the exit code of each step of a job running several commands.
+
+    Args:
+        filename: The `.steps` file of the job, with a `name exit_code` line
+            per step, the exit code being `skipped` for the steps not run.
+
+    Returns:
+        The last exit code of each step, indexed by job name, or nothing if
+        the file does not exist.
+
+    """
+    codes: Dict[str, str] = {}
+    if not os.path.exists(filename):
+        return codes
+
+    with open(filename, "r", encoding="utf-8") as steps_file:
+        for line in steps_file:
+            fields = line.split()
+            if len(fields) == 2:
+                codes[fields[0]] = fields[1]
+    return codes
+
+
+def get_fingerprint(path: str) -> Optional[str]:
+    """Get the fingerprint of a file, i.e., its size and modification time.
+
+    Args:
+        path: Path of the file.
+
+    Returns:
+        The fingerprint or None if the file does not exist.
+
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return f"{info.st_size}:{info.st_mtime_ns}"
+
+
+@dataclass
+class JobState:
+    """The state of a job.
+
+    Attributes:
+        variable: The variable name of the job.
+        name: The name of the job.
+        status: One of `STATUSES`.
+        slurm_job_id: The Slurm job ID of the last submission of the job.
+        outputs: The fingerprint of each output file when the job finished, see `get_fingerprint`.
+        updated: Time of the last update, in seconds since the Epoch.
+
+    """
+
+    variable: str
+    name: str
+    status: str
+    slurm_job_id: Optional[str]
+    outputs: Dict[str, Optional[str]]
+    updated: float
+
+
+class WorkflowState:
+    """The state database of a workflow.
+
+    Args:
+        filename: Path of the SQLite database, created if missing.
+
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.submissions = f"{filename}.submitted"
+
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        # the rollback journal works on network filesystems, unlike WAL
+        self.connection = sqlite3.connect(filename, timeout=120, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "variable TEXT PRIMARY KEY, name TEXT, status TEXT, slurm_job_id TEXT, "
+            "outputs TEXT, updated REAL)"
+        )
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def register(self, jobs: Iterable[Tuple[str, str, Sequence[str]]], reset: bool) -> None:
+        """Record jobs as generated.
+
+        Args:
+            jobs: The variable name, name and output files of each job.
+            reset: True to forget every job recorded before, otherwise only the
+                given jobs are overwritten.
+
+        """
+        # keep the Slurm job IDs of the previous submission of the jobs left untouched
+        self.load_submissions()
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if reset:
+                self.connection.execute("DELETE FROM jobs")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, 'generated', NULL, ?, ?)",
+                [
+                    (variable, name, json.dumps(dict.fromkeys(outputs)), now)
+                    for variable, name, outputs in jobs
+                ],
+            )
+
+        if os.path.exists(self.submissions):
+            os.remove(self.submissions)
+
+    def set_status(
+        self, variables: Sequence[str], status: str, slurm_job_id: Optional[str] = None
+    ) -> None:
+        """Update the status of jobs.
+
+        The fingerprints of the outputs of the jobs are taken when they succeed.
+
+        Args:
+            variables: The variable names of the jobs.
+            status: One of `STATUSES`.
+            slurm_job_id: The Slurm job ID running the jobs, if known.
+
+        """
+        if status not in STATUSES:
+            raise ValueError(f"Unknown job status: {status}")
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for variable in variables:
+                row = self.connection.execute(
+                    "SELECT outputs FROM jobs WHERE variable = ?", (variable,)
+                ).fetchone()
+                if row is None:
+                    continue
+
+                outputs = json.loads(row[0])
+                if status == "succeeded":
+                    outputs = {x: get_fingerprint(x) for x in outputs}
+
+                self.connection.execute(
+                    "UPDATE jobs SET status = ?, slurm_job_id = COALESCE(?, slurm_job_id), "
+                    "outputs = ?, updated = ? WHERE variable = ?",
+                    (status, slurm_job_id or None, json.dumps(outputs), now, variable),
+                )
+
+    def finish(
+        self, variables: Sequence[str], exit_code: int, step_codes: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Record jobs as succeeded, failed or skipped from their exit code.
+
+        Args:
+            variables: The variable names of the jobs.
+            exit_code: The exit code of the Slurm job running the jobs.
+            step_codes: The exit code of the steps of the Slurm job, indexed by
+                job name, which take precedence over `exit_code`, see
+                `read_step_codes`.
+
+        """
+        names = {
+            row[0]: row[1]
+            for row in self.connection.execute(
+                f"SELECT variable, name FROM jobs WHERE variable IN ({', '.join('?' * len(variables))})",
+                list(variables),
+            )
+        }
+
+        statuses: Dict[str, List[str]] = {}
+        for variable in variables:
+            code = (step_codes or {}).get(names.get(variable, ""), str(exit_code))
+            status = "succeeded" if code == "0" else "skipped" if code == "skipped" else "failed"
+            statuses.setdefault(status, []).append(variable)
+
+        for status, group in statuses.items():
+            self.set_status(group, status)
+
+    def load_submissions(self) -> None:
+        """Record the Slurm job IDs appended by the submission scripts."""
+        if not os.path.exists(self.submissions):
+            return
+
+        submitted: Dict[str, str] = {}
+        with open(self.submissions, "r", encoding="utf-8") as submissions_file:
+            for line in submissions_file:
+                fields = line.split()
+                if len(fields) == 2:
+                    submitted[fields[0]] = fields[1]
+
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "UPDATE jobs SET status = 'submitted', slurm_job_id = ? "
+                "WHERE variable = ? AND status = 'generated'",
+                [(job_id, variable) for variable, job_id in submitted.items()],
+            )
+
+    def get_jobs(self) -> Dict[str, JobState]:
+        """Get the state of every job, indexed by variable name."""
+        self.load_submissions()
+        return {
+            row[0]: JobState(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5])
+            for row in self.connection.execute("SELECT * FROM jobs ORDER BY updated, rowid")
+        }
+
+    def get_valid_outputs(self) -> Dict[str, bool]:
+        """Check if the outputs recorded by the succeeded jobs are still on disk.
+
+        A file written by several jobs, e.g., a HAL file appended in place, is
+        compared against the fingerprint taken by the last of them.
+
+        Returns:
+            True for each output file whose fingerprint did not change.
+
+        """
+        latest: Dict[str, Optional[str]] = {}
+        for job in self.get_jobs().values():
+            if job.status == "succeeded":
+                latest.update(job.outputs)
+
+        return {
+            path: fingerprint is not None and fingerprint == get_fingerprint(path)
+            for path, fingerprint in latest.items()
+        }
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Update or show the state of the jobs of a cactus_batcher workflow"
+    )
+    parser.add_argument("--db", metavar="PATH", required=True, help="SQLite state database")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    running = subparsers.add_parser("running", help="Record jobs as running")
+    running.add_argument("variables", nargs="+", help="Variable names of the jobs")
+    running.add_argument("--slurm_job_id", help="Slurm job ID running the jobs")
+
+    finish = subparsers.add_parser("finish", help="Record jobs as succeeded or failed")
+    finish.add_argument("exit_code", type=int, help="Exit code of the jobs")
+    finish.add_argument("variables", nargs="+", help="Variable names of the jobs")
+    finish.add_argument(
+        "--steps",
+        metavar="PATH",
+        help="File with the exit code of each step of the job, used instead of its exit code",
+    )
+
+    subparsers.add_parser("show", help="Print the state of every job")
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = create_argparser().parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"File {args.db} does not exist!", file=sys.stderr)
+        sys.exit(1)
+
+    state = WorkflowState(args.db)
+
+    if args.action == "running":
+        state.set_status(args.variables, "running", slurm_job_id=args.slurm_job_id)
+
+    elif args.action == "finish":
+        step_codes = None if args.steps is None else read_step_codes(args.steps)
+        state.finish(args.variables, args.exit_code, step_codes=step_codes)
+
+    else:
+        jobs: List[JobState] = list(state.get_jobs().values())
+        print("job;status;slurm_job_id")
+        for job_state in jobs:
+            print(f"{job_state.name};{job_state.status};{job_state.slurm_job_id or ''}")
+
+    state.close()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""This script merges the lifecycle records of a cactus_batcher workflow into a timeline.
+
+The jobs generated by cactus_batcher append a JSON record to the
+`<job>.lifecycle` file of their log directory every time they run, with their
+submission, start and end times, exit code, node and allocated resources.
+
+The records are merged into a trace-event JSON file that can be opened with
+chrome://tracing or https://ui.perfetto.dev, with one process per Slurm
+partition and one track per round (split in lanes when jobs overlap). Each
+attempt of a job is drawn as the time it waited in the queue followed by the
+time it ran.
+
+The time between the submission of a job and its start is split into:
+    - dependency wait: until the last of its dependencies finished;
+    - queue wait: from then on until Slurm started it.
+
+A summary of both and of the run time is printed per round and partition.
+
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class Attempt:
+    """A run of a job, as recorded by its lifecycle.
+
+    Attributes:
+        job: Name of the Slurm job.
+        round: Name of the round of the job.
+        variables: Variable names of the jobs run by this job.
+        dependencies: Variable names of the jobs that this job depends on.
+        partition: Slurm partition running the job.
+        submit: Submission time, in seconds since the Epoch, if known.
+        start: Start time, in seconds since the Epoch.
+        end: End time, in seconds since the Epoch.
+        exit_code: Exit code of the job.
+        info: The other fields of the record, e.g., the node or the allocated CPUs.
+        eligible: Time at which the job could start, see `set_eligible_times`.
+
+    """
+
+    job: str
+    round: str
+    variables: List[str]
+    dependencies: List[str]
+    partition: str
+    submit: Optional[float]
+    start: float
+    end: float
+    exit_code: int
+    info: Dict[str, Any] = field(default_factory=dict)
+    eligible: Optional[float] = None
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Attempt":
+        """Create an attempt from a lifecycle record."""
+
+        def timestamp(value: Any) -> Optional[float]:
+            # the times are strings holding $EPOCHREALTIME, whose decimal
+            # separator is the one of the locale of the job, e.g., a comma
+            return None if value in (None, "") else float(str(value).replace(",", "."))
+
+        known = {
+            "job", "round", "variables", "dependencies", "partition", "submit", "start", "end", "exit_code"
+        }
+        return cls(
+            job=record["job"],
+            round=record["round"],
+            variables=record["variables"],
+            dependencies=record["dependencies"],
+            partition=record.get("partition") or "unknown",
+            submit=timestamp(record["submit"]),
+            start=timestamp(record["start"]),
+            end=timestamp(record["end"]),
+            exit_code=int(record["exit_code"]),
+            info={x: y for x, y in record.items() if x not in known and y not in ("", None)},
+        )
+
+    @property
+    def dependency_wait(self) -> float:
+        """Time waiting for the dependencies of the job, in seconds."""
+        if self.submit is None or self.eligible is None:
+            return 0.0
+        return max(0.0, self.eligible - self.submit)
+
+    @property
+    def queue_wait(self) -> float:
+        """Time waiting in the queue once the job could start, in seconds."""
+        if self.eligible is None:
+            return 0.0
+        return max(0.0, self.start - self.eligible)
+
+    @property
+    def runtime(self) -> float:
+        """Time running, in seconds."""
+        return max(0.0, self.end - self.start)
+
+
+def find_lifecycle_files(paths: Iterable[str]) -> List[str]:
+    """Find the lifecycle files of the given files and directories.
+
+    Args:
+        paths: Lifecycle files, or directories searched recursively.
+
+    Returns:
+        Path of each lifecycle file.
+
+    """
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            filenames.extend(os.path.join(root, x) for x in files if x.endswith(".lifecycle"))
+    return sorted(filenames)
+
+
+def read_attempts(filenames: Iterable[str]) -> List[Attempt]:
+    """Read the attempts recorded in lifecycle files.
+
+    Records that cannot be parsed, e.g., when a node died while writing them,
+    are reported and skipped.
+
+    Args:
+        filenames: Paths of the lifecycle files.
+
+    Returns:
+        Every attempt, in start order.
+
+    """
+    attempts = []
+    for filename in filenames:
+        with open(filename, "r", encoding="utf-8") as lifecycle_file:
+            for number, line in enumerate(lifecycle_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    attempts.append(Attempt.from_record(json.loads(line)))
+                except (ValueError, KeyError, TypeError) as err:
+                    print(f"Skipping record {filename}:{number}: {err}", file=sys.stderr)
+
+    attempts.sort(key=lambda x: (x.start, x.job))
+    return attempts
+
+
+def set_eligible_times(attempts: List[Attempt]) -> None:
+    """Set the time at which each attempt could start.
+
+    A job can start once it is submitted and its dependencies succeeded. An
+    attempt following a failed or requeued one can only start after it.
+
+    Args:
+        attempts: Every attempt, in start order.
+
+    """
+
+    # end of the last successful attempt of each job
+    succeeded: Dict[str, float] = {}
+    for attempt in attempts:
+        if attempt.exit_code == 0:
+            for variable in attempt.variables:
+                succeeded[variable] = max(succeeded.get(variable, attempt.end), attempt.end)
+
+    previous: Dict[str, float] = {}
+    for attempt in attempts:
+        times = [succeeded[x] for x in attempt.dependencies if x in succeeded]
+        if attempt.submit is not None:
+            times.append(attempt.submit)
+        if attempt.job in previous:
+            times.append(previous[attempt.job])
+
+        # dependencies outside of the records, e.g., skipped by a resubmission
+        attempt.eligible = min(max(times), attempt.start) if times else None
+        previous[attempt.job] = attempt.end
+
+
+def assign_lanes(attempts: List[Attempt]) -> Dict[int, int]:
+    """Spread overlapping attempts of a track over lanes.
+
+    Args:
+        attempts: The attempts of a track, in start order.
+
+    Returns:
+        The lane of each attempt, indexed by position in `attempts`.
+
+    """
+    lanes: Dict[int, int] = {}
+    free: List[Tuple[float, int]] = []
+    count = 0
+    for index, attempt in sorted(
+        enumerate(attempts), key=lambda x: (x[1].eligible or x[1].start, x[1].start)
+    ):
+        begin = attempt.start if attempt.eligible is None else attempt.eligible
+        if free and free[0][0] <= begin:
+            _, lane = heapq.heappop(free)
+        else:
+            lane, count = count, count + 1
+        lanes[index] = lane
+        heapq.heappush(free, (attempt.end, lane))
+    return lanes
+
+
+def create_trace(attempts: List[Attempt]) -> Dict[str, Any]:
+    """Create the trace events of the attempts.
+
+    Args:
+        attempts: Every attempt with its eligible time set, in start order.
+
+    Returns:
+        A trace in the Trace Event Format.
+
+    """
+    origin = min(
+        [x.submit for x in attempts if x.submit is not None] + [x.start for x in attempts]
+    )
+
+    def microseconds(value: float) -> float:
+        return round((value - origin) * 1e6, 3)
+
+    tracks: Dict[Tuple[str, str], List[Attempt]] = {}
+    for attempt in attempts:
+        tracks.setdefault((attempt.partition, attempt.round), []).append(attempt)
+
+    events: List[Dict[str, Any]] = []
+    pids: Dict[str, int] = {}
+    tid = 0
+    for (partition, round_name), track in tracks.items():
+        if partition not in pids:
+            pids[partition] = len(pids) + 1
+            events.append(
+                {"ph": "M", "name": "process_name", "pid": pids[partition], "args": {"name": partition}}
+            )
+        pid = pids[partition]
+
+        lanes = assign_lanes(track)
+        for lane in range(max(lanes.values()) + 1):
+            name = round_name if lane == 0 else f"{round_name} #{lane}"
+            events.append(
+                {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid + lane, "args": {"name": name}}
+            )
+            events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_sort_index",
+                    "pid": pid,
+                    "tid": tid + lane,
+                    "args": {"sort_index": tid + lane},
+                }
+            )
+
+        for index, attempt in enumerate(track):
+            lane = tid + lanes[index]
+            if attempt.eligible is not None and attempt.queue_wait > 0:
+                events.append(
+                    {
+                        "ph": "X",
+                        "cat": "queue",
+                        "name": f"{attempt.job} (queued)",
+                        "pid": pid,
+                        "tid": lane,
+                        "ts": microseconds(attempt.eligible),
+                        "dur": round(attempt.queue_wait * 1e6, 3),
+                        "cname": "grey",
+                    }
+                )
+            events.append(
+                {
+                    "ph": "X",
+                    "cat": "run",
+                    "name": attempt.job if attempt.exit_code == 0 else f"{attempt.job} (failed)",
+                    "pid": pid,
+                    "tid": lane,
+                    "ts": microseconds(attempt.start),
+                    "dur": round(attempt.runtime * 1e6, 3),
+                    "args": dict(
+                        attempt.info,
+                        exit_code=attempt.exit_code,
+                        variables=attempt.variables,
+                        dependency_wait=round(attempt.dependency_wait, 3),
+                        queue_wait=round(attempt.queue_wait, 3),
+                    ),
+                    **({} if attempt.exit_code == 0 else {"cname": "terrible"}),
+                }
+            )
+
+        tid += max(lanes.values()) + 1
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def format_seconds(seconds: float) -> str:
+    """Format seconds as [D day[s], ]H:MM:SS."""
+    return str(timedelta(seconds=round(seconds)))
+
+
+def print_summary(attempts: List[Attempt]) -> None:
+    """Print the dependency wait, queue wait and run time per round and partition.
+
+    Args:
+        attempts: Every attempt with its eligible time set, in start order.
+
+    """
+    summary: Dict[Tuple[str, str], List[Attempt]] = {}
+    for attempt in attempts:
+        summary.setdefault((attempt.round, attempt.partition), []).append(attempt)
+
+    print(
+        "round;partition;jobs;attempts;failed;dependency_wait;queue_wait;runtime;"
+        "mean_queue_wait;mean_runtime"
+    )
+    for (round_name, partition), group in summary.items():
+        queue_wait = sum(x.queue_wait for x in group)
+        runtime = sum(x.runtime for x in group)
+        print(
+            f"{round_name};{partition};{len({x.job for x in group})};{len(group)};"
+            f"{sum(1 for x in group if x.exit_code != 0)};"
+            f"{format_seconds(sum(x.dependency_wait for x in group))};"
+            f"{format_seconds(queue_wait)};{format_seconds(runtime)};"
+            f"{format_seconds(queue_wait / len(group))};{format_seconds(runtime / len(group))}"
+        )
+
+    begin = min([x.submit for x in attempts if x.submit is not None] + [x.start for x in attempts])
+    end = max(x.end for x in attempts)
+    queue_wait = sum(x.queue_wait for x in attempts)
+    runtime = sum(x.runtime for x in attempts)
+    print(f"Makespan = {format_seconds(end - begin)}")
+    share = 100 * queue_wait / max(queue_wait + runtime, 1e-9)
+    print(f"Queue wait = {format_seconds(queue_wait)} ({share:.2f}%)")
+    print(f"Runtime = {format_seconds(runtime)}")
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Merge the lifecycle records of a cactus_batcher workflow into a trace"
+    )
+    parser.add_argument(
+        "paths",
+        metavar="PATH",
+        nargs="+",
+        help="Lifecycle files, or directories searched recursively, "
+        "e.g., the output directory of cactus_batcher",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="PATH",
+        help="Trace-event JSON file to write, for chrome://tracing or https://ui.perfetto.dev",
+    )
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = create_argparser().parse_args()
+
+    attempts = read_attempts(find_lifecycle_files(args.paths))
+    if not attempts:
+        print("No lifecycle records found!", file=sys.stderr)
+        sys.exit(1)
+
+    set_eligible_times(attempts)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as trace_file:
+            json.dump(create_trace(attempts), trace_file)
+
+    print_summary(attempts)
@@ -3,6 +3,7 @@
 reads a given tree and attach the FASTA file paths"""
 
 import argparse
+import bisect
 import os
 import sys
 import re
@@ -22,7 +23,7 @@ def assemblies_parser(directories, ext):
 
     Args:
         directories: list of paths where the FASTA files are localised
-        ext: extention of the files expected to be found in `dest`
+        ext: extention of the files expected to be found in `dest`, optionally followed by `.gz`
 
     Returns:
         A dictionary containing the path, filename, and bool flag for each file.ext in `deset`
@@ -42,19 +43,21 @@ def assemblies_parser(directories, ext):
 
         try:
             for filename in os.listdir(dest):
-                if filename.endswith(ext):
+                if filename.endswith((ext, ext + ".gz")):
 
-                    key = re.sub("\\W+|_", "", filename).lower()
+                    # compressed files are named as the plain ones, e.g., by assembly_ingest.py --bgzip
+                    plain = filename[: -len(".gz")] if filename.endswith(".gz") else filename
+                    key = re.sub("\\W+|_", "", plain).lower()
 
                     # sanity check
                     assert key not in content
 
                     content[key] = {
                         "path": "{}/{}".format(dest, filename),
-                        "name": filename.rsplit(ext, 1)[0],
+                        "name": plain.rsplit(ext, 1)[0],
                         "used": False,
                     }
-                else:
+                elif not filename.endswith((".fai", ".gzi")):
                     print(
                         "file {} does not end with {}, thus it will been ignored".format(
                             filename, ext
@@ -66,6 +69,48 @@ def assemblies_parser(directories, ext):
     return content
 
 
+def index_assemblies(assemblies_content):
+    """A function to index the normalised names of the FASTA files parsed before
+
+    Every suffix of every name is sorted, so that the names containing a
+    given string are found by a binary search for it as a prefix.
+
+    Args:
+        assemblies_content: The dictionary containing the fasta file information
+
+    Returns:
+        A sorted list of (suffix, name) tuples
+
+    """
+    return sorted(
+        (key[start:], key) for key in assemblies_content for start in range(len(key))
+    )
+
+
+def match_assemblies(name, assemblies_content, suffixes):
+    """A function to find the FASTA files matching a normalised leaf name
+
+    Args:
+        name: The normalised name of the leaf, including the extension
+        assemblies_content: The dictionary containing the fasta file information
+        suffixes: The index of the names of the FASTA files, see `index_assemblies`
+
+    Returns:
+        A sorted list of the names of the FASTA files matching the leaf: the one
+        named after the leaf if any, all those containing its name otherwise
+
+    """
+    if name in assemblies_content:
+        return [name]
+
+    matches = set()
+    index = bisect.bisect_left(suffixes, (name,))
+    while index < len(suffixes) and suffixes[index][0].startswith(name):
+        matches.add(suffixes[index][1])
+        index += 1
+    return sorted(matches)
+
+
 def tree_parser(filename, tree_format, output):
     """A function to parse the given tree
 
@@ -102,18 +147,57 @@ def create_new_tree(tree_content, assemblies_content, tree_format, ext):
 
     Returns:
         A list of filenames containing the FASTA files that have been parsed but not
-        included in the given tree
+        included in the given tree, and a dictionary of the ambiguous leaves, which are
+        left unchanged: those matching several FASTA files, and those matching the same
+        FASTA file but a leaf named after it, with the paths of the files they match
 
     """
 
+    suffixes = index_assemblies(assemblies_content)
+    ambiguous_leaves = {}
+    leaves_by_key = {}
+
     for leaf in tree_content["tree"].get_terminals():
 
         name = re.sub("\\W+|_", "", leaf.name + ext).lower()
-        for key, fasta in assemblies_content.items():
-            if name in key:
-                leaf.name = fasta["name"]
-                fasta["used"] = True
-                break
+        matches = match_assemblies(name, assemblies_content, suffixes)
+        if len(matches) > 1:
+            ambiguous_leaves[leaf.name] = [assemblies_content[x]["path"] for x in matches]
+            print(
+                "Leaf {} matches several FASTA files, thus it will not be renamed: {}".format(
+                    leaf.name, ", ".join(ambiguous_leaves[leaf.name])
+                )
+            )
+            continue
+
+        # whether the leaf is named after the file, or only contained in its name
+        for key in matches:
+            leaves_by_key.setdefault(key, []).append((leaf, key == name))
+
+    # a leaf named after a FASTA file claims it, the other leaves matching
+    # it being left to be sorted out by hand, as those matching several files
+    for key, claims in leaves_by_key.items():
+        fasta = assemblies_content[key]
+        exact = [leaf for leaf, is_exact in claims if is_exact]
+        if len(claims) == 1 or len(exact) == 1:
+            claimant = exact[0] if exact else claims[0][0]
+        else:
+            claimant = None
+
+        others = [leaf for leaf, _ in claims if leaf is not claimant]
+        if others:
+            print(
+                "FASTA file {} matches several leaves, thus {} will not be renamed: {}".format(
+                    fasta["path"], "they" if claimant is None else "all but {}".format(claimant.name),
+                    ", ".join(x.name for x, _ in claims)
+                )
+            )
+            for leaf in others:
+                ambiguous_leaves[leaf.name] = [fasta["path"]]
+
+        if claimant is not None:
+            claimant.name = fasta["name"]
+            fasta["used"] = True
 
     # remove labels on non-leaf nodes
     for non_leaf in tree_content["tree"].get_nonterminals():
@@ -134,7 +218,7 @@ def create_new_tree(tree_content, assemblies_content, tree_format, ext):
             print("FASTA file not used in the tree: {}".format(fasta["name"]))
             filenames_not_used.append(fasta)
 
-    return filenames_not_used
+    return filenames_not_used, ambiguous_leaves
 
 
 def append_fasta_paths(filename, content):
@@ -158,6 +242,7 @@ def add_header(
     qtd_files,
     qtd_terminals,
     unused_filenames,
+    ambiguous_leaves,
 ):
     """Funciton to create a header to the cactus input file
 
@@ -168,6 +253,7 @@ def add_header(
         qtd_files: The amount of files parsed
         qtd_terminals: The amount of leaves (terminals) of the tree
         unused_filenames: The list of files that have not been used for sanity-check
+        ambiguous_leaves: The leaves matching several files, with the paths of those files
 
     """
 
@@ -200,6 +286,13 @@ def add_header(
             f.write("\n")
             for fasta in unused_filenames:
                 f.write("# {} {}\n".format(fasta["name"], fasta["path"]))
+        f.write("# Ambiguous leaves: ")
+        if len(ambiguous_leaves) == 0:
+            f.write("None\n")
+        else:
+            f.write("\n")
+            for leaf, paths in ambiguous_leaves.items():
+                f.write("# {} {}\n".format(leaf, " ".join(paths)))
         f.write("#\n")
         f.write(new_content)
 
@@ -253,7 +346,9 @@ if __name__ == "__main__":
     )
 
     # sanity check
-    unused_filenames = create_new_tree(tree_data, assemblies_data, args.format, args.extension)
+    unused_filenames, ambiguous_leaves = create_new_tree(
+        tree_data, assemblies_data, args.format, args.extension
+    )
 
     # append FASTA locations to the cactus input file
     append_fasta_paths(tree_data["path"], assemblies_data)
@@ -266,4 +361,9 @@ if __name__ == "__main__":
         len(assemblies_data),
         len(tree_data["tree"].get_terminals()),
         unused_filenames,
+        ambiguous_leaves,
     )
+
+    # ambiguous leaves have to be sorted out by hand
+    if ambiguous_leaves:
+        sys.exit(1)
@@ -1,34 +1,145 @@
 #!/usr/bin/env python3
 
-import fileinput
+"""Keep only the first word of the headers of FASTA files, in place.
+
+The files are fixed in parallel. Each file is read in large binary blocks:
+sequence lines are copied as they are and only header lines are parsed.
+A first scan of the headers only skips the files already clean. A fixed
+file is written next to the original one and then renamed over it.
+Gzip-compressed files are written back compressed with gzip, and bgzip
+ones with bgzip, their `.fai` and `.gzi` indexes being rewritten. The
+carriage returns of files with CRLF line endings are kept.
+
+With --mapping, the headers changed are listed as a TSV file of
+`file<TAB>old header<TAB>new header` lines, old headers containing tabs
+being quoted as in CSV files.
+
+"""
+
 import argparse
+import csv
+import functools
+import gzip
 import os.path
+import re
+import shutil
 import sys
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import fasta_len
+
+# what makes a header to be fixed
+WHITESPACE = re.compile(rb'\s')
+
+
+def is_clean(filename: str) -> bool:
+    """Check whether the headers of a FASTA file are a single word each."""
+    with fasta_len.open_fasta(filename) as fasta_file:
+        for header, part in fasta_len.split_headers(fasta_len.read_blocks(fasta_file)):
+            # the carriage return of a CRLF line ending is not part of the header
+            if header and WHITESPACE.search(part, 0, len(part) - (part[-1:] == b'\r')):
+                return False
+    return True
+
+
+def fix_file(filename: str, compresslevel: int = 6) -> Optional[List[Tuple[str, str]]]:
+    """Keep only the first word of the headers of a FASTA file, in place.
+
+    Args:
+        filename: Path of the FASTA file, plain, gzip or bgzip-compressed.
+        compresslevel: Compression level of a compressed file.
+
+    Returns:
+        The old and new header of each header changed, or None if the file was already clean.
+
+    """
+    if is_clean(filename):
+        return None
+
+    directory, basename = os.path.split(os.path.abspath(filename))
+    output = os.path.join(directory, '.{}.{}.tmp'.format(basename, uuid.uuid4()))
+    compressed = fasta_len.is_gzip(filename)
+    bgzip = compressed and fasta_len.is_bgzip(filename)
+
+    changes = []
+    names = set()
+    try:
+        with fasta_len.open_fasta(filename) as fasta_file, (
+            gzip.open(output, 'wb', compresslevel=compresslevel)
+            if compressed and not bgzip else open(output, 'wb')
+        ) as output_file:
+            writer = fasta_len.BgzfWriter(output_file, compresslevel) if bgzip else output_file
+            for header, part in fasta_len.split_headers(fasta_len.read_blocks(fasta_file)):
+                if header:
+                    old = part.tobytes()
+                    part = fasta_len.fix_header(old)
+                    new = part[1:].rstrip(b'\r').decode(errors='replace')
+                    if part != old:
+                        changes.append((old[1:].rstrip(b'\r').decode(errors='replace'), new))
+                    if part in names:
+                        print('{}: header {} is not unique'.format(filename, new), file=sys.stderr)
+                    names.add(part)
+                writer.write(part)
+            if bgzip:
+                writer.close()
+
+        shutil.copymode(filename, output)
+        # the offsets of the indexes are stale once the headers are shorter
+        indexes = [x for x in (filename + '.fai', filename + '.gzi') if os.path.exists(x)]
+        for index in indexes:
+            os.remove(index)
+        os.replace(output, filename)
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+    if indexes:
+        try:
+            fasta_len.index_fasta(filename, fasta_len.read_fasta(filename))
+        except ValueError as error:
+            print('{}: {}'.format(filename, error), file=sys.stderr)
+
+    return changes
+
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("input", help = "FAST file")
+    parser.add_argument("input", nargs = "+", help = "FASTA files, plain or gzip")
+    parser.add_argument(
+        "--processes", type = int, default = os.cpu_count(), help = "maximum amount of files fixed at once"
+    )
+    parser.add_argument(
+        "--mapping", metavar = "TSV",
+        help = "write the old and new header of each header changed, quoting those containing tabs"
+    )
+    parser.add_argument(
+        "--compresslevel", type = int, default = 6, help = "gzip compression level of the compressed files"
+    )
     args = parser.parse_args()
 
-    if not os.path.exists(args.input):
-        print('File {} does not exist!'.format(args.input))
-        sys.exit(1)
-
-    output = str(uuid.uuid4())
-    f = open(output, "w")
+    for filename in args.input:
+        if not os.path.exists(filename):
+            print('File {} does not exist!'.format(filename))
+            sys.exit(1)
 
-    for line in fileinput.input(args.input):
-        if line[0] == '>':
-            line = line.split()[0] + '\n'
-        f.write(line)
+    filenames = list(dict.fromkeys(args.input))
+    fix = functools.partial(fix_file, compresslevel = args.compresslevel)
+    with ProcessPoolExecutor(max_workers = max(1, min(args.processes, len(filenames)))) as pool:
+        results = list(pool.map(fix, filenames))
 
-    f.close()
+    for filename, changes in zip(filenames, results):
+        if changes is None:
+            print('{}: headers already clean'.format(filename))
+            continue
 
-    #rename files
-    tmp_filename = str(uuid.uuid4())
+        print('{}: {} headers fixed'.format(filename, len(changes)))
 
-    os.rename(args.input,tmp_filename)
-    os.rename(output, args.input)
-    os.remove(tmp_filename)
\ No newline at end of file
+    if args.mapping is not None:
+        with open(args.mapping, 'w', newline='') as mapping_file:
+            # descriptions may contain tabs
+            writer = csv.writer(mapping_file, delimiter='\t', lineterminator='\n')
+            for filename, changes in zip(filenames, results):
+                writer.writerows((filename, old, new) for old, new in changes or [])
@@ -1,21 +1,651 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""Print the length of each sequence of a FASTA file, and their total.
+
+The file is read as bytes in large blocks and the residues of each record
+are counted without building its sequence, so chromosome-scale assemblies
+take little memory. Plain, gzip and bgzip files are supported.
+
+With --index, a samtools-compatible `.fai` index is written next to the
+FASTA file (and a `.gzi` index for bgzip files). Later runs read the
+lengths from the index while it is newer than the FASTA file, printing
+the sequence names only, as samtools does.
+
+With --assemblies_dirs, as given to cactus_tree_prepare.py, every assembly
+found is summarised instead, in parallel, as one table: records, total
+length, N50/L50, and N, GC and soft-masked content. The statistics are
+cached by path, size and modification time, so that a rerun only scans
+new or changed assemblies.
+
+"""
+
+import argparse
+import gzip
+import json
+import os.path
+import re
+import string
+import struct
 import sys
-from Bio.SeqIO.FastaIO import SimpleFastaParser
-import si_prefix
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# size of the blocks read from the FASTA file
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# bytes of uncompressed data per BGZF block, as bgzip does
+BGZF_BLOCK_SIZE = 0xFF00
+
+# the empty block ending every bgzip file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# soft-masked residues, e.g., by RepeatMasker
+LOWERCASE = string.ascii_lowercase.encode()
+
+# columns of the table of --assemblies_dirs
+COLUMNS = ['assembly', 'records', 'length', 'n50', 'l50', 'n_percent', 'gc_percent', 'masked_percent', 'path']
+
+
+class FastaRecord(NamedTuple):
+    """A sequence of a FASTA file, with the fields of its `.fai` line.
+
+    Attributes:
+        title: Header line, without '>'.
+        length: Amount of residues.
+        offset: Offset of the first residue, in the uncompressed file.
+        line_bases: Residues per line.
+        line_width: Bytes per line, including the end of line.
+        uniform: Whether every line but the last has the same length, as indexing requires.
+        gc: Amount of G and C residues, if counted.
+        at: Amount of A and T residues, if counted.
+        n: Amount of N residues, if counted.
+        masked: Amount of lowercase residues, if counted.
+
+    """
+
+    title: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+    uniform: bool
+    gc: int = 0
+    at: int = 0
+    n: int = 0
+    masked: int = 0
+
+    @property
+    def name(self) -> str:
+        """Name of the sequence, i.e., the first word of its header."""
+        return self.title.split(maxsplit=1)[0] if self.title.strip() else ''
+
+    def to_fai(self) -> str:
+        """Format the record as a line of a `.fai` index."""
+        fields = [self.name, self.length, self.offset, self.line_bases, self.line_width]
+        return '\t'.join(str(x) for x in fields) + '\n'
+
+
+class RecordScan:
+    """Counts of a record being scanned, block after block."""
+
+    def __init__(self, title: bytes, start: int, composition: bool = False):
+        self.title = title.rstrip(b'\r').decode()
+        self.start = start
+        self.size = 0
+        self.newlines = 0
+        self.ignored = 0
+        self.aligned = 0
+        self.line_bases = 0
+        self.line_width = 0
+        self.last_byte = 0
+        self.composition = [0, 0, 0, 0] if composition else None
+
+    def add(self, block: bytes, start: int, end: int, position: int) -> None:
+        """Count the part `block[start:end]` of the sequence, `position` being the offset of the block."""
+        if start >= end:
+            return
+
+        self.size += end - start
+        self.newlines += block.count(b'\n', start, end)
+        # as Biopython, spaces and carriage returns are not residues
+        self.ignored += block.count(b'\r', start, end) + block.count(b' ', start, end)
+        before, self.last_byte = self.last_byte, block[end - 1]
+
+        if self.composition is not None:
+            segment = block[start:end]
+            upper = segment.upper()
+            self.composition[0] += upper.count(b'G') + upper.count(b'C')
+            self.composition[1] += upper.count(b'A') + upper.count(b'T')
+            self.composition[2] += upper.count(b'N')
+            self.composition[3] += len(segment) - len(segment.translate(None, LOWERCASE))
+
+        if not self.line_width:
+            first = block.find(b'\n', start, end)
+            if first < 0:
+                return
+            self.line_width = position + first - self.start + 1
+            self.line_bases = self.line_width - 1 - ((block[first - 1] if first > start else before) == 0x0D)
+
+        # the ends of line expected by a uniform line width
+        expected = self.start + self.line_width - 1
+        if position + start > expected:
+            expected += -(-(position + start - expected) // self.line_width) * self.line_width
+        self.aligned += block[expected - position:end:self.line_width].count(b'\n')
+
+    def finish(self) -> FastaRecord:
+        """Get the record scanned."""
+        length = self.size - self.newlines - self.ignored
+        # a carriage return ending the file is the end of the last line, without its line feed
+        trailing = int(self.last_byte == 0x0D)
+        if not self.line_width:
+            # a single line without end of line, read as if it had one
+            return FastaRecord(
+                self.title, length, self.start, length, self.size + (self.size > 0), self.ignored == trailing,
+                *(self.composition or [])
+            )
+
+        # every end of line is where expected but the last one, ending a shorter last line
+        if self.last_byte != 0x0A:
+            last_line = self.size - self.newlines * self.line_width - trailing
+            lines = self.aligned == self.newlines and last_line <= self.line_bases
+        elif self.size % self.line_width:
+            lines = self.aligned == self.newlines - 1 and self.size // self.line_width == self.newlines - 1
+        else:
+            lines = self.aligned == self.newlines
+        uniform = lines and self.ignored == self.newlines * (self.line_width - self.line_bases - 1) + trailing
+        return FastaRecord(
+            self.title, length, self.start, self.line_bases, self.line_width, uniform,
+            *(self.composition or [])
+        )
+
+
+def scan_fasta(blocks: Iterable[bytes], composition: bool = False) -> Iterator[FastaRecord]:
+    """Find the records of a FASTA file read in blocks, counting their residues.
+
+    Only header lines are carried over from a block to the next one, so a
+    sequence written on a single line is never held in memory at once.
+
+    Args:
+        blocks: The content of the FASTA file, in consecutive blocks.
+        composition: Whether to count the GC, AT, N and lowercase residues too.
+
+    Yields:
+        Each record of the file.
+
+    """
+    record: Optional[RecordScan] = None
+    position = 0
+    line_start = True
+    carry = b''
+
+    for block in blocks:
+        if carry:
+            position -= len(carry)
+            block = carry + block
+            carry = b''
+
+        index = 0
+        while index < len(block):
+            if block[index] == 0x3E and (block[index - 1] == 0x0A if index else line_start):
+                end = block.find(b'\n', index)
+                if end < 0:
+                    carry = block[index:]
+                    break
+                if record is not None:
+                    yield record.finish()
+                record = RecordScan(block[index + 1:end], position + end + 1, composition)
+                index = end + 1
+                continue
+
+            header = block.find(b'\n>', index)
+            stop = len(block) if header < 0 else header + 1
+            # anything before the first header is ignored, as Biopython does
+            if record is not None:
+                record.add(block, index, stop, position)
+            index = stop
+
+        position += len(block)
+        line_start = bool(carry) or block.endswith(b'\n')
+
+    if carry:
+        if record is not None:
+            yield record.finish()
+        record = RecordScan(carry[1:], position, composition)
+
+    if record is not None:
+        yield record.finish()
+
+
+def split_headers(blocks: Iterable[bytes]) -> Iterator[Tuple[bool, memoryview]]:
+    """Split a FASTA file read in blocks into header lines and everything else.
+
+    Only header lines are carried over from a block to the next one, so the
+    sequences are never held in memory at once.
+
+    Args:
+        blocks: The content of the FASTA file, in consecutive blocks.
+
+    Yields:
+        Whether each part is a header line, without its end of line, and the part.
+
+    """
+    line_start = True
+    carry = b''
+    for block in blocks:
+        if carry:
+            block = carry + block
+            carry = b''
+
+        view = memoryview(block)
+        index = 0
+        while index < len(block):
+            if block[index] == 0x3E and (block[index - 1] == 0x0A if index else line_start):
+                end = block.find(b'\n', index)
+                if end < 0:
+                    carry = block[index:]
+                    break
+                yield True, view[index:end]
+                index = end
+                continue
+
+            header = block.find(b'\n>', index)
+            stop = len(block) if header < 0 else header + 1
+            yield False, view[index:stop]
+            index = stop
+
+        line_start = bool(carry) or block.endswith(b'\n')
+
+    if carry:
+        yield True, memoryview(carry)
+
+
+def fix_header(header: bytes) -> bytes:
+    """Keep the first word of a header line, and the carriage return ending it if any."""
+    line = header.rstrip(b'\r')
+    words = line.split()
+    return (words[0] if words else line) + header[len(line):]
+
+
+def fix_headers(blocks: Iterable[bytes], changes: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """Keep only the first word of the header lines of a FASTA file read in blocks.
+
+    Args:
+        blocks: The content of the FASTA file, in consecutive blocks.
+        changes: Where to append the old and new header of each header changed.
+
+    Yields:
+        The fixed content, in blocks of about the size of those read.
+
+    """
+    parts = []
+    size = 0
+    for header, part in split_headers(blocks):
+        if header:
+            old = part.tobytes()
+            part = fix_header(old)
+            if part != old:
+                names = [x[1:].rstrip(b'\r').decode(errors='replace') for x in (old, part)]
+                changes.append((names[0], names[1]))
+        parts.append(part)
+        size += len(part)
+        if size >= BLOCK_SIZE:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+
+    if parts:
+        yield b''.join(parts)
+
+
+def is_gzip(filename: str) -> bool:
+    """Check the magic number of a file, as bgzip files are gzip files too."""
+    with open(filename, 'rb') as fasta_file:
+        return fasta_file.read(2) == b'\x1f\x8b'
+
+
+def is_bgzip(filename: str) -> bool:
+    """Check whether a gzip file starts with a BGZF block, i.e., was compressed by bgzip."""
+    with open(filename, 'rb') as fasta_file:
+        header = fasta_file.read(16)
+    return len(header) == 16 and header[3] & 4 != 0 and header[12:14] == b'BC'
+
+
+def read_blocks(handle: BinaryIO) -> Iterator[bytes]:
+    """Read a file in blocks of `BLOCK_SIZE`."""
+    while True:
+        block = handle.read(BLOCK_SIZE)
+        if not block:
+            return
+        yield block
+
+
+def open_fasta(filename: str) -> BinaryIO:
+    """Open a plain, gzip or bgzip FASTA file to read it in binary mode."""
+    return gzip.open(filename, 'rb') if is_gzip(filename) else open(filename, 'rb')
+
+
+def read_fasta(filename: str, composition: bool = False) -> List[FastaRecord]:
+    """Scan the records of a plain, gzip or bgzip FASTA file, see `scan_fasta`."""
+    with open_fasta(filename) as fasta_file:
+        return list(scan_fasta(read_blocks(fasta_file), composition))
+
+
+def read_fai(filename: str) -> List[FastaRecord]:
+    """Load the records of a `.fai` index, their titles being the sequence names."""
+    records = []
+    with open(filename, 'r') as fai_file:
+        for line in fai_file:
+            name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')[:5]
+            fields = [int(x) for x in (length, offset, line_bases, line_width)]
+            records.append(FastaRecord(name, *fields, True))
+    return records
+
+
+def write_fai(filename: str, records: Iterable[FastaRecord]) -> None:
+    """Write a `.fai` index, refusing records samtools could not index."""
+    records = list(records)
+    for record in records:
+        if not record.uniform:
+            raise ValueError('Different line length in sequence {}, cannot index it'.format(record.name))
+
+    with open(filename + '.tmp', 'w') as fai_file:
+        fai_file.writelines(x.to_fai() for x in records)
+    os.replace(filename + '.tmp', filename)
+
+
+def read_bgzip_offsets(filename: str) -> List[Tuple[int, int]]:
+    """Get the compressed and uncompressed offsets of each block of a bgzip file but the first.
+
+    Only the headers of the blocks are read, and their uncompressed sizes.
+
+    """
+    offsets = []
+    compressed, uncompressed = 0, 0
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as bgzip_file:
+        while compressed < size:
+            if compressed:
+                offsets.append((compressed, uncompressed))
+            header = bgzip_file.read(18)
+            if len(header) < 18 or header[12:14] != b'BC':
+                raise ValueError('{} is not a bgzip file'.format(filename))
+            block_size = struct.unpack('<H', header[16:18])[0] + 1
+            bgzip_file.seek(compressed + block_size - 4)
+            uncompressed += struct.unpack('<I', bgzip_file.read(4))[0]
+            compressed += block_size
+
+    # the empty block marking the end of the file starts no data
+    if offsets and offsets[-1][1] == uncompressed:
+        offsets.pop()
+    return offsets
+
+
+def write_gzi(filename: str, offsets: Iterable[Tuple[int, int]]) -> None:
+    """Write a `.gzi` index: the count of offsets, then each offset, as unsigned 64-bit little-endian."""
+    offsets = list(offsets)
+    with open(filename, 'wb') as gzi_file:
+        gzi_file.write(struct.pack('<Q', len(offsets)))
+        for offset in offsets:
+            gzi_file.write(struct.pack('<QQ', *offset))
+
+
+class BgzfWriter:
+    """Compress data into BGZF blocks, keeping the offsets of the `.gzi` index.
+
+    Attributes:
+        offsets: The compressed and uncompressed offsets of each block but the first.
+
+    """
+
+    def __init__(self, handle: BinaryIO, compresslevel: int = 6):
+        self.handle = handle
+        self.compresslevel = compresslevel
+        self.pending = b''
+        self.compressed = 0
+        self.uncompressed = 0
+        self.offsets: List[Tuple[int, int]] = []
+
+    def write(self, data: bytes) -> None:
+        """Compress the full blocks of the data, keeping the rest for later."""
+        data = self.pending + data if self.pending else data
+        view = memoryview(data)
+        start = 0
+        while len(data) - start >= BGZF_BLOCK_SIZE:
+            self.write_block(view[start:start + BGZF_BLOCK_SIZE])
+            start += BGZF_BLOCK_SIZE
+        self.pending = bytes(view[start:])
+
+    def write_block(self, data) -> None:
+        """Compress one block."""
+        if self.compressed:
+            self.offsets.append((self.compressed, self.uncompressed))
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        # gzip header with the BC extra field holding the size of the block
+        header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+        self.handle.write(header)
+        self.handle.write(deflated)
+        self.handle.write(struct.pack('<II', zlib.crc32(data), len(data)))
+        self.compressed += len(header) + len(deflated) + 8
+        self.uncompressed += len(data)
+
+    def close(self) -> None:
+        """Compress the last block and end the file."""
+        if self.pending:
+            self.write_block(self.pending)
+            self.pending = b''
+        self.handle.write(BGZF_EOF)
+
+
+def index_fasta(filename: str, records: Iterable[FastaRecord]) -> None:
+    """Write the `.fai` index of a FASTA file, and its `.gzi` index if compressed by bgzip."""
+    if is_gzip(filename):
+        if not is_bgzip(filename):
+            raise ValueError('Cannot index files compressed with gzip, please use bgzip')
+        write_gzi(filename + '.gzi', read_bgzip_offsets(filename))
+    write_fai(filename + '.fai', records)
+
+
+def get_records(filename: str, index: bool = False) -> List[FastaRecord]:
+    """Get the records of a FASTA file, from its `.fai` index if up to date.
+
+    Args:
+        filename: Path of the FASTA file.
+        index: Whether to write its index if not up to date.
+
+    Returns:
+        Each record of the file.
+
+    """
+    fai = filename + '.fai'
+    if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(filename):
+        return read_fai(fai)
+
+    records = read_fasta(filename)
+    if index:
+        index_fasta(filename, records)
+    return records
+
+
+def find_assemblies(directories: Iterable[str], ext: str) -> List[str]:
+    """Find the assemblies of the given directories, as cactus_tree_prepare.py does.
+
+    Args:
+        directories: Paths where the FASTA files are.
+        ext: Extension of the FASTA files, optionally followed by `.gz`.
+
+    Returns:
+        Absolute path of each assembly found.
+
+    """
+    ext = "." + re.sub("\\W+|_", "", ext).lower()
+
+    filenames = []
+    for dest in directories:
+        dest = os.path.abspath(dest)
+        for filename in sorted(os.listdir(dest)):
+            if filename.endswith((ext, ext + '.gz')):
+                filenames.append(os.path.join(dest, filename))
+            elif not filename.endswith(('.fai', '.gzi')):
+                print(
+                    'file {} does not end with {}, thus it will been ignored'.format(filename, ext),
+                    file=sys.stderr
+                )
+    return filenames
+
+
+def get_n50(lengths: List[int]) -> List[int]:
+    """Get the N50 and L50 of the lengths of the records of an assembly."""
+    half = sum(lengths) / 2
+    covered = 0
+    for index, length in enumerate(sorted(lengths, reverse=True)):
+        covered += length
+        if covered >= half:
+            return [length, index + 1]
+    return [0, 0]
+
+
+def get_assembly_name(filename: str) -> str:
+    """Get the name of an assembly from its path, without its extensions."""
+    return re.sub('(\\.gz)?$', '', os.path.basename(filename)).rsplit('.', 1)[0]
+
+
+def format_stat(value: float) -> str:
+    """Format a statistic of an assembly, percentages with two decimals."""
+    return '{:.2f}'.format(value) if isinstance(value, float) else str(value)
+
+
+def summarise_records(records: List[FastaRecord]) -> Dict[str, float]:
+    """Summarise the records of an assembly scanned with their composition, see `COLUMNS`.
+
+    Args:
+        records: Each record of the assembly.
+
+    Returns:
+        The statistics of the assembly, the N, GC and masked content in percentage.
+
+    """
+    length = sum(x.length for x in records)
+    gc = sum(x.gc for x in records)
+    n50, l50 = get_n50([x.length for x in records])
+    return {
+        'records': len(records),
+        'length': length,
+        'n50': n50,
+        'l50': l50,
+        'n_percent': 100 * sum(x.n for x in records) / length if length else 0.0,
+        'gc_percent': 100 * gc / (gc + sum(x.at for x in records)) if gc else 0.0,
+        'masked_percent': 100 * sum(x.masked for x in records) / length if length else 0.0,
+    }
+
+
+def get_assembly_stats(filename: str) -> Dict[str, float]:
+    """Scan and summarise an assembly, see `summarise_records`."""
+    return summarise_records(read_fasta(filename, composition=True))
+
+
+def read_cache(filename: str) -> Dict[str, dict]:
+    """Load the statistics of the assemblies summarised before, by path."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as cache_file:
+        return json.load(cache_file)
+
+
+def write_cache(filename: str, cache: Dict[str, dict]) -> None:
+    """Save the statistics of the assemblies, atomically."""
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename + '.tmp', 'w') as cache_file:
+        json.dump(cache, cache_file, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def summarise_assemblies(filenames: List[str], cache: Dict[str, dict], processes: int) -> Dict[str, dict]:
+    """Get the statistics of the assemblies, scanning those not cached in parallel.
+
+    Args:
+        filenames: Paths of the assemblies.
+        cache: Statistics of the assemblies summarised before, updated in place.
+        processes: Maximum amount of assemblies scanned at once.
+
+    Returns:
+        The statistics of each assembly, by path.
+
+    """
+    missing = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        entry = cache.get(filename)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            missing.append((filename, stat))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=min(processes, len(missing))) as pool:
+            results = pool.map(get_assembly_stats, [x[0] for x in missing])
+            for (filename, stat), result in zip(missing, results):
+                cache[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'stats': result}
+
+    return {x: cache[x]['stats'] for x in filenames}
+
+
+if __name__ == "__main__":
+
+    # only needed to print the lengths, so that other scripts can import fasta_len without it
+    import si_prefix
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs = "?", help = "FASTA file, plain, gzip or bgzip")
+    parser.add_argument("--index", action = "store_true", help = "write a samtools-compatible .fai index")
+    parser.add_argument(
+        "--assemblies_dirs", nargs = "+", help = "summarise every assembly of these directories instead"
+    )
+    parser.add_argument(
+        "--extension", default = ".fa", help = "the expected extension of the assemblies (--assemblies_dirs)"
+    )
+    parser.add_argument(
+        "--processes", type = int, default = os.cpu_count(),
+        help = "maximum amount of assemblies scanned at once"
+    )
+    parser.add_argument(
+        "--cache", default = os.path.join(os.path.expanduser('~'), '.cache', 'fasta_len.json'),
+        help = "statistics of the assemblies summarised before (--assemblies_dirs)"
+    )
+    args = parser.parse_args()
 
-FastaFile = open(sys.argv[1], 'r')
+    if args.assemblies_dirs:
+        cache = read_cache(args.cache)
+        filenames = find_assemblies(args.assemblies_dirs, args.extension)
+        stats = summarise_assemblies(filenames, cache, args.processes)
+        write_cache(args.cache, cache)
 
+        print(';'.join(COLUMNS))
+        for filename, assembly in stats.items():
+            print(';'.join(
+                [get_assembly_name(filename)] + [format_stat(assembly[x]) for x in COLUMNS[1:-1]] + [filename]
+            ))
+        sys.exit(0)
 
-total = 0
+    if args.input is None:
+        parser.error('either a FASTA file or --assemblies_dirs is required')
 
-for name, seq in SimpleFastaParser(FastaFile):
-    seqLen = len(seq)
-    total = total + seqLen
-    print('name: {}\tlen: {}\t -> {}'.format(name,seqLen, si_prefix.si_format(seqLen)))
+    if not os.path.exists(args.input):
+        print('File {} does not exist!'.format(args.input))
+        sys.exit(1)
 
-FastaFile.close()
+    try:
+        records = get_records(args.input, args.index)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
 
+    total = 0
+    for record in records:
+        total = total + record.length
+        print('name: {}\tlen: {}\t -> {}'.format(
+            record.title, record.length, si_prefix.si_format(record.length)
+        ))
 
-print('Total: {} -> {}'.format(total, si_prefix.si_format(total)))
+    print('Total: {} -> {}'.format(total, si_prefix.si_format(total)))
@@ -1,53 +1,629 @@
 #!/usr/bin/env python3
 
-import fileinput
+"""Extract the runtime of each Toil job from Cactus logs, e.g., the --logFile of cactus_batcher jobs.
+
+Logs can be given as files, directories (searched recursively for `.log`
+and `.log.gz` files) or glob patterns, plain or gzip/bgzip-compressed. Each file is scanned in large
+blocks for the "Successfully ran:" lines only, and the files are spread
+over a pool of processes. The durations of each job are merged exactly
+across files, so the statistics do not depend on how the logs are split.
+
+With --concurrency, the start and end of each Toil job are rebuilt from the
+timestamp of its "Successfully ran:" line (its end) and its runtime, to
+tell for each log how many jobs ran at once over time, its effective
+parallelism and its idle gaps, i.e., whether more cores would help.
+
+With --state, the byte offset reached in each log and the running sums of
+its jobs are kept in a JSON file, so that each run only parses the lines
+appended since the previous one; --follow repeats it every few seconds to
+watch a long alignment. Rotated logs are followed by inode, and the sums of
+truncated, replaced or removed logs are kept aside as history.
+
+"""
+
 import argparse
+import datetime
+import glob
+import gzip
+import json
+import math
+import mmap
 import os.path
+import re
 import sys
+import time
 
-import datetime
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from statistics import mean, median, pstdev
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+MARKER = b'Successfully ran:'
+
+# size of the blocks read from compressed logs
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# timestamp of a log line, e.g., [2023-01-31T10:00:00+0000] or 2023-01-31 10:00:00,123
+TIMESTAMP = re.compile(
+  rb'(\d{4}-\d\d-\d\d)[T ](\d\d:\d\d:\d\d)(?:[.,](\d+))?\s*(Z|[+-]\d\d:?\d\d)?'
+)
+
+# logs found in directories, leaving the .err/.out, .lifecycle, .usage.csv and .steps files of the jobs
+LOG_EXTENSIONS = ('.log', '.log.gz')
+
+# bytes at the start of a log compared between runs of --state
+HEAD_SIZE = 256
+
+# output formats: the historical one, read by cactus_batcher.py --runtimes, and one with more statistics
+FORMATS = {
+  'default': ['job', 'count', 'mean', 'stdev'],
+  'full': ['job', 'count', 'mean', 'stdev', 'p50', 'p95', 'max', 'total'],
+}
+
+
+def find_logs(paths: Iterable[str]) -> List[str]:
+  """Expand the given files, directories and glob patterns into log files.
+
+  Args:
+    paths: Log files, directories searched recursively for `LOG_EXTENSIONS` files, or glob patterns.
+
+  Returns:
+    Path of each log file, in the given order.
+
+  """
+  filenames = []
+  for path in paths:
+    matches = [path] if os.path.exists(path) else sorted(glob.glob(path, recursive=True))
+    if not matches:
+      print('File {} does not exist!'.format(path))
+      sys.exit(1)
+
+    for match in matches:
+      if os.path.isdir(match):
+        for root, dirs, files in os.walk(match):
+          dirs.sort()
+          filenames.extend(os.path.join(root, x) for x in sorted(files) if x.endswith(LOG_EXTENSIONS))
+      else:
+        filenames.append(match)
+
+  return list(dict.fromkeys(filenames))
+
+
+def is_gzip(filename: str) -> bool:
+  """Check the magic number of a file, as bgzip files are gzip files too."""
+  with open(filename, 'rb') as log_file:
+    return log_file.read(2) == b'\x1f\x8b'
+
+
+def find_lines(buffer, start: int = 0, end: int = -1) -> Iterator[bytes]:
+  """Find the lines containing `MARKER` in a buffer, e.g., a memory-mapped file.
+
+  Args:
+    buffer: A bytes-like object supporting find and rfind.
+    start: Offset from which to search.
+    end: Offset up to which to search, or -1 for the end of the buffer.
+
+  Yields:
+    Each line found, without its end of line.
+
+  """
+  end = len(buffer) if end < 0 else end
+  position = buffer.find(MARKER, start, end)
+  while position >= 0:
+    line_start = max(buffer.rfind(b'\n', start, position) + 1, start)
+    line_end = buffer.find(b'\n', position, end)
+    if line_end < 0:
+      line_end = end
+    yield buffer[line_start:line_end]
+    position = buffer.find(MARKER, line_end, end)
+
+
+def read_lines(filename: str) -> Iterator[bytes]:
+  """Find the lines containing `MARKER` in a plain or gzip-compressed log.
+
+  Plain logs are memory-mapped, while compressed logs are decompressed in
+  blocks of `BLOCK_SIZE`, carrying the last partial line over to the next block.
+
+  Args:
+    filename: Path of the log.
+
+  Yields:
+    Each line found, without its end of line.
+
+  """
+  if os.path.getsize(filename) == 0:
+    return
+
+  if not is_gzip(filename):
+    with open(filename, 'rb') as log_file:
+      with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        yield from find_lines(buffer)
+    return
+
+  with gzip.open(filename, 'rb') as log_file:
+    tail = b''
+    while True:
+      block = log_file.read(BLOCK_SIZE)
+      if not block:
+        break
+      block = tail + block
+      cut = block.rfind(b'\n') + 1
+      yield from find_lines(block, 0, cut)
+      tail = block[cut:]
+    yield from find_lines(tail)
+
+
+def parse_line(line: bytes):
+  """Get the job name and runtime of a "Successfully ran:" line, or None if it is malformed."""
+  fields = line.decode(errors='replace').strip().split('ran:')[1].split()
+  if len(fields) < 3 or fields[-1] != 'seconds':
+    return None
+
+  try:
+    return fields[0].replace('"', ''), float(fields[-2])
+  except ValueError:
+    return None
+
+
+def parse_log(filename: str) -> Dict[str, array]:
+  """Get the runtime of each Toil job of a log.
+
+  Args:
+    filename: Path of the log.
+
+  Returns:
+    The runtimes of each job, in order of appearance.
+
+  """
+  table: Dict[str, array] = {}
+  for line in read_lines(filename):
+    parsed = parse_line(line)
+    if parsed is None:
+      print(
+        'Skipping malformed line of {}: {}'.format(filename, line.decode(errors='replace')), file=sys.stderr
+      )
+      continue
+
+    job, time = parsed
+    if job not in table:
+      table[job] = array('d')
+    table[job].append(time)
+
+  return table
+
+
+@lru_cache(maxsize=4096)
+def to_epoch(date: bytes, time: bytes, zone: Optional[bytes]) -> float:
+  """Convert a date, time and UTC offset of a log line into seconds since the Epoch."""
+  # Toil logs in UTC unless told otherwise
+  text = b'T'.join([date, time]) + (zone or b'+0000')
+  return datetime.datetime.strptime(text.decode(), '%Y-%m-%dT%H:%M:%S%z').timestamp()
+
+
+def parse_timestamp(line: bytes) -> Optional[float]:
+  """Get the time of a log line in seconds since the Epoch, or None if it has no timestamp."""
+  match = TIMESTAMP.search(line, 0, 64)
+  if match is None:
+    return None
+
+  date, time, fraction, zone = match.groups()
+  return to_epoch(date, time, zone) + (float(b'0.' + fraction) if fraction else 0.0)
+
+
+def parse_log_timeline(filename: str) -> Tuple[str, array, array]:
+  """Get the start and end of each Toil job of a log.
+
+  Args:
+    filename: Path of the log.
+
+  Returns:
+    The path of the log, and the start and end of each job in seconds since the Epoch.
+
+  """
+  starts, ends = array('d'), array('d')
+  for line in read_lines(filename):
+    parsed = parse_line(line)
+    end = parse_timestamp(line)
+    if parsed is None or end is None:
+      print(
+        'Skipping line without runtime or timestamp of {}: {}'.format(
+          filename, line.decode(errors='replace')
+        ),
+        file=sys.stderr
+      )
+      continue
+
+    starts.append(end - parsed[1])
+    ends.append(end)
+
+  return filename, starts, ends
+
+
+def analyse_concurrency(
+  starts: array, ends: array, min_gap: float, max_cores: Optional[int]
+) -> Dict[str, float]:
+  """Sweep over the starts and ends of the jobs of a log to measure its concurrency.
+
+  Args:
+    starts: Start of each job.
+    ends: End of each job.
+    min_gap: Minimum idle time, in seconds, counted as a gap.
+    max_cores: The --maxCores of the log, to measure how long it was saturated, if known.
+
+  Returns:
+    The statistics of `CONCURRENCY`, times in seconds.
+
+  """
+  # ends first at the same time, so that back-to-back jobs do not overlap
+  events = sorted([(x, 1) for x in starts] + [(x, -1) for x in ends], key=lambda x: (x[0], x[1]))
+  wall_time = events[-1][0] - events[0][0]
 
-from collections import OrderedDict
-from statistics import mean, pstdev
+  running, previous, peak = 0, events[0][0], 0
+  time_at: Dict[int, float] = {}
+  gaps = []
+  for timestamp, change in events:
+    if timestamp > previous:
+      time_at[running] = time_at.get(running, 0.0) + timestamp - previous
+      if running == 0 and timestamp - previous >= min_gap:
+        gaps.append(timestamp - previous)
+    running += change
+    peak = max(peak, running)
+    previous = timestamp
+
+  work = sum(ends) - sum(starts)
+  idle = time_at.get(0, 0.0)
+  busy = wall_time - idle
+  saturation = peak if max_cores is None else max_cores
+  return {
+    'jobs': len(starts),
+    'wall_time': wall_time,
+    'busy_time': busy,
+    'idle_time': idle,
+    'gaps': len(gaps),
+    'longest_gap': max(gaps, default=0.0),
+    'parallelism': work / wall_time if wall_time else 0.0,
+    'busy_parallelism': work / busy if busy else 0.0,
+    'peak': peak,
+    'saturated': 100 * sum(y for x, y in time_at.items() if x >= saturation) / busy if busy else 0.0,
+  }
+
+
+def get_concurrency_steps(starts: array, ends: array) -> Iterator[Tuple[float, int]]:
+  """Get the amount of running jobs every time it changes."""
+  events = sorted([(x, 1) for x in starts] + [(x, -1) for x in ends], key=lambda x: (x[0], x[1]))
+  running = 0
+  for index, (timestamp, change) in enumerate(events):
+    running += change
+    if index + 1 == len(events) or events[index + 1][0] != timestamp:
+      yield timestamp, running
+
+
+CONCURRENCY = [
+  'log', 'jobs', 'wall_time', 'busy_time', 'idle_time', 'gaps', 'longest_gap',
+  'parallelism', 'busy_parallelism', 'peak', 'saturated',
+]
+
+
+def parse_logs(filenames: List[str], processes: int) -> Dict[str, array]:
+  """Get the runtime of each Toil job of several logs, parsed in parallel.
+
+  Args:
+    filenames: Paths of the logs.
+    processes: Maximum amount of logs parsed at once.
+
+  Returns:
+    The runtimes of each job over every log, in order of appearance.
+
+  """
+  if processes <= 1 or len(filenames) <= 1:
+    tables = map(parse_log, filenames)
+    return merge_tables(tables)
+
+  with ProcessPoolExecutor(max_workers=min(processes, len(filenames))) as pool:
+    return merge_tables(pool.map(parse_log, filenames))
+
+
+def merge_tables(tables: Iterable[Dict[str, array]]) -> Dict[str, array]:
+  """Merge the runtimes of each job of several logs, keeping the order of appearance."""
+  merged: Dict[str, array] = {}
+  for table in tables:
+    for job, times in table.items():
+      if job in merged:
+        merged[job].extend(times)
+      else:
+        merged[job] = times
+  return merged
+
+
+def percentile(times: array, fraction: float) -> float:
+  """Get a percentile of the runtimes, by nearest rank."""
+  ordered = sorted(times)
+  return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def format_row(job: str, times: array, output_format: str) -> str:
+  """Format the statistics of a job, see `FORMATS`."""
+  row = [job, len(times), mean(times), pstdev(times)]
+  if output_format == 'full':
+    row += [median(times), percentile(times, 0.95), max(times), sum(times)]
+  return ';'.join([row[0], str(row[1])] + ['{:.2f}'.format(x) for x in row[2:]])
+
+
+def add_runtime(sums: Dict[str, List[float]], job: str, runtime: float) -> None:
+  """Add the runtime of a job to its running sums: count, total, sum of squares, minimum and maximum."""
+  if job not in sums:
+    sums[job] = [1, runtime, runtime * runtime, runtime, runtime]
+    return
+
+  job_sums = sums[job]
+  job_sums[0] += 1
+  job_sums[1] += runtime
+  job_sums[2] += runtime * runtime
+  job_sums[3] = min(job_sums[3], runtime)
+  job_sums[4] = max(job_sums[4], runtime)
+
+
+def merge_sums(merged: Dict[str, List[float]], sums: Dict[str, List[float]]) -> None:
+  """Merge the running sums of each job into others, keeping the order of appearance."""
+  for job, (count, total, squares, low, high) in sums.items():
+    if job not in merged:
+      merged[job] = [count, total, squares, low, high]
+      continue
+
+    job_sums = merged[job]
+    job_sums[0] += count
+    job_sums[1] += total
+    job_sums[2] += squares
+    job_sums[3] = min(job_sums[3], low)
+    job_sums[4] = max(job_sums[4], high)
+
+
+def scan_log(filename: str, offset: int) -> Tuple[Dict[str, List[float]], int]:
+  """Get the running sums of each Toil job of a log from a byte offset.
+
+  Plain logs are parsed up to their last complete line only, as they may be
+  in the middle of being written. Compressed logs cannot be resumed, so they
+  are parsed from their start whatever the offset.
+
+  Args:
+    filename: Path of the log.
+    offset: Byte offset of the first line to parse.
+
+  Returns:
+    The running sums of each job, see `add_runtime`, and the offset reached.
+
+  """
+  sums: Dict[str, List[float]] = {}
+  if is_gzip(filename):
+    for line in read_lines(filename):
+      parsed = parse_line(line)
+      if parsed is not None:
+        add_runtime(sums, *parsed)
+    return sums, os.path.getsize(filename)
+
+  with open(filename, 'rb') as log_file:
+    if os.fstat(log_file.fileno()).st_size <= offset:
+      return sums, offset
+
+    with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      end = buffer.rfind(b'\n', offset) + 1
+      if end <= offset:
+        return sums, offset
+
+      for line in find_lines(buffer, offset, end):
+        parsed = parse_line(line)
+        if parsed is None:
+          print(
+            'Skipping malformed line of {}: {}'.format(filename, line.decode(errors='replace')),
+            file=sys.stderr
+          )
+          continue
+        add_runtime(sums, *parsed)
+
+  return sums, end
+
+
+def read_head(filename: str) -> str:
+  """Get the first bytes of a log, decompressed, in hexadecimal, to tell whether it was replaced."""
+  with (gzip.open if is_gzip(filename) else open)(filename, 'rb') as log_file:
+    return log_file.read(HEAD_SIZE).hex()
+
+
+def update_state(state: dict, filenames: List[str], pool: Optional[ProcessPoolExecutor]) -> None:
+  """Parse what was appended to the logs since the offsets of the state, and update it.
+
+  The logs are followed by device and inode, so a rotated log keeps its
+  offset under its new name. The sums of a log truncated, replaced or no
+  longer given are moved to the retired sums, as its jobs did run, unless
+  a new compressed log starts like it, i.e., the log was compressed.
+
+  Args:
+    state: The `files` (by "device:inode") and `retired` sums, updated in place.
+    filenames: Paths of the logs.
+    pool: Processes to parse the logs with, if any.
+
+  """
+  old_files = state['files']
+  files = {}
+  work = []
+  compressed = []
+  for filename in filenames:
+    stat = os.stat(filename)
+    key = '{}:{}'.format(stat.st_dev, stat.st_ino)
+    if key in files:
+      continue
+
+    head = read_head(filename)
+    entry = old_files.pop(key, None)
+    if entry is not None and entry['offset'] == stat.st_size and entry['head'] == head:
+      files[key] = dict(entry, path=filename)
+      continue
+
+    if entry is not None and entry['compressed']:
+      # parsed again from the start, the previous sums being a part of the new ones
+      entry = None
+    elif entry is not None and (stat.st_size < entry['offset'] or not head.startswith(entry['head'])):
+      print('Log {} was truncated or replaced, parsing it again'.format(filename), file=sys.stderr)
+      merge_sums(state['retired'], entry['jobs'])
+      entry = None
+
+    if entry is None:
+      entry = {'offset': 0, 'jobs': {}, 'compressed': is_gzip(filename)}
+      if entry['compressed']:
+        compressed.append(head)
+    files[key] = dict(entry, path=filename, head=head)
+    work.append((key, filename, entry['offset']))
+
+  for entry in old_files.values():
+    if entry['head'] and any(x.startswith(entry['head']) for x in compressed):
+      continue
+    merge_sums(state['retired'], entry['jobs'])
+
+  keys = [x[0] for x in work]
+  if pool is None:
+    results = map(scan_log, [x[1] for x in work], [x[2] for x in work])
+  else:
+    results = pool.map(scan_log, [x[1] for x in work], [x[2] for x in work])
+  for key, (sums, offset) in zip(keys, results):
+    merge_sums(files[key]['jobs'], sums)
+    files[key]['offset'] = offset
+    files[key]['head'] = files[key]['head'][:2 * offset]
+
+  state['files'] = files
+
+
+def read_state(filename: str) -> dict:
+  """Load the state of a previous run, or an empty one."""
+  if not os.path.exists(filename):
+    return {'files': {}, 'retired': {}}
+  with open(filename, 'r') as state_file:
+    return json.load(state_file)
+
+
+def write_state(filename: str, state: dict) -> None:
+  """Save the state atomically, so a killed run never leaves it half-written."""
+  with open(filename + '.tmp', 'w') as state_file:
+    json.dump(state, state_file)
+  os.replace(filename + '.tmp', filename)
+
+
+def format_sums(job: str, sums: List[float]) -> str:
+  """Format the running sums of a job as `FORMATS['default']`."""
+  count, total, squares = sums[:3]
+  runtime = total / count
+  deviation = max(squares / count - runtime ** 2, 0.0) ** 0.5
+  return '{};{};{:.2f};{:.2f}'.format(job, int(count), runtime, deviation)
+
+
+def print_state(state: dict, header: bool) -> None:
+  """Print the table of the jobs of the state, as without --state."""
+  table: Dict[str, List[float]] = {}
+  merge_sums(table, state['retired'])
+  for entry in state['files'].values():
+    merge_sums(table, entry['jobs'])
+
+  if header:
+    print(';'.join(FORMATS['default']))
+  for job, sums in table.items():
+    print(format_sums(job, sums))
+
+  total = sum(x[1] for x in table.values())
+  print('Runtime = {} seconds or {}'.format(total, str(datetime.timedelta(seconds=total))))
 
 
 if __name__ == "__main__":
 
   parser = argparse.ArgumentParser()
-  parser.add_argument("input", help = "log file")
+  parser.add_argument(
+    "input", nargs="+", help = "log files, directories of .log files or glob patterns (plain or gzip)"
+  )
+  parser.add_argument("--format", choices = list(FORMATS), default = "default", help = "output format")
+  parser.add_argument("--header", action = "store_true", help = "print the names of the columns")
+  parser.add_argument(
+    "--processes", type = int, default = os.cpu_count(), help = "maximum amount of logs parsed at once"
+  )
+  parser.add_argument(
+    "--concurrency", action = "store_true",
+    help = "print the concurrency of the Toil jobs of each log instead"
+  )
+  parser.add_argument(
+    "--min_gap", type = float, default = 1.0,
+    help = "minimum idle time, in seconds, counted as a gap (--concurrency)"
+  )
+  parser.add_argument(
+    "--max_cores", type = int, help = "--maxCores of the logs, the peak concurrency otherwise (--concurrency)"
+  )
+  parser.add_argument(
+    "--timeline", metavar = "CSV",
+    help = "write the amount of running jobs over time of each log (--concurrency)"
+  )
+  parser.add_argument(
+    "--state", metavar = "JSON",
+    help = "only parse what was appended to the logs since the run that wrote this file"
+  )
+  parser.add_argument(
+    "--follow", metavar = "SECONDS", type = float, help = "parse the logs again every SECONDS (--state)"
+  )
   args = parser.parse_args()
 
-  if not os.path.exists(args.input):
-    print('File {} does not exist!'.format(args.input))
-    sys.exit(1)
+  if args.follow is not None and args.state is None:
+    parser.error('--follow requires --state')
+  if args.state is not None and (args.format != 'default' or args.concurrency):
+    parser.error('--state only keeps running sums, for the default format')
 
-  table = OrderedDict()
+  if args.state is not None:
+    state = read_state(args.state)
+    pool = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 1 else None
+    try:
+      while True:
+        update_state(state, find_logs(args.input), pool)
+        write_state(args.state, state)
+        print_state(state, args.header)
+        if args.follow is None:
+          break
+        sys.stdout.flush()
+        time.sleep(args.follow)
+        print()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      if pool is not None:
+        pool.shutdown()
+    sys.exit(0)
 
-  for line in fileinput.input(args.input):
-    if 'Successfully ran:' in line:
-      line = (line.strip())
+  if args.concurrency:
+    filenames = find_logs(args.input)
+    with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(filenames)))) as pool:
+      timelines = [x for x in pool.map(parse_log_timeline, filenames) if len(x[1]) > 0]
 
-      line = line.split('ran:')[1].split()
-      job = line[0].replace('"','')
+    # times in seconds, to be read by a spreadsheet or a plotting tool
+    print(';'.join(CONCURRENCY))
+    for filename, starts, ends in timelines:
+      stats = analyse_concurrency(starts, ends, args.min_gap, args.max_cores)
+      print(';'.join([filename] + [
+        str(stats[x]) if isinstance(stats[x], int) else '{:.2f}'.format(stats[x]) for x in CONCURRENCY[1:]
+      ]))
 
-      assert line[-1] == 'seconds'
-      time = float(line[-2])
+    if args.timeline is not None:
+      with open(args.timeline, 'w') as timeline_file:
+        timeline_file.write('log,time,running\n')
+        for filename, starts, ends in timelines:
+          for timestamp, running in get_concurrency_steps(starts, ends):
+            timeline_file.write('{},{:.3f},{}\n'.format(filename, timestamp, running))
 
-      if job in table:
-        table[job].append(time)
-      else:
-        table[job] = [time]
+    sys.exit(0)
+
+  table = parse_logs(find_logs(args.input), args.processes)
 
+  if args.header:
+    print(';'.join(FORMATS[args.format]))
 
   total = 0.0
   for item in table.keys():
-    print('{};{};{:.2f};{:.2f}'.format(item,
-      len(table[item]),
-      mean(table[item]),
-      pstdev(table[item])
-      ))
-    
+    print(format_row(item, table[item], args.format))
+
     total = total + sum(table[item])
-    
-  print('Runtime = {} seconds or {}'.format(total, str(datetime.timedelta(seconds=total))))
 
+  print('Runtime = {} seconds or {}'.format(total, str(datetime.timedelta(seconds=total))))
@@ -0,0 +1,726 @@
+#!/usr/bin/env python3
+
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""This script samples the resource usage of a process tree, replacing usage.sh.
+
+It reads `/proc` directly instead of forking `ps`, `top`, `pgrep` and friends
+on every sample, so it can sample every second or faster without showing up
+in the profile of the job it watches.
+
+Each sample appends one row per command name of the process tree of the
+target (e.g., cactus_consolidated, python3/toil_worker.py), one `TOTAL` row
+for the whole tree and one `NODE` row for the whole node to a CSV file with
+the fixed columns of `COLUMNS`:
+    - TIMESTAMP: seconds since the Epoch;
+    - COMMAND: command name, TOTAL, NODE, GPU<index>, CGROUP or CGROUP_COUNTERS;
+    - PROCESSES: amount of processes;
+    - CPU_USAGE: CPU usage, 100 being one CPU fully used;
+    - MEM_USAGE_MB: resident memory (used memory for NODE);
+    - READ_MB_S, WRITE_MB_S: bytes read and written by system calls,
+      including network filesystems (NODE rows leave them at 0);
+    - GPU_USAGE, GPU_MEM_USAGE: GPU and GPU memory usage in percentage,
+      averaged over the GPUs of the job (NODE rows only).
+
+CGROUP_COUNTERS rows hold the cumulative counters of the cgroup instead, see
+`CgroupSampler`.
+
+With `--gpu`, the GPUs of the job (see CUDA_VISIBLE_DEVICES) are streamed
+by one `nvidia-smi -lms` process for the whole run, and each sample also
+appends one `GPU<index>` row per GPU with its mean utilisation and its peak
+memory usage since the previous sample.
+
+With `--cgroup`, the counters of the cgroup of the target are sampled
+instead, see `CgroupSampler`. They account for every process of the Slurm
+job, including the short-lived ones missed between two samples, and give
+its exact CPU time and peak memory for the cost of reading a few files.
+
+The file is only ever appended to, so several runs of a job (e.g., when it is
+requeued) share the same file, and a sample is never lost if the job is killed.
+
+The samples are kept as a text CSV file with a row per command, the layout
+of usage.sh, rather than as a binary columnar file: each sample is appended
+with a single write, so a killed job loses at most a partial last line that
+readers skip, and the files stay readable by spreadsheets and by the tools
+written for usage.sh. usage_report.py turns them into columnar arrays when
+it loads them.
+
+"""
+
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+COLUMNS = [
+    "TIMESTAMP",
+    "COMMAND",
+    "PROCESSES",
+    "CPU_USAGE",
+    "MEM_USAGE_MB",
+    "READ_MB_S",
+    "WRITE_MB_S",
+    "GPU_USAGE",
+    "GPU_MEM_USAGE",
+]
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1024 * 1024
+
+
+def read_proc_file(path: str) -> Optional[bytes]:
+    """Read a file of `/proc`, or None if the process died meanwhile."""
+    try:
+        with open(path, "rb") as proc_file:
+            return proc_file.read()
+    except OSError:
+        return None
+
+
+@dataclass
+class ProcessSample:
+    """The usage of a process when it was sampled.
+
+    Attributes:
+        pid: Process ID.
+        ppid: Parent process ID.
+        start: Start time of the process, in clock ticks since boot, telling
+            apart processes reusing the same PID.
+        comm: Name of the executable.
+        cpu_ticks: User and system CPU time, in clock ticks.
+        rss: Resident memory, in bytes.
+
+    """
+
+    pid: int
+    ppid: int
+    start: int
+    comm: str
+    cpu_ticks: int
+    rss: int
+
+    @classmethod
+    def read(cls, pid: int) -> Optional["ProcessSample"]:
+        """Read `/proc/<pid>/stat`, or None if the process died meanwhile."""
+        content = read_proc_file(f"/proc/{pid}/stat")
+        if content is None:
+            return None
+
+        # the name may contain spaces and parentheses, but it is the only field that may
+        head, _, tail = content.rpartition(b")")
+        fields = tail.split()
+        return cls(
+            pid=pid,
+            ppid=int(fields[1]),
+            start=int(fields[19]),
+            comm=head.partition(b"(")[2].decode(errors="replace"),
+            cpu_ticks=int(fields[11]) + int(fields[12]),
+            rss=int(fields[21]) * PAGE_SIZE,
+        )
+
+
+def read_io(pid: int) -> Tuple[int, int]:
+    """Get the bytes read and written by the system calls of a process so far."""
+    content = read_proc_file(f"/proc/{pid}/io")
+    if content is None:
+        return 0, 0
+
+    counters = dict(line.split(b": ") for line in content.splitlines() if b": " in line)
+    return int(counters.get(b"rchar", 0)), int(counters.get(b"wchar", 0))
+
+
+def read_node_cpu() -> Tuple[int, int]:
+    """Get the busy and total CPU time of the node so far, in clock ticks."""
+    content = read_proc_file("/proc/stat") or b""
+    fields = [int(x) for x in content.split(b"\n", 1)[0].split()[1:]]
+    idle = sum(fields[3:5])
+    return sum(fields) - idle, sum(fields)
+
+
+def read_node_memory() -> int:
+    """Get the memory used by the node, in bytes."""
+    content = read_proc_file("/proc/meminfo") or b""
+    info = dict(line.split(b":", 1) for line in content.splitlines() if b":" in line)
+    total = int(info.get(b"MemTotal", b"0 kB").split()[0])
+    available = int(info.get(b"MemAvailable", b"0 kB").split()[0])
+    return (total - available) * 1024
+
+
+class GpuSource(ABC):
+    """A source of GPU metrics, sampled along with the process tree.
+
+    Subclasses collect the utilisation and the memory usage of each GPU in the
+    background, and `read` returns what was collected since its last call.
+
+    """
+
+    @abstractmethod
+    def read(self) -> Dict[str, Tuple[float, float, float]]:
+        """Get the metrics collected since the last call.
+
+        Returns:
+            The mean utilisation, mean memory usage and peak memory usage of
+            each GPU (in percentage), indexed by GPU index.
+
+        """
+
+    def close(self) -> None:
+        """Stop collecting metrics."""
+
+
+class NvidiaSmiStream(GpuSource):
+    """GPU metrics streamed by a single long-lived `nvidia-smi -lms` process.
+
+    The CSV lines printed by nvidia-smi are parsed by a background thread into
+    per-GPU series, instead of starting nvidia-smi on every sample.
+
+    Args:
+        interval: Milliseconds between the queries of nvidia-smi.
+        devices: Comma-separated indexes or UUIDs of the GPUs, or None for all of them.
+        executable: Path of nvidia-smi.
+
+    """
+
+    QUERY = "index,utilization.gpu,memory.used,memory.total"
+
+    def __init__(self, interval: int, devices: Optional[str] = None, executable: str = "nvidia-smi"):
+        command = [
+            executable,
+            f"--query-gpu={self.QUERY}",
+            "--format=csv,noheader,nounits",
+            f"--loop-ms={interval}",
+        ]
+        if devices:
+            command.append(f"--id={devices}")
+
+        # samples of each GPU since the last read: utilisation and memory usage
+        self.series: Dict[str, Tuple[List[float], List[float]]] = {}
+        self.lock = threading.Lock()
+
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+        )
+        self.thread = threading.Thread(target=self.parse, daemon=True)
+        self.thread.start()
+
+    def parse(self) -> None:
+        """Parse the output of nvidia-smi until it exits."""
+        assert self.process.stdout is not None
+        for line in self.process.stdout:
+            fields = [x.strip() for x in line.split(",")]
+            if len(fields) != 4:
+                continue
+
+            # some metrics may be reported as [N/A] or [Not Supported]
+            utilization, used, total = (
+                float(x) if x.replace(".", "", 1).isdigit() else None for x in fields[1:]
+            )
+
+            with self.lock:
+                series = self.series.setdefault(fields[0], ([], []))
+                if utilization is not None:
+                    series[0].append(utilization)
+                if used is not None and total:
+                    series[1].append(100 * used / total)
+
+    def read(self) -> Dict[str, Tuple[float, float, float]]:
+        with self.lock:
+            series, self.series = self.series, {}
+
+        return {
+            index: (
+                sum(utilization) / len(utilization) if utilization else 0.0,
+                sum(memory) / len(memory) if memory else 0.0,
+                max(memory, default=0.0),
+            )
+            for index, (utilization, memory) in sorted(series.items())
+        }
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        self.thread.join(timeout=1)
+
+
+def get_gpu_rows(timestamp: str, gpus: Dict[str, Tuple[float, float, float]]) -> List[List[str]]:
+    """Get one row per GPU, with its mean utilisation and its peak memory usage.
+
+    Args:
+        timestamp: Time of the sample.
+        gpus: The metrics of each GPU, see `GpuSource.read`.
+
+    Returns:
+        The rows of the GPUs, see `COLUMNS`.
+
+    """
+    return [
+        [timestamp, f"GPU{index}", "0", "0.00", "0.00", "0.00", "0.00", f"{utilization:.2f}", f"{memory:.2f}"]
+        for index, (utilization, _, memory) in gpus.items()
+    ]
+
+
+class ProcessTreeSampler:
+    """Sample the resource usage of the process tree of a target process.
+
+    The CPU usage and I/O rates are computed from the counters of each
+    process between two samples, so processes are only accounted for from
+    their second sample on.
+
+    Args:
+        target: PID of the root of the process tree.
+        gpus: Source of the metrics of the GPUs of the job, if any.
+
+    """
+
+    def __init__(self, target: int, gpus: Optional[GpuSource] = None):
+        self.target = target
+        self.gpus = gpus
+
+        # counters of the previous sample, indexed by (PID, start time)
+        self.previous: Dict[Tuple[int, int], Tuple[int, int, int]] = {}
+        self.previous_node = read_node_cpu()
+        self.previous_time = time.monotonic()
+
+        # the command names, computed once per process
+        self.names: Dict[Tuple[int, int], str] = {}
+
+    def command_name(self, process: ProcessSample) -> str:
+        """Name a process after its executable or, for Python, after its script."""
+        key = (process.pid, process.start)
+        if key not in self.names:
+            name = process.comm
+            if name.startswith("python"):
+                args = (read_proc_file(f"/proc/{process.pid}/cmdline") or b"").split(b"\0")[1:]
+                for index, arg in enumerate(args):
+                    if arg == b"-c":
+                        break
+                    if arg == b"-m" or not arg.startswith(b"-"):
+                        script = args[index + 1] if arg == b"-m" and index + 1 < len(args) else arg
+                        name = f"{name}/{os.path.basename(script.decode(errors='replace'))}"
+                        break
+            self.names[key] = re.sub(r"[,\s]", "_", name)
+        return self.names[key]
+
+    def sample(self) -> Optional[List[List[str]]]:
+        """Sample the usage of the process tree and of the node.
+
+        Returns:
+            The rows of the sample, see `COLUMNS`, or None if the target died.
+
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.previous_time, 1e-6)
+        timestamp = f"{time.time():.3f}"
+
+        # one pass over /proc, as the tree must be walked from the parent PIDs
+        processes: Dict[int, ProcessSample] = {}
+        children: Dict[int, List[int]] = {}
+        for entry in os.scandir("/proc"):
+            if entry.name.isdigit():
+                process = ProcessSample.read(int(entry.name))
+                if process is not None:
+                    processes[process.pid] = process
+                    children.setdefault(process.ppid, []).append(process.pid)
+
+        if self.target not in processes:
+            return None
+
+        # descendants of the target, ignoring this sampler
+        tree = []
+        pending = [self.target]
+        while pending:
+            pid = pending.pop()
+            if pid != os.getpid():
+                tree.append(processes[pid])
+                pending.extend(children.get(pid, []))
+
+        usage: Dict[str, List[float]] = {}
+        current: Dict[Tuple[int, int], Tuple[int, int, int]] = {}
+        for process in tree:
+            key = (process.pid, process.start)
+            current[key] = (process.cpu_ticks,) + read_io(process.pid)
+            previous = self.previous.get(key, current[key])
+
+            row = usage.setdefault(self.command_name(process), [0, 0.0, 0.0, 0.0, 0.0])
+            row[0] += 1
+            row[1] += 100 * (current[key][0] - previous[0]) / CLOCK_TICKS / elapsed
+            row[2] += process.rss / MB
+            row[3] += (current[key][1] - previous[1]) / MB / elapsed
+            row[4] += (current[key][2] - previous[2]) / MB / elapsed
+
+        self.names = {x: y for x, y in self.names.items() if x in current}
+        self.previous = current
+        self.previous_time = now
+
+        # usage of the whole node
+        node_cpu = read_node_cpu()
+        busy = node_cpu[0] - self.previous_node[0]
+        total = max(node_cpu[1] - self.previous_node[1], 1)
+        self.previous_node = node_cpu
+        gpus = self.gpus.read() if self.gpus is not None else {}
+        gpu_usage = (
+            sum(x[0] for x in gpus.values()) / len(gpus) if gpus else 0.0,
+            sum(x[1] for x in gpus.values()) / len(gpus) if gpus else 0.0,
+        )
+
+        rows = [
+            [
+                timestamp,
+                "NODE",
+                str(len(processes)),
+                f"{100 * os.cpu_count() * busy / total:.2f}",
+                f"{read_node_memory() / MB:.2f}",
+                "0.00",
+                "0.00",
+                f"{gpu_usage[0]:.2f}",
+                f"{gpu_usage[1]:.2f}",
+            ],
+        ]
+
+        totals = [sum(x[i] for x in usage.values()) for i in range(5)]
+        for name, values in [("TOTAL", totals)] + sorted(usage.items()):
+            rows.append(
+                [timestamp, name, str(int(values[0]))]
+                + [f"{x:.2f}" for x in values[1:]]
+                + ["0.00", "0.00"]
+            )
+
+        return rows + get_gpu_rows(timestamp, gpus)
+
+
+def find_cgroups(pid: int, root: str, path: Optional[str] = None) -> Dict[str, str]:
+    """Find the directories of the cgroup of a process, up to its Slurm job.
+
+    The cgroup of a process running in a Slurm job is a step or task of the
+    job, e.g., /system.slice/slurmstepd.scope/job_42/step_batch/user/task_0,
+    so its path is cut after the job to account for the whole job.
+
+    Args:
+        pid: The process ID.
+        root: Mount point of the cgroup filesystem, e.g., /sys/fs/cgroup.
+        path: Path of the cgroup inside of each hierarchy, instead of the
+            path read from `/proc/<pid>/cgroup`.
+
+    Returns:
+        The directory of the cgroup indexed by controller, or by an empty
+        string with cgroup v2.
+
+    """
+
+    def job_path(value: str) -> str:
+        return re.sub(r"(/job_\d+)/.*$", r"\1", value)
+
+    # paths of the cgroup of the process in each hierarchy, indexed by controllers
+    paths: Dict[str, str] = {}
+    for line in (read_proc_file(f"/proc/{pid}/cgroup") or b"").decode().splitlines():
+        _, controllers, value = line.split(":", 2)
+        paths[controllers] = value
+
+    # cgroup v2, i.e., a single hierarchy
+    if os.path.exists(os.path.join(root, "cgroup.controllers")):
+        return {"": os.path.join(root, job_path(path or paths.get("", "/")).lstrip("/"))}
+
+    # cgroup v1, one hierarchy per (set of) controllers, e.g., cpu,cpuacct
+    cgroups = {}
+    for mount in os.listdir(root):
+        for controller in mount.split(","):
+            if controller in ("cpuacct", "memory", "blkio", "pids") and controller not in cgroups:
+                value = path or next((y for x, y in paths.items() if controller in x.split(",")), "/")
+                cgroups[controller] = os.path.join(root, mount, job_path(value).lstrip("/"))
+    return cgroups
+
+
+class CgroupSampler:
+    """Sample the resource usage of a cgroup, e.g., of a Slurm job.
+
+    The counters of the cgroup account for every process of the job, even the
+    short-lived ones, without walking the process tree. Each sample appends
+    a `CGROUP` row with the CPU usage and the I/O rates since the previous
+    sample and the current memory usage, and a `CGROUP_COUNTERS` row with
+    the counters themselves: the CPU time so far in seconds (`usage_usec` of
+    `cpu.stat`, or `cpuacct.usage`) in the CPU_USAGE column, the peak memory
+    usage so far (`memory.peak`, or `memory.max_usage_in_bytes`) in the
+    MEM_USAGE_MB column, and the MB read and written so far in the READ_MB_S
+    and WRITE_MB_S columns. Differencing them gives the exact usage between
+    any two samples.
+
+    Args:
+        target: PID of a process of the cgroup, sampled until it dies.
+        cgroups: The directories of the cgroup, see `find_cgroups`.
+        gpus: Source of the metrics of the GPUs of the job, if any.
+
+    """
+
+    def __init__(self, target: int, cgroups: Dict[str, str], gpus: Optional[GpuSource] = None):
+        self.target = target
+        self.cgroups = cgroups
+        self.gpus = gpus
+        self.peak = 0
+        self.previous = self.read_counters()
+        self.previous_time = time.monotonic()
+
+    def read_value(self, controller: str, filename: str) -> Optional[bytes]:
+        """Read a file of the cgroup, or None if the controller or file is missing."""
+        directory = self.cgroups.get("" if "" in self.cgroups else controller)
+        return None if directory is None else read_proc_file(os.path.join(directory, filename))
+
+    def read_counters(self) -> Tuple[float, int, int]:
+        """Get the CPU time (in seconds) and the bytes read and written by the cgroup so far."""
+        if "" in self.cgroups:
+            stat = dict(
+                line.split() for line in (self.read_value("", "cpu.stat") or b"").splitlines() if line
+            )
+            cpu = int(stat.get(b"usage_usec", 0)) / 1e6
+            io = [
+                dict(x.split(b"=", 1) for x in line.split()[1:] if b"=" in x)
+                for line in (self.read_value("", "io.stat") or b"").splitlines()
+            ]
+            read = sum(int(x.get(b"rbytes", 0)) for x in io)
+            written = sum(int(x.get(b"wbytes", 0)) for x in io)
+        else:
+            cpu = int(self.read_value("cpuacct", "cpuacct.usage") or 0) / 1e9
+            io = [
+                line.split()
+                for line in (self.read_value("blkio", "blkio.throttle.io_service_bytes") or b"").splitlines()
+            ]
+            read = sum(int(x[2]) for x in io if len(x) == 3 and x[1] == b"Read")
+            written = sum(int(x[2]) for x in io if len(x) == 3 and x[1] == b"Write")
+        return cpu, read, written
+
+    def read_memory(self) -> Tuple[int, int]:
+        """Get the current and peak memory usage of the cgroup, in bytes."""
+        if "" in self.cgroups:
+            current = int(self.read_value("", "memory.current") or 0)
+            peak = int(self.read_value("", "memory.peak") or 0)
+        else:
+            current = int(self.read_value("memory", "memory.usage_in_bytes") or 0)
+            peak = int(self.read_value("memory", "memory.max_usage_in_bytes") or 0)
+
+        # memory.peak is only available from Linux 5.19 on
+        self.peak = max(self.peak, peak, current)
+        return current, self.peak
+
+    def sample(self) -> Optional[List[List[str]]]:
+        """Sample the usage of the cgroup.
+
+        Returns:
+            The rows of the sample, see `COLUMNS`, or None if the target died.
+
+        """
+        if not os.path.exists(f"/proc/{self.target}"):
+            return None
+
+        now = time.monotonic()
+        elapsed = max(now - self.previous_time, 1e-6)
+        timestamp = f"{time.time():.3f}"
+
+        counters = self.read_counters()
+        current, peak = self.read_memory()
+        processes = int(self.read_value("pids", "pids.current") or 0)
+        usage = [
+            100 * (counters[0] - self.previous[0]) / elapsed,
+            current / MB,
+            (counters[1] - self.previous[1]) / MB / elapsed,
+            (counters[2] - self.previous[2]) / MB / elapsed,
+        ]
+        self.previous = counters
+        self.previous_time = now
+
+        gpus = self.gpus.read() if self.gpus is not None else {}
+        gpu_usage = (
+            sum(x[0] for x in gpus.values()) / len(gpus) if gpus else 0.0,
+            sum(x[1] for x in gpus.values()) / len(gpus) if gpus else 0.0,
+        )
+
+        rows = [
+            [timestamp, "CGROUP", str(processes)]
+            + [f"{x:.2f}" for x in usage]
+            + [f"{gpu_usage[0]:.2f}", f"{gpu_usage[1]:.2f}"],
+            [
+                timestamp,
+                "CGROUP_COUNTERS",
+                str(processes),
+                f"{counters[0]:.6f}",
+                f"{peak / MB:.2f}",
+                f"{counters[1] / MB:.6f}",
+                f"{counters[2] / MB:.6f}",
+                "0.00",
+                "0.00",
+            ],
+        ]
+        return rows + get_gpu_rows(timestamp, gpus)
+
+
+def find_target(pattern: str, timeout: float = 30) -> Optional[int]:
+    """Find the oldest process of the user whose command line matches a pattern.
+
+    Args:
+        pattern: Regular expression searched in the command lines.
+        timeout: Maximum time to wait for the process to start, in seconds.
+
+    Returns:
+        The PID of the process, or None if none started before the timeout.
+
+    """
+    regex = re.compile(pattern.encode())
+    deadline = time.monotonic() + timeout
+    while True:
+        matches = []
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit() or int(entry.name) == os.getpid():
+                continue
+            try:
+                if entry.stat().st_uid != os.getuid():
+                    continue
+            except OSError:
+                continue
+            cmdline = read_proc_file(f"/proc/{entry.name}/cmdline") or b""
+            if regex.search(cmdline.replace(b"\0", b" ")):
+                process = ProcessSample.read(int(entry.name))
+                if process is not None:
+                    matches.append((process.start, process.pid))
+
+        if matches:
+            return min(matches)[1]
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(1)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Sample the resource usage of a process tree from /proc"
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="PATH", required=True, help="CSV file to append the samples to"
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-p", "--pid", type=int, help="PID of the process to watch")
+    target.add_argument(
+        "-t",
+        "--target",
+        metavar="REGEX",
+        help="Watch the oldest process of the user whose command line matches, "
+        "e.g., 'cactus-preprocess|cactus-blast|cactus-align'",
+    )
+    parser.add_argument(
+        "-i", "--interval", type=float, default=1.0, help="Seconds between samples (default: %(default)s)"
+    )
+    parser.add_argument("-g", "--gpu", action="store_true", help="Sample the GPUs with nvidia-smi as well")
+    parser.add_argument(
+        "--nvidia_smi",
+        metavar="PATH",
+        default="nvidia-smi",
+        help="Path of nvidia-smi (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cgroup",
+        action="store_true",
+        help="Sample the counters of the cgroup of the target (up to its Slurm job) "
+        "instead of its process tree",
+    )
+    parser.add_argument(
+        "--cgroup_root",
+        metavar="PATH",
+        default="/sys/fs/cgroup",
+        help="Mount point of the cgroup filesystem (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cgroup_path",
+        metavar="PATH",
+        help="Path of the cgroup inside of each hierarchy, instead of the one of the target",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Verbose mode")
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = create_argparser().parse_args()
+
+    target_pid = args.pid
+    if args.target is not None:
+        target_pid = find_target(args.target)
+        if target_pid is None:
+            print(f"PID not found for {args.target}, exiting with code 1", file=sys.stderr)
+            sys.exit(1)
+
+    gpu_source: Optional[GpuSource] = None
+    if args.gpu:
+        try:
+            gpu_source = NvidiaSmiStream(
+                interval=max(1, int(args.interval * 1000)),
+                devices=os.environ.get("CUDA_VISIBLE_DEVICES"),
+                executable=args.nvidia_smi,
+            )
+        except OSError as err:
+            print(f"Cannot sample the GPUs: {err}", file=sys.stderr)
+
+    sampler: Union[ProcessTreeSampler, CgroupSampler]
+    if args.cgroup:
+        cgroups = find_cgroups(target_pid, args.cgroup_root, args.cgroup_path)
+        sampler = CgroupSampler(target_pid, cgroups, gpus=gpu_source)
+    else:
+        sampler = ProcessTreeSampler(target_pid, gpus=gpu_source)
+
+    if args.verbose:
+        print(f"TARGET_PID={target_pid}")
+        if args.cgroup:
+            for controller, directory in cgroups.items():
+                print(f"CGROUP={controller or 'v2'}:{directory}")
+
+    # stop sampling, keeping what has been written, when the job ends
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    new_file = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+    with open(args.output, "a", encoding="utf-8") as output:
+        if new_file:
+            output.write(",".join(COLUMNS) + "\n")
+
+        try:
+            while True:
+                time.sleep(args.interval)
+                rows = sampler.sample()
+                if rows is None:
+                    break
+                output.write("".join(",".join(x) + "\n" for x in rows))
+                output.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if gpu_source is not None:
+                gpu_source.close()
+
+    if args.verbose:
+        print(f"{os.path.basename(sys.argv[0])} finalised")
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""This script summarises the usage files written by usage.py for a whole workflow.
+
+Every `<job>.usage.csv` file found is loaded into columnar arrays, one set
+per job and command, instead of sorting and joining CSV files as usage.sh
+does. It then prints one table with a row per job and command, and a
+`*` row per command over the whole workflow:
+    - samples and duration of the samples;
+    - CPU time, mean and 95th percentile CPU usage (100 being one CPU);
+    - peak resident memory;
+    - mean and peak GPU usage, and peak GPU memory usage (NODE and GPU rows).
+
+The CPU time and peak memory of the CGROUP rows are taken from the
+cumulative counters of the cgroup (the CGROUP_COUNTERS rows) by
+differencing them, rather than by integrating the sampled CPU usage.
+
+The samples of the jobs are also aligned on time to find the peak CPU and
+memory usage of the whole workflow at once.
+
+"""
+
+import argparse
+import math
+import os
+import re
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import compress
+from operator import mul, sub
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# rows of usage.py holding cumulative counters, and the rows they belong to
+COUNTERS = {"CGROUP_COUNTERS": "CGROUP"}
+
+# columns of usage.py loaded, by index
+TIMESTAMP, COMMAND, PROCESSES, CPU_USAGE, MEM_USAGE_MB, GPU_USAGE, GPU_MEM_USAGE = 0, 1, 2, 3, 4, 7, 8
+FIELDS = 9
+
+# columns of usage.py loaded as numbers, and the attributes of `UsageSeries` holding them
+NUMBERS = (TIMESTAMP, PROCESSES, CPU_USAGE, MEM_USAGE_MB, GPU_USAGE, GPU_MEM_USAGE)
+SERIES = ("time", "processes", "cpu", "memory", "gpu", "gpu_memory")
+
+# columns of the summary
+COLUMNS = [
+    "job",
+    "command",
+    "samples",
+    "duration",
+    "cpu_seconds",
+    "mean_cpu",
+    "p95_cpu",
+    "peak_mem_mb",
+    "mean_gpu",
+    "peak_gpu",
+    "peak_gpu_mem",
+]
+
+
+@dataclass
+class UsageSeries:
+    """The samples of a command of a job, in columnar arrays.
+
+    Attributes:
+        time: Timestamps, in seconds since the Epoch.
+        processes: Amount of processes.
+        cpu: CPU usage, 100 being one CPU fully used.
+        memory: Resident memory, in MB.
+        gpu: GPU usage, in percentage.
+        gpu_memory: GPU memory usage, in percentage.
+        counters: The cumulative counters sampled along, if any, i.e., the CPU
+            time in seconds in `cpu` and the peak memory in `memory`.
+
+    """
+
+    time: array = field(default_factory=lambda: array("d"))
+    processes: array = field(default_factory=lambda: array("d"))
+    cpu: array = field(default_factory=lambda: array("d"))
+    memory: array = field(default_factory=lambda: array("d"))
+    gpu: array = field(default_factory=lambda: array("d"))
+    gpu_memory: array = field(default_factory=lambda: array("d"))
+    counters: Optional["UsageSeries"] = None
+
+    def extend(self, other: "UsageSeries") -> None:
+        """Append the samples of another series."""
+        for name in SERIES:
+            getattr(self, name).extend(getattr(other, name))
+
+
+def find_usage_files(paths: Iterable[str]) -> List[str]:
+    """Find the usage files of the given files and directories.
+
+    Args:
+        paths: Usage files, or directories searched recursively.
+
+    Returns:
+        Path of each usage file.
+
+    """
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            filenames.extend(os.path.join(root, x) for x in files if x.endswith(".usage.csv"))
+    return sorted(filenames)
+
+
+def read_usage_lines(filename: str) -> Dict[str, UsageSeries]:
+    """Load a usage file written by usage.py line by line, skipping malformed lines.
+
+    Args:
+        filename: Path of the usage file.
+
+    Returns:
+        The samples of each command of the file, including TOTAL and NODE.
+
+    """
+    series: Dict[str, UsageSeries] = {}
+    with open(filename, "r", encoding="utf-8") as usage_file:
+        for line in usage_file:
+            fields = line.rstrip("\n").split(",")
+
+            # header lines, or a line cut short by a killed job
+            if len(fields) != FIELDS or fields[TIMESTAMP] == "TIMESTAMP":
+                continue
+
+            try:
+                values = [float(fields[x]) for x in NUMBERS]
+            except ValueError:
+                print(f"Skipping malformed line of {filename}: {line.strip()}", file=sys.stderr)
+                continue
+
+            samples = series.setdefault(fields[COMMAND], UsageSeries())
+            for name, value in zip(SERIES, values):
+                getattr(samples, name).append(value)
+
+    return series
+
+
+def attach_counters(series: Dict[str, UsageSeries]) -> Dict[str, UsageSeries]:
+    """Move the samples of the counter rows to the `counters` of the rows they belong to."""
+    for name, command in COUNTERS.items():
+        if name in series and command in series:
+            series[command].counters = series.pop(name)
+    return series
+
+
+def read_usage_file(filename: str) -> Dict[str, UsageSeries]:
+    """Load a usage file written by usage.py.
+
+    The whole file is split into fields at once and each column is converted
+    in one pass, falling back to `read_usage_lines` if a line is malformed.
+    The counter rows are attached to their rows, see `attach_counters`.
+
+    Args:
+        filename: Path of the usage file.
+
+    Returns:
+        The samples of each command of the file, including TOTAL and NODE.
+
+    """
+    with open(filename, "r", encoding="utf-8") as usage_file:
+        content = usage_file.read()
+
+    # drop the headers, written once per run of the job, and a line cut short by a killed job
+    content = content[: content.rfind("\n") + 1]
+    if content.startswith("TIMESTAMP,"):
+        content = content.replace(content[: content.index("\n") + 1], "")
+
+    fields = content.replace("\n", ",").split(",")[:-1]
+    if len(fields) % FIELDS != 0:
+        return attach_counters(read_usage_lines(filename))
+
+    try:
+        columns = [array("d", map(float, fields[x::FIELDS])) for x in NUMBERS]
+    except ValueError:
+        return attach_counters(read_usage_lines(filename))
+
+    # spread the rows over the commands
+    commands = fields[COMMAND::FIELDS]
+    series: Dict[str, UsageSeries] = {}
+    for command in dict.fromkeys(commands):
+        mask = list(map(command.__eq__, commands))
+        series[command] = UsageSeries(*(array("d", compress(x, mask)) for x in columns))
+
+    return attach_counters(series)
+
+
+def percentile(values: array, fraction: float) -> float:
+    """Get a percentile of the values, by nearest rank."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def get_duration(time: array) -> float:
+    """Get the time covered by sorted samples, in seconds."""
+    return time[-1] - time[0] if len(time) > 1 else 0.0
+
+
+def get_increase(counter: array) -> float:
+    """Get the increase of a cumulative counter over its samples.
+
+    A counter going down was reset, e.g., by a requeued job running in a new
+    cgroup, so it is counted from zero again.
+
+    """
+    return sum(y - x if y >= x else y for x, y in zip(counter[:-1], counter[1:]))
+
+
+def get_cpu_seconds(samples: UsageSeries) -> float:
+    """Get the CPU time of the samples, in seconds.
+
+    The CPU time is the increase of the CPU time counter if sampled along,
+    otherwise each sample accounts for the CPU usage since the sample
+    before it.
+
+    """
+    if samples.counters is not None:
+        return get_increase(samples.counters.cpu)
+
+    time = samples.time
+    return sum(map(mul, map(sub, time[1:], time[:-1]), samples.cpu[1:])) / 100
+
+
+def get_peak_memory(samples: UsageSeries) -> float:
+    """Get the peak memory of the samples, from the peak memory counter if sampled along."""
+    peak = max(samples.memory, default=0.0)
+    if samples.counters is not None:
+        peak = max(peak, max(samples.counters.memory, default=0.0))
+    return peak
+
+
+def summarise(job: str, command: str, parts: List[UsageSeries]) -> List[str]:
+    """Summarise the samples of a command, see `COLUMNS`.
+
+    Args:
+        job: Name of the job, or `*` for the whole workflow.
+        command: Name of the command.
+        parts: The samples of the command, one series per job.
+
+    Returns:
+        The fields of the row of the command.
+
+    """
+    samples = UsageSeries()
+    for part in parts:
+        samples.extend(part)
+
+    gpu = command == "NODE" or command.startswith("GPU")
+    return [
+        job,
+        command,
+        str(len(samples.time)),
+        str(timedelta(seconds=round(sum(get_duration(x.time) for x in parts)))),
+        f"{sum(get_cpu_seconds(x) for x in parts):.0f}",
+        f"{sum(samples.cpu) / len(samples.cpu):.2f}",
+        f"{percentile(samples.cpu, 0.95):.2f}",
+        f"{max(get_peak_memory(x) for x in parts):.2f}",
+        f"{sum(samples.gpu) / len(samples.gpu):.2f}" if gpu else "",
+        f"{max(samples.gpu):.2f}" if gpu else "",
+        f"{max(samples.gpu_memory):.2f}" if gpu else "",
+    ]
+
+
+def get_workflow_peaks(
+    jobs: Dict[str, Dict[str, UsageSeries]], resolution: float
+) -> Tuple[Optional[float], float, Optional[float], float]:
+    """Align the TOTAL (or CGROUP) samples of the jobs on time to find the peaks of the workflow.
+
+    The samples are spread over bins of `resolution` seconds, keeping the
+    last sample of each job per bin, and the bins are summed over the jobs.
+
+    Args:
+        jobs: The samples of each command of each job.
+        resolution: Width of the time bins, in seconds.
+
+    Returns:
+        The time and value of the peak CPU usage and of the peak memory.
+
+    """
+    totals = [x.get("TOTAL", x.get("CGROUP")) for x in jobs.values()]
+    totals = [x for x in totals if x is not None and x.time]
+    if not totals:
+        return None, 0.0, None, 0.0
+
+    origin = min(x.time[0] for x in totals)
+    size = int((max(x.time[-1] for x in totals) - origin) / resolution) + 1
+    cpu = array("d", bytes(8 * size))
+    memory = array("d", bytes(8 * size))
+
+    for samples in totals:
+        last: Dict[int, int] = {}
+        for index, timestamp in enumerate(samples.time):
+            last[int((timestamp - origin) / resolution)] = index
+        for position, index in last.items():
+            cpu[position] += samples.cpu[index]
+            memory[position] += samples.memory[index]
+
+    peak_cpu = max(range(size), key=cpu.__getitem__)
+    peak_memory = max(range(size), key=memory.__getitem__)
+    return (
+        origin + peak_cpu * resolution,
+        cpu[peak_cpu],
+        origin + peak_memory * resolution,
+        memory[peak_memory],
+    )
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """Create an argparser object to handle the input of the script.
+
+    Returns:
+        An argparser object.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Summarise the usage files written by usage.py for a whole workflow"
+    )
+    parser.add_argument(
+        "paths",
+        metavar="PATH",
+        nargs="+",
+        help="Usage files, or directories searched recursively, e.g., the output directory of cactus_batcher",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=60,
+        help="Seconds over which the samples of the jobs are aligned (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Amount of usage files loaded in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs_only", action="store_true", help="Only print the TOTAL, NODE, GPU and CGROUP rows of each job"
+    )
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = create_argparser().parse_args()
+
+    filenames = find_usage_files(args.paths)
+    if not filenames:
+        print("No usage files found!", file=sys.stderr)
+        sys.exit(1)
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        jobs = {
+            re.sub(r"\.usage\.csv$", "", os.path.basename(filename)): series
+            for filename, series in zip(filenames, pool.map(read_usage_file, filenames))
+        }
+
+    print(";".join(COLUMNS))
+
+    workflow: Dict[str, List[UsageSeries]] = {}
+    for job, commands in jobs.items():
+        for command, samples in commands.items():
+            if not args.jobs_only or command in ("TOTAL", "NODE") or command.startswith(("GPU", "CGROUP")):
+                print(";".join(summarise(job, command, [samples])))
+            workflow.setdefault(command, []).append(samples)
+
+    for command in sorted(workflow, key=lambda x: (x != "NODE", x != "TOTAL", x)):
+        print(";".join(summarise("*", command, workflow[command])))
+
+    peak_cpu_time, peak_cpu, peak_memory_time, peak_memory = get_workflow_peaks(jobs, args.resolution)
+    if peak_cpu_time is not None:
+        peak_cpu_date = datetime.fromtimestamp(round(peak_cpu_time)).isoformat()
+        peak_memory_date = datetime.fromtimestamp(round(peak_memory_time)).isoformat()
+        print(f"Peak CPU usage = {peak_cpu:.2f} at {peak_cpu_date}")
+        print(f"Peak memory = {peak_memory:.2f} MB at {peak_memory_date}")
@@ -0,0 +1,10 @@
+"""Make the scripts of bin importable by the tests, as they import each other."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
+
+# cactus_batcher refuses to be imported without the singularity images
+os.environ.setdefault("CACTUS_IMAGE", "cactus.sif")
+os.environ.setdefault("CACTUS_GPU_IMAGE", "cactus-gpu.sif")
@@ -0,0 +1,59 @@
+"""Tests of the cache of assembly_ingest.py, run as a script."""
+
+import json
+import os
+import subprocess
+import sys
+
+import assembly_ingest
+
+SCRIPT = os.path.abspath(assembly_ingest.__file__)
+
+
+def ingest(tmp_path, *arguments):
+    command = [sys.executable, SCRIPT, "--processes", "1", "--cache", str(tmp_path / "cache.json")]
+    command += arguments
+    return subprocess.run(command, check=True, capture_output=True, text=True, cwd=tmp_path).stdout
+
+
+def test_changed_input_is_ingested_again(tmp_path):
+    (tmp_path / "in").mkdir()
+    assembly = tmp_path / "in" / "genome.fa"
+    assembly.write_text(">a desc\nACGT\n")
+    ingest(tmp_path, str(assembly), "--output_dir", "out")
+
+    # the output is unchanged, but not the input it was written from
+    assembly.write_text(">a desc\nACGTAA\n")
+    ingest(tmp_path, str(assembly), "--output_dir", "out")
+
+    assert (tmp_path / "out" / "genome.fa").read_text() == ">a\nACGTAA\n"
+    entry = json.loads((tmp_path / "cache.json").read_text())[str(tmp_path / "out" / "genome.fa")]
+    assert entry["input"]["path"] == str(assembly)
+    assert entry["stats"]["length"] == 6
+
+
+def test_input_compressed_in_place_is_skipped(tmp_path):
+    assembly = tmp_path / "genome.fa"
+    assembly.write_text(">a desc\nACGT\n")
+    ingest(tmp_path, str(assembly), "--bgzip")
+    assert sorted(os.listdir(tmp_path)) == [
+        "cache.json",
+        "genome.fa.gz",
+        "genome.fa.gz.fai",
+        "genome.fa.gz.gzi",
+    ]
+
+    compressed = tmp_path / "genome.fa.gz"
+    mtime = compressed.stat().st_mtime_ns
+    output = ingest(tmp_path, "--assemblies_dirs", str(tmp_path))
+    assert output.splitlines()[1].endswith(";1;5f76802474aa90b1515c820bf8a6b773;{}".format(compressed))
+    assert compressed.stat().st_mtime_ns == mtime
+
+
+def test_mapping_quotes_tabs(tmp_path):
+    assembly = tmp_path / "genome.fa"
+    assembly.write_text(">a\tx\nACGT\n")
+
+    ingest(tmp_path, str(assembly), "--mapping", "mapping.tsv")
+
+    assert (tmp_path / "mapping.tsv").read_text() == f'{assembly}\t"a\tx"\ta\n'
@@ -0,0 +1,75 @@
+"""Tests of the job scripts generated by cactus_batcher.py."""
+
+import subprocess
+
+import pytest
+
+import cactus_batcher
+import cactus_batcher_trace
+
+
+def run_steps(tmp_path, steps, concurrent):
+    """Run the content of a job wrapping several steps, returning its exit code."""
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    script = tmp_path / "job.sh"
+    script.write_text(
+        cactus_batcher.get_wrapped_steps(
+            job_name="fused", log_dir=str(log_dir), steps=steps, concurrent=concurrent
+        )
+    )
+    return subprocess.run(["bash", str(script)], cwd=tmp_path, check=False).returncode
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_wrapped_hal2fasta_step_writes_its_fasta(tmp_path, concurrent):
+    steps = [
+        ("cactus-align-Anc0", "echo aligned"),
+        ("hal2fasta-Anc0", "printf '>Anc0\\nACGT\\n' > Anc0.fa; echo exported >&2"),
+    ]
+
+    assert run_steps(tmp_path, steps, concurrent) == 0
+    assert (tmp_path / "Anc0.fa").read_text() == ">Anc0\nACGT\n"
+    assert (tmp_path / "logs" / "hal2fasta-Anc0-local.out").read_text() == ""
+    assert (tmp_path / "logs" / "hal2fasta-Anc0-local.err").read_text() == "exported\n"
+    assert (tmp_path / "logs" / "cactus-align-Anc0-local.out").read_text() == "aligned\n"
+    assert sorted((tmp_path / "logs" / "fused-local.steps").read_text().splitlines()) == [
+        "cactus-align-Anc0 0",
+        "hal2fasta-Anc0 0",
+    ]
+
+
+def test_wrapped_steps_stop_at_first_failure(tmp_path):
+    steps = [
+        ("cactus-align-Anc0", "false"),
+        ("hal2fasta-Anc0", "printf '>Anc0\\n' > Anc0.fa"),
+    ]
+
+    assert run_steps(tmp_path, steps, concurrent=False) != 0
+    assert not (tmp_path / "Anc0.fa").exists()
+    assert (tmp_path / "logs" / "fused-local.steps").read_text().splitlines() == [
+        "cactus-align-Anc0 1",
+        "hal2fasta-Anc0 skipped",
+    ]
+
+
+def test_lifecycle_record_with_comma_decimal_times(tmp_path):
+    command = cactus_batcher.get_lifecycle_record(
+        job_name="cactus-blast-Anc0",
+        log_dir=str(tmp_path),
+        round_name="alignments-0",
+        variables=["CACTUS_BLAST_ANC0"],
+        dependencies=[],
+        partition="standard",
+    )
+    # $EPOCHREALTIME as printed by bash in a locale with a decimal comma
+    script = "\n".join(
+        ["LIFECYCLE_START=1700000000,250000", "LIFECYCLE_END=1700000010,750000", "STATUS=0", command]
+    )
+    subprocess.run(["bash", "-c", script], check=True, env={"PATH": "/usr/bin:/bin"})
+
+    attempts = cactus_batcher_trace.read_attempts([str(tmp_path / "cactus-blast-Anc0.lifecycle")])
+    assert len(attempts) == 1
+    assert attempts[0].submit is None
+    assert attempts[0].start == 1700000000.25
+    assert attempts[0].runtime == 10.5
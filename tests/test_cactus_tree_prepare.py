@@ -0,0 +1,53 @@
+"""Tests of the matching of tree leaves to FASTA files of cactus_tree_prepare.py."""
+
+import io
+
+import pytest
+
+Phylo = pytest.importorskip("Bio.Phylo")
+
+import cactus_tree_prepare  # pylint: disable=wrong-import-position
+
+
+def test_compressed_assemblies_are_found(tmp_path):
+    filenames = ["Homo_sapiens.fa.gz", "Homo_sapiens.fa.gz.fai", "Homo_sapiens.fa.gz.gzi", "Mus_musculus.fa"]
+    for filename in filenames:
+        (tmp_path / filename).write_text("")
+
+    content = cactus_tree_prepare.assemblies_parser([str(tmp_path)], ".fa")
+
+    assert content == {
+        "homosapiensfa": {"path": f"{tmp_path}/Homo_sapiens.fa.gz", "name": "Homo_sapiens", "used": False},
+        "musmusculusfa": {"path": f"{tmp_path}/Mus_musculus.fa", "name": "Mus_musculus", "used": False},
+    }
+
+
+def test_leaves_sharing_a_fasta_file_are_ambiguous(tmp_path):
+    for filename in ["Homo_sapiens.fa", "Mus_musculus.fa"]:
+        (tmp_path / filename).write_text("")
+    content = cactus_tree_prepare.assemblies_parser([str(tmp_path)], ".fa")
+    tree = Phylo.read(io.StringIO("((homo_sapiens:1,HomoSapiens:1):1,mus_musculus:2);"), "newick")
+
+    unused, ambiguous = cactus_tree_prepare.create_new_tree(
+        {"tree": tree, "path": str(tmp_path / "tree.nwk")}, content, "newick", ".fa"
+    )
+
+    path = f"{tmp_path}/Homo_sapiens.fa"
+    assert ambiguous == {"homo_sapiens": [path], "HomoSapiens": [path]}
+    assert [x.name for x in tree.get_terminals()] == ["homo_sapiens", "HomoSapiens", "Mus_musculus"]
+    assert [x["name"] for x in unused] == ["Homo_sapiens"]
+
+
+def test_leaf_named_after_a_fasta_file_claims_it(tmp_path):
+    for filename in ["Homo_sapiens.fa", "Mus_musculus.fa"]:
+        (tmp_path / filename).write_text("")
+    content = cactus_tree_prepare.assemblies_parser([str(tmp_path)], ".fa")
+    tree = Phylo.read(io.StringIO("((Homo_sapiens:1,sapiens:1):1,mus_musculus:2);"), "newick")
+
+    unused, ambiguous = cactus_tree_prepare.create_new_tree(
+        {"tree": tree, "path": str(tmp_path / "tree.nwk")}, content, "newick", ".fa"
+    )
+
+    assert ambiguous == {"sapiens": [f"{tmp_path}/Homo_sapiens.fa"]}
+    assert [x.name for x in tree.get_terminals()] == ["Homo_sapiens", "sapiens", "Mus_musculus"]
+    assert not unused
@@ -0,0 +1,71 @@
+"""Tests of fasta-header-fixer.py and of the header fixing it shares with assembly_ingest.py."""
+
+import csv
+import gzip
+import os
+import subprocess
+import sys
+
+import fasta_len
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(fasta_len.__file__)), "fasta-header-fixer.py")
+
+
+def write_bgzip(path, data):
+    with open(path, "wb") as handle:
+        writer = fasta_len.BgzfWriter(handle)
+        writer.write(data)
+        writer.close()
+
+
+def run_fixer(*arguments):
+    command = [sys.executable, SCRIPT, "--processes", "1", *map(str, arguments)]
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+
+def test_crlf_headers_keep_their_line_ending(tmp_path):
+    clean = tmp_path / "clean.fa"
+    clean.write_bytes(b">a\r\nACGT\r\n>b\r\nAC\r\n")
+    dirty = tmp_path / "dirty.fa"
+    dirty.write_bytes(b">a desc\r\nACGT\r\n>b\r\nAC\r\n")
+    mapping = tmp_path / "mapping.tsv"
+
+    output = run_fixer(clean, dirty, "--mapping", mapping)
+
+    assert f"{clean}: headers already clean" in output
+    assert dirty.read_bytes() == b">a\r\nACGT\r\n>b\r\nAC\r\n"
+    # no row for the header whose only change would be its carriage return
+    assert mapping.read_text() == f"{dirty}\ta desc\ta\n"
+
+
+def test_bgzip_file_stays_bgzip_with_fresh_indexes(tmp_path):
+    path = tmp_path / "genome.fa.gz"
+    write_bgzip(path, b">a desc\nACGT\nAC\n>b\nNNNN\n")
+    fasta_len.get_records(str(path), index=True)
+
+    run_fixer(path)
+
+    assert fasta_len.is_bgzip(str(path))
+    assert gzip.decompress(path.read_bytes()) == b">a\nACGT\nAC\n>b\nNNNN\n"
+    assert (tmp_path / "genome.fa.gz.fai").read_text() == "a\t6\t3\t4\t5\nb\t4\t14\t4\t5\n"
+    assert (tmp_path / "genome.fa.gz.gzi").exists()
+
+
+def test_ingest_keeps_crlf_headers():
+    changes = []
+    # shared by both scripts
+    fixed = b"".join(fasta_len.fix_headers([b">a desc\r\nAC", b"GT\r\n>b\r", b"\nAC\r\n"], changes))
+    assert fixed == b">a\r\nACGT\r\n>b\r\nAC\r\n"
+    assert changes == [("a desc", "a")]
+
+
+def test_mapping_quotes_tabs(tmp_path):
+    path = tmp_path / "p.fa"
+    path.write_bytes(b">a\nAC\n>b\tx\nGT\n")
+    mapping = tmp_path / "mapping.tsv"
+
+    run_fixer(path, "--mapping", mapping)
+
+    assert mapping.read_text() == f'{path}\t"b\tx"\tb\n'
+    with open(mapping, newline="") as mapping_file:
+        assert list(csv.reader(mapping_file, delimiter="\t")) == [[str(path), "b\tx", "b"]]
@@ -0,0 +1,106 @@
+"""Regression tests of the FASTA scanner of fasta_len.py against the rules of samtools faidx."""
+
+import random
+
+import pytest
+
+import fasta_len
+
+
+def reference_records(data):
+    """Index a FASTA file line by line, as samtools faidx does.
+
+    Every sequence line but the last one of a record must have the bases and
+    width of the first one, and the last one may not have more bases.
+
+    Returns:
+        The name, length, offset, line bases, line width and validity of each record.
+
+    """
+    records = []
+    offset = 0
+    lines = data.split(b"\n")
+    # no line after the last line feed
+    if not lines[-1]:
+        lines.pop()
+    for line in lines:
+        if line.startswith(b">"):
+            # a header ending the file has no line feed
+            records.append((line[1:].rstrip(b"\r").decode(), min(offset + len(line) + 1, len(data)), []))
+        elif records:
+            # width as if the line had a line feed, carriage returns not being bases
+            records[-1][2].append((len(line) - line.count(b"\r"), len(line) + 1))
+        offset += len(line) + 1
+
+    results = []
+    for name, start, sequence in records:
+        # blank lines ending a record are not its last line
+        while len(sequence) > 1 and not sequence[-1][0]:
+            sequence.pop()
+        line_bases, line_width = sequence[0] if sequence else (0, 0)
+        valid = all(x == sequence[0] for x in sequence[:-1])
+        valid = valid and (not sequence or sequence[-1][0] <= line_bases)
+        results.append((name, sum(x[0] for x in sequence), start, line_bases, line_width, valid))
+    return results
+
+
+def scan(data, block_size):
+    blocks = [data[i : i + block_size] for i in range(0, len(data), block_size)]
+    return [tuple(x[:6]) for x in fasta_len.scan_fasta(blocks)]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b">a\nACGT\nAC\n",
+        b">a\nACGT\nAC",
+        b">a desc\r\nACGT\r\nAC\r\n",
+        b">a\r\nACGT\r\nAC\r",
+        b">a\nACGT\r",
+        b">a\nAC\nGT\r",
+        b">a\nACGT\nACGTA\n",
+        b">a\nAC\nACGT\nAC\n",
+        b">a\n\n>b\nAC\n",
+        b">a\r\nACGT\r\n\r\n>b",
+        b"ignored\n>a\nACGT\n>b\n",
+    ],
+)
+def test_scan_fasta_cases(data):
+    expected = reference_records(data)
+    for block_size in range(1, len(data) + 1):
+        assert scan(data, block_size) == expected, block_size
+
+
+def test_scan_fasta_ending_with_a_carriage_return():
+    # a CRLF file whose last line feed was lost
+    assert scan(b">a\r\nACGT\r\nAC\r", 1 << 20) == [("a", 6, 4, 4, 6, True)]
+    assert scan(b">a\nACGT\r", 1 << 20) == [("a", 4, 3, 4, 6, True)]
+
+
+def test_scan_fasta_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        end_of_line = rng.choice([b"\n", b"\r\n"])
+        data = b""
+        for index in range(rng.randint(1, 4)):
+            width = rng.randint(1, 7)
+            sequence = bytes(rng.choice(b"ACGTNacgtn") for _ in range(rng.randint(0, 30)))
+            data += b">s%d desc" % index + end_of_line
+            data += b"".join(sequence[x : x + width] + end_of_line for x in range(0, len(sequence), width))
+
+        # a file may lack its last line feed, or its whole last end of line
+        data = data[: len(data) - rng.choice([0, 0, 1, len(end_of_line)])]
+        assert scan(data, rng.randint(1, 16)) == reference_records(data), data
+
+
+def test_index_and_read_fai(tmp_path):
+    data = b">a desc\r\nACGT\r\nAC\r\n>b\r\nNNNN\r"
+    path = tmp_path / "genome.fa"
+    path.write_bytes(data)
+
+    records = fasta_len.get_records(str(path), index=True)
+    fai = (tmp_path / "genome.fa.fai").read_text()
+    assert fai == "a\t6\t9\t4\t6\nb\t4\t23\t4\t6\n"
+    # the index is read back instead of the file
+    indexed = fasta_len.get_records(str(path))
+    assert [(x.name, *x[1:5]) for x in indexed] == [(x.name, *x[1:5]) for x in records]
@@ -0,0 +1,26 @@
+"""Tests of log-extracter.py, run as a script."""
+
+import gzip
+import os
+import subprocess
+import sys
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "log-extracter.py")
+
+LOG = '[2024-01-01T10:00:08+0000] Successfully ran: "blast" kind-blast/instance-1 in 8 seconds\n'
+
+
+def test_directory_only_yields_logs(tmp_path):
+    # a cactus_batcher logs directory: Toil writes its --logFile to stderr too
+    (tmp_path / "cactus-blast-Anc0.log").write_text(LOG)
+    (tmp_path / "cactus-blast-Anc0-42.err").write_text(LOG)
+    (tmp_path / "cactus-blast-Anc0-42.out").write_text(LOG)
+    (tmp_path / "cactus-blast-Anc0.lifecycle").write_text("{}\n")
+    (tmp_path / "cactus-blast-Anc0.usage.csv").write_text("timestamp\n")
+    (tmp_path / "round").mkdir()
+    (tmp_path / "round" / "cactus-blast-Anc1.log.gz").write_bytes(gzip.compress(LOG.encode()))
+
+    command = [sys.executable, SCRIPT, "--processes", "1", str(tmp_path)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+    assert output.splitlines() == ["blast;2;8.00;0.00", "Runtime = 16.0 seconds or 0:00:16"]
@@ -0,0 +1,128 @@
+"""Tests of the samplers of usage.py, against a fake nvidia-smi and fake cgroup trees."""
+
+import pytest
+
+import usage
+import usage_report
+
+FAKE_NVIDIA_SMI = """#!/bin/sh
+echo "$@" > "$(dirname "$0")/arguments"
+printf '0, 40, 1000, 4000\\n1, [N/A], 2000, 4000\\n'
+printf '0, 60, 3000, 4000\\n1, [N/A], [N/A], 4000\\n'
+printf 'garbage\\n'
+"""
+
+
+@pytest.fixture
+def fake_nvidia_smi(tmp_path, monkeypatch):
+    """Put a fake nvidia-smi printing two samples of two GPUs first in PATH."""
+    executable = tmp_path / "nvidia-smi"
+    executable.write_text(FAKE_NVIDIA_SMI)
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:/usr/bin:/bin")
+    return tmp_path
+
+
+def test_gpu_source_is_abstract():
+    with pytest.raises(TypeError):
+        usage.GpuSource()  # pylint: disable=abstract-class-instantiated
+
+
+def test_nvidia_smi_stream(fake_nvidia_smi):
+    stream = usage.NvidiaSmiStream(interval=250, devices="0,1")
+    stream.process.wait(timeout=10)
+    stream.thread.join(timeout=10)
+
+    assert stream.read() == {"0": (50.0, 50.0, 75.0), "1": (0.0, 50.0, 50.0)}
+    assert stream.read() == {}
+    stream.close()
+
+    arguments = (fake_nvidia_smi / "arguments").read_text().split()
+    assert "--loop-ms=250" in arguments
+    assert "--id=0,1" in arguments
+    assert "--format=csv,noheader,nounits" in arguments
+
+
+def test_gpu_rows():
+    rows = usage.get_gpu_rows("1.000", {"0": (50.0, 50.0, 75.0)})
+    assert rows == [["1.000", "GPU0", "0", "0.00", "0.00", "0.00", "0.00", "50.00", "75.00"]]
+    assert len(rows[0]) == len(usage.COLUMNS)
+
+
+JOB = "system.slice/slurmstepd.scope/job_42"
+TASK = f"/{JOB}/step_batch/user/task_0"
+
+
+def write_files(directory, files):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, content in files.items():
+        (directory / name).write_text(content)
+
+
+def make_cgroup_v2(root, cpu_usec, current, peak, rbytes, wbytes):
+    (root / "cgroup.controllers").write_text("cpu io memory pids\n")
+    write_files(
+        root / JOB,
+        {
+            "cpu.stat": f"usage_usec {cpu_usec}\nuser_usec 0\nsystem_usec 0\n",
+            "memory.current": f"{current}\n",
+            "memory.peak": f"{peak}\n",
+            "io.stat": f"8:0 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1\n",
+            "pids.current": "3\n",
+        },
+    )
+
+
+def make_cgroup_v1(root, cpu_usec, current, peak, rbytes, wbytes):
+    write_files(root / "cpu,cpuacct" / JOB, {"cpuacct.usage": f"{cpu_usec * 1000}\n"})
+    write_files(
+        root / "memory" / JOB,
+        {"memory.usage_in_bytes": f"{current}\n", "memory.max_usage_in_bytes": f"{peak}\n"},
+    )
+    write_files(
+        root / "blkio" / JOB,
+        {"blkio.throttle.io_service_bytes": f"8:0 Read {rbytes}\n8:0 Write {wbytes}\n8:0 Total 0\n"},
+    )
+    write_files(root / "pids" / JOB, {"pids.current": "3\n"})
+
+
+@pytest.mark.parametrize("make_cgroup", [make_cgroup_v2, make_cgroup_v1])
+def test_cgroup_sampler(tmp_path, monkeypatch, make_cgroup):
+    mb = usage.MB
+    make_cgroup(tmp_path, cpu_usec=1_000_000, current=mb, peak=2 * mb, rbytes=0, wbytes=0)
+    cgroups = usage.find_cgroups(0, str(tmp_path), path=TASK)
+    assert all(x.endswith(JOB) for x in cgroups.values())
+
+    clock = iter([100.0, 102.0])
+    monkeypatch.setattr(usage.time, "monotonic", lambda: next(clock))
+    sampler = usage.CgroupSampler(usage.os.getpid(), cgroups)
+
+    # 3 CPU seconds and 4 MB read in 2 seconds
+    make_cgroup(tmp_path, cpu_usec=4_000_000, current=3 * mb, peak=5 * mb, rbytes=4 * mb, wbytes=2 * mb)
+    rows = sampler.sample()
+
+    assert [x[1] for x in rows] == ["CGROUP", "CGROUP_COUNTERS"]
+    assert rows[0][2:7] == ["3", "150.00", "3.00", "2.00", "1.00"]
+    assert rows[1][2:7] == ["3", "4.000000", "5.00", "4.000000", "2.000000"]
+    assert all(len(x) == len(usage.COLUMNS) for x in rows)
+
+
+def test_report_differences_cgroup_counters(tmp_path):
+    # the job was requeued after 2 samples, in a new cgroup whose counters start again
+    lines = [",".join(usage.COLUMNS)]
+    for timestamp, cpu, counter, peak in [
+        (10, 100.0, 5.0, 100.0),
+        (11, 100.0, 6.0, 300.0),
+        (20, 100.0, 0.5, 50.0),
+        (21, 200.0, 2.5, 80.0),
+    ]:
+        lines.append(f"{timestamp},CGROUP,1,{cpu},40.00,0.00,0.00,0.00,0.00")
+        lines.append(f"{timestamp},CGROUP_COUNTERS,1,{counter},{peak},0.00,0.00,0.00,0.00")
+    usage_file = tmp_path / "job.usage.csv"
+    usage_file.write_text("\n".join(lines) + "\n")
+
+    series = usage_report.read_usage_file(str(usage_file))
+    assert list(series) == ["CGROUP"]
+    assert usage_report.get_cpu_seconds(series["CGROUP"]) == 3.5
+    row = usage_report.summarise("job", "CGROUP", [series["CGROUP"]])
+    assert row[usage_report.COLUMNS.index("peak_mem_mb")] == "300.00"